@@ -0,0 +1,383 @@
+import json
+import queue
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime
+
+
+class RingWindow:
+    """Time window over a fixed-size ring of (timestamp, value) samples
+
+    Samples older than span seconds are dropped as new ones arrive, and the
+    oldest sample is overwritten once the ring is full, so memory stays
+    fixed. The running sum makes count/sum/rate O(1).
+    """
+    __slots__ = ('span', 'capacity', 'times', 'values', 'head', 'count', 'total')
+
+    def __init__(self, span, capacity=256):
+        self.span = span
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.head = 0
+        self.count = 0
+        self.total = 0.0
+
+    def _pop(self):
+        self.total -= self.values[self.head]
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+
+    def expire(self, timestamp):
+        horizon = timestamp - self.span
+        while self.count and self.times[self.head] < horizon:
+            self._pop()
+
+    def append(self, timestamp, value=1.0):
+        self.expire(timestamp)
+        if self.count == self.capacity:
+            self._pop()
+        index = (self.head + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+        self.total += value
+
+    def oldest(self):
+        return self.times[self.head], self.values[self.head]
+
+    def newest(self):
+        index = (self.head + self.count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def rate(self):
+        """Samples per second over the window"""
+        return self.count / self.span
+
+
+class Alert:
+    """One rule firing for one session"""
+
+    def __init__(self, rule, session, timestamp, value, message):
+        self.rule = rule.name
+        self.severity = rule.severity
+        self.session = session
+        self.timestamp = timestamp
+        self.value = value
+        self.message = message
+
+    def to_dict(self):
+        return {'time': datetime.fromtimestamp(self.timestamp).isoformat(timespec='milliseconds'),
+                'rule': self.rule, 'severity': self.severity, 'session': self.session,
+                'value': self.value, 'message': self.message}
+
+    def __str__(self):
+        stamp = datetime.fromtimestamp(self.timestamp).strftime("%H:%M:%S.%f")[:-3]
+        return f"[{stamp}] ALERT {self.severity.upper()} {self.rule} ({self.session}): {self.message}"
+
+
+class Rule(ABC):
+    """Base class: a condition over one metric stream, evaluated per session
+
+    Subclasses implement evaluate(), and new_state() when they keep state.
+    Rules that also fire on the absence of events override idle().
+    """
+    severity = "warning"
+
+    def __init__(self, name, metric, severity=None):
+        self.name = name
+        self.metric = metric
+        if severity is not None:
+            self.severity = severity
+
+    def new_state(self):
+        """Fresh per-session state passed to evaluate() and idle()"""
+        return None
+
+    @abstractmethod
+    def evaluate(self, state, timestamp, value):
+        """Update state with one event of the metric; return a message to fire, or None"""
+
+    def idle(self, state, timestamp):
+        """Called on engine ticks between events"""
+        return None
+
+
+class SustainedAbove(Rule):
+    """Value above threshold for at least duration seconds (once per episode)"""
+
+    def __init__(self, name, metric, threshold, duration, severity=None):
+        super().__init__(name, metric, severity)
+        self.threshold = threshold
+        self.duration = duration
+
+    def new_state(self):
+        # [time the value went above threshold, already fired]
+        return [None, False]
+
+    def evaluate(self, state, timestamp, value):
+        if value <= self.threshold:
+            state[0] = None
+            state[1] = False
+            return None
+        if state[0] is None:
+            state[0] = timestamp
+        if not state[1] and timestamp - state[0] >= self.duration:
+            state[1] = True
+            return (f"{self.metric} {value:g} above {self.threshold:g} "
+                    f"for {timestamp - state[0]:.1f}s")
+        return None
+
+
+class DropRate(Rule):
+    """Value falling faster than limit per second over a window"""
+
+    def __init__(self, name, metric, limit, window, capacity=64, severity=None):
+        super().__init__(name, metric, severity)
+        self.limit = limit
+        self.window = window
+        self.capacity = capacity
+
+    def new_state(self):
+        return RingWindow(self.window, self.capacity)
+
+    def evaluate(self, state, timestamp, value):
+        state.append(timestamp, value)
+        first_time, first_value = state.oldest()
+        elapsed = timestamp - first_time
+        if elapsed <= 0:
+            return None
+        drop = (first_value - value) / elapsed
+        if drop >= self.limit:
+            return f"{self.metric} falling {drop:.0f}/s ({first_value:g} -> {value:g} in {elapsed:.1f}s)"
+        return None
+
+
+class RateAbove(Rule):
+    """More than limit events per second over a window"""
+
+    def __init__(self, name, metric, limit, window=1.0, capacity=None, severity=None):
+        super().__init__(name, metric, severity)
+        self.limit = limit
+        self.window = window
+        # Enough room to see the limit being crossed
+        self.capacity = capacity or int(limit * window * 2) + 1
+
+    def new_state(self):
+        return RingWindow(self.window, self.capacity)
+
+    def evaluate(self, state, timestamp, value):
+        state.append(timestamp, value)
+        rate = state.rate()
+        if rate > self.limit:
+            return f"{self.metric} rate {rate:.0f}/s above {self.limit:g}/s"
+        return None
+
+
+class EveryEvent(Rule):
+    """Fires on every event of the metric, e.g. unknown packet ids"""
+
+    def __init__(self, name, metric, template="{metric} {value}", severity=None):
+        super().__init__(name, metric, severity)
+        self.template = template
+
+    def evaluate(self, state, timestamp, value):
+        return self.template.format(metric=self.metric, value=value)
+
+
+class GapAbove(Rule):
+    """No event of the metric for more than max_gap seconds, e.g. missing pings"""
+
+    def __init__(self, name, metric, max_gap, severity=None):
+        super().__init__(name, metric, severity)
+        self.max_gap = max_gap
+
+    def new_state(self):
+        # [last event time, already fired for this gap]
+        return [None, False]
+
+    def evaluate(self, state, timestamp, value):
+        message = None
+        if state[0] is not None and not state[1] and timestamp - state[0] > self.max_gap:
+            message = f"{self.metric} gap of {timestamp - state[0]:.1f}s"
+        state[0] = timestamp
+        state[1] = False
+        return message
+
+    def idle(self, state, timestamp):
+        if state[0] is not None and not state[1] and timestamp - state[0] > self.max_gap:
+            state[1] = True
+            return f"no {self.metric} for {timestamp - state[0]:.1f}s"
+        return None
+
+
+def default_rules():
+    """Rules for desync, HP loss, packet-rate spikes, unknown ids, ping gaps and latency"""
+    return [
+        SustainedAbove("desync", "desync", threshold=8, duration=3.0),
+        DropRate("hp_drop", "hp", limit=200, window=2.0),
+        RateAbove("packet_spike", "packet", limit=500, window=1.0),
+        EveryEvent("unknown_packet", "unknown_packet", "unknown packet id 0x{value:02X}",
+                   severity="info"),
+        GapAbove("ping_gap", "ping", max_gap=15.0, severity="critical"),
+        SustainedAbove("high_latency", "latency", threshold=0.25, duration=10.0),
+    ]
+
+
+class FileSink:
+    """Append alerts as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', buffering=1)
+
+    def __call__(self, alert):
+        self.file.write(json.dumps(alert.to_dict()) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class WebhookSink:
+    """POST alerts as JSON from a background thread
+
+    A bounded queue decouples the hot path from the network; alerts that do
+    not fit are counted in dropped instead of blocking.
+    """
+
+    def __init__(self, url="http://127.0.0.1:8080/alerts", queue_size=1000, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._post_loop, daemon=True)
+        self.thread.start()
+
+    def __call__(self, alert):
+        try:
+            self.queue.put_nowait(alert.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _post_loop(self):
+        while True:
+            payload = self.queue.get()
+            if payload is None:
+                break
+            request = urllib.request.Request(self.url, data=json.dumps(payload).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError:
+                self.failed += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(self.timeout)
+
+
+class AlertEngine:
+    """Streaming rules over per-session metric events
+
+    observe(session, metric, timestamp, value) runs only the rules bound to
+    that metric, against state kept per session and rule. Fired alerts go
+    to every sink (any callable taking an Alert), subject to a per rule and
+    session cooldown. Rules that override idle(), such as ping gaps, are
+    checked on ticks, driven by event time so replays behave like live
+    captures. forget() drops a session in O(1).
+    """
+
+    def __init__(self, rules=None, sinks=(), cooldown=30.0, tick_interval=1.0, history=100):
+        self.rules = list(rules) if rules is not None else default_rules()
+        self.sinks = list(sinks)
+        self.cooldown = cooldown
+        self.tick_interval = tick_interval
+        self.by_metric = {}
+        for rule in self.rules:
+            self.by_metric.setdefault(rule.metric, []).append(rule)
+        self.idle_rules = [rule for rule in self.rules if type(rule).idle is not Rule.idle]
+        # {session: {rule: state}} and {session: {rule: last fired time}}
+        self.states = {}
+        self.last_fired = {}
+        self.last_tick = 0.0
+        self.recent = []
+        self.history = history
+        self.fired = 0
+        self.suppressed = 0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def observe(self, session, metric, timestamp, value=1.0):
+        rules = self.by_metric.get(metric)
+        if rules:
+            states = self.states.get(session)
+            if states is None:
+                states = self.states[session] = {}
+            for rule in rules:
+                state = states.get(rule)
+                if state is None and rule not in states:
+                    state = states[rule] = rule.new_state()
+                message = rule.evaluate(state, timestamp, value)
+                if message is not None:
+                    self.fire(rule, session, timestamp, value, message)
+        if timestamp - self.last_tick >= self.tick_interval:
+            self.tick(timestamp)
+
+    def tick(self, timestamp=None):
+        """Check rules that fire on the absence of events"""
+        timestamp = time.time() if timestamp is None else timestamp
+        self.last_tick = timestamp
+        idle_rules = self.idle_rules
+        if not idle_rules:
+            return
+        for session, states in list(self.states.items()):
+            for rule in idle_rules:
+                if rule in states:
+                    message = rule.idle(states[rule], timestamp)
+                    if message is not None:
+                        self.fire(rule, session, timestamp, None, message)
+
+    def fire(self, rule, session, timestamp, value, message):
+        last_fired = self.last_fired.get(session)
+        if last_fired is None:
+            last_fired = self.last_fired[session] = {}
+        last = last_fired.get(rule)
+        if last is not None and timestamp - last < self.cooldown:
+            self.suppressed += 1
+            return
+        last_fired[rule] = timestamp
+        alert = Alert(rule, session, timestamp, value, message)
+        self.fired += 1
+        self.recent.append(alert)
+        if len(self.recent) > self.history:
+            self.recent.pop(0)
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception as e:
+                print(f"Alert sink error: {e}")
+
+    def forget(self, session):
+        """Drop the state of a finished session"""
+        self.states.pop(session, None)
+        self.last_fired.pop(session, None)
+
+    def reset(self):
+        """Forget every session and the fired counts; rules and sinks stay"""
+        self.states = {}
+        self.last_fired = {}
+        self.last_tick = 0.0
+        self.recent = []
+        self.fired = 0
+        self.suppressed = 0
+
+    def close(self):
+        for sink in self.sinks:
+            close = getattr(sink, 'close', None)
+            if close is not None:
+                close()
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from d2_export import (FRAME_HEADER, FRAME_HELLO, FRAME_EVENTS, FRAME_SESSIONS, FRAME_SNAPSHOT,
+                       FLAG_COMPRESSED, decode_events, decode_sessions, parse_target)
+from d2_packet_codec import D2PacketCodec
+from d2_recorder import SessionRecorder, flow_address
+
+
+class NodeState:
+    """Latest snapshot and session aggregates reported by one monitor node"""
+
+    def __init__(self, name, started):
+        self.name = name
+        self.started = started
+        self.connected = True
+        self.last_seen = time.time()
+        self.snapshot = {}
+        self.sessions = {}
+        self.events = 0
+        self.bytes = 0
+
+
+class D2Collector:
+    """Merges the export streams of many monitors into one store and view
+
+    Every node connects with d2_location_monitor.py --export. Events of
+    each node go to their own SessionRecorder in a subdirectory of store
+    (see node_store()), as two nodes can see the same client ip:port;
+    d2_query.RecordingSet(collector.node_store(name)) queries one node.
+    The latest snapshot and per-session aggregates of each node make up
+    view().
+    """
+
+    def __init__(self, listen, store=None, view_path=None, view_interval=5.0):
+        self.listen = listen
+        self.store = store
+        self.view_path = view_path
+        self.view_interval = view_interval
+        self.recorders = {}
+        self.codecs = None
+        if store is not None:
+            self.codecs = (D2PacketCodec.from_file("client2gs.json"),
+                           D2PacketCodec.from_file("gs2client.json"))
+        self.nodes = {}
+        self.events = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    async def handle(self, reader, writer):
+        node = None
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, frame_type, flags = FRAME_HEADER.unpack(header)
+                body = await reader.readexactly(length)
+                self.bytes += FRAME_HEADER.size + length
+                if flags & FLAG_COMPRESSED:
+                    body = zlib.decompress(body)
+                if frame_type == FRAME_HELLO:
+                    hello = json.loads(body)
+                    node = self.nodes.get(hello['node'])
+                    if node is None:
+                        node = self.nodes[hello['node']] = NodeState(hello['node'], hello['started'])
+                    node.connected = True
+                    print(f"Node {node.name} connected")
+                    continue
+                if node is None:
+                    print("Dropping connection that did not introduce itself")
+                    break
+                node.last_seen = time.time()
+                node.bytes += FRAME_HEADER.size + length
+                if frame_type == FRAME_EVENTS:
+                    self.store_events(node, body)
+                elif frame_type == FRAME_SESSIONS:
+                    node.sessions = {session['flow']: session for session in decode_sessions(body)}
+                elif frame_type == FRAME_SNAPSHOT:
+                    node.snapshot = json.loads(body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (zlib.error, ValueError, struct.error) as e:
+            print(f"Bad frame from {node.name if node else 'unknown node'}: {e}")
+        finally:
+            if node is not None:
+                node.connected = False
+                print(f"Node {node.name} disconnected")
+            writer.close()
+
+    def node_store(self, name):
+        """Directory holding the recorded events of one node"""
+        return os.path.join(self.store, re.sub(r'[^\w.-]', '_', name))
+
+    def recorder(self, node):
+        """SessionRecorder of a node, created with its directory on first use"""
+        recorder = self.recorders.get(node.name)
+        if recorder is None and self.store is not None:
+            recorder = self.recorders[node.name] = SessionRecorder(
+                self.node_store(node.name), prefix="collected",
+                client_codec=self.codecs[0], server_codec=self.codecs[1])
+        return recorder
+
+    def store_events(self, node, body):
+        count = 0
+        recorder = self.recorder(node)
+        for timestamp_ns, flow, direction, payload in decode_events(body):
+            if recorder is not None:
+                recorder.record(timestamp_ns, flow, direction, payload)
+            count += 1
+        node.events += count
+        self.events += count
+
+    def view(self):
+        """Combined view: totals, per-node snapshots and every live session"""
+        sessions = []
+        for node in self.nodes.values():
+            for session in node.sessions.values():
+                ip, port = flow_address(session['flow'])
+                sessions.append(dict(session, node=node.name, session=f"{ip}:{port}"))
+        sessions.sort(key=lambda session: session['last_seen'], reverse=True)
+        return {
+            'generated': time.time(),
+            'events': self.events,
+            'bytes_received': self.bytes,
+            'nodes': {node.name: {'connected': node.connected, 'last_seen': node.last_seen,
+                                  'events': node.events, 'bytes': node.bytes,
+                                  'snapshot': node.snapshot}
+                      for node in self.nodes.values()},
+            'sessions': sessions,
+        }
+
+    def write_view(self):
+        """Replace view_path with the current view in one rename"""
+        temporary = self.view_path + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.view(), f, indent=2, default=str)
+        os.replace(temporary, self.view_path)
+
+    def print_view(self):
+        view = self.view()
+        connected = sum(1 for node in view['nodes'].values() if node['connected'])
+        print(f"\n{connected}/{len(view['nodes'])} node(s) connected, {view['events']} events, "
+              f"{view['bytes_received']} bytes received, {len(view['sessions'])} session(s)")
+        for name, node in sorted(view['nodes'].items()):
+            snapshot = node['snapshot']
+            print(f"  {name:<28} {node['events']:>9} events  "
+                  f"pos ({snapshot.get('server_x', '-')}, {snapshot.get('server_y', '-')})  "
+                  f"HP {snapshot.get('server_hp', '-')}")
+        for session in view['sessions'][:10]:
+            print(f"  {session['session']:<22} {session['node']:<28} {session['packets']:>8} pkts  "
+                  f"ping p50 {session['ping_p50_ms']}ms p99 {session['ping_p99_ms']}ms")
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.view_interval)
+            for recorder in self.recorders.values():
+                recorder.flush()
+            if self.view_path:
+                self.write_view()
+            self.print_view()
+
+    async def serve(self):
+        _, address = parse_target(self.listen)
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            server = await asyncio.start_unix_server(self.handle, address)
+        else:
+            server = await asyncio.start_server(self.handle, *address)
+        print(f"Collecting on {self.listen}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.report())
+
+    def close(self):
+        for recorder in self.recorders.values():
+            recorder.close()
+        if self.view_path:
+            self.write_view()
+        self.print_view()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect D2 monitor exports from many nodes")
+    parser.add_argument("--listen", default="tcp://0.0.0.0:7460",
+                        help="tcp://HOST:PORT or unix:///PATH (default tcp://0.0.0.0:7460)")
+    parser.add_argument("--store", metavar="DIR",
+                        help="record the events of each node to DIR/NODE (query with d2_query.py)")
+    parser.add_argument("--view", metavar="FILE", help="keep the combined view in FILE as JSON")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between view updates")
+    args = parser.parse_args()
+
+    collector = D2Collector(args.listen, args.store, args.view, args.interval)
+    try:
+        asyncio.run(collector.serve())
+    except KeyboardInterrupt:
+        print("\nCollector stopped")
+    finally:
+        collector.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import json
+from array import array
+
+DIRECTION_NAMES = ("client", "server")
+
+
+class PacketDiscovery:
+    """Line-rate census of (direction, packet id, length) with unknown-id sampling
+
+    All counters live in arrays preallocated for 2 directions x 256 ids, and
+    lengths above max_length share one overflow bucket, so record() only
+    indexes arrays. Payloads of ids missing from the definitions, and of
+    known ids whose length differs from the definition's Size or from the
+    size of its fixed layout, are sampled (samples_per_id each) for the
+    report. Size and layout are checked separately because some
+    definitions disagree with their own structure.
+    """
+
+    def __init__(self, client_codec, server_codec, max_length=1024, samples_per_id=8):
+        self.max_length = max_length
+        self.row = max_length + 1
+        self.samples_per_id = samples_per_id
+        self.codecs = (client_codec, server_codec)
+
+        self.counts = array('Q', bytes(8 * 512))
+        self.lengths = array('I', bytes(4 * 512 * self.row))
+        self.mismatches = array('Q', bytes(8 * 512))
+        self.expected = array('i', [-1] * 512)
+        self.layout = array('i', [-1] * 512)
+        self.known = bytearray(512)
+        self.names = [None] * 512
+        self.samples = [[] for _ in range(512)]
+        self.total = 0
+
+        for direction, codec in enumerate(self.codecs):
+            for packet in codec.packets.values():
+                if packet.packet_id is None:
+                    continue
+                index = direction << 8 | packet.packet_id
+                self.known[index] = 1
+                self.names[index] = packet.name
+                if packet.size is not None and packet.size >= 0:
+                    self.expected[index] = packet.size
+                if packet.fixed_size is not None:
+                    self.layout[index] = packet.fixed_size
+
+    def reset(self):
+        """Zero every count and drop the samples"""
+        self.counts = array('Q', bytes(8 * 512))
+        self.lengths = array('I', bytes(4 * 512 * self.row))
+        self.mismatches = array('Q', bytes(8 * 512))
+        self.samples = [[] for _ in range(512)]
+        self.total = 0
+
+    def record(self, direction, payload):
+        """Count one game payload (direction 0 = client, 1 = server)"""
+        index = direction << 8 | payload[0]
+        length = len(payload)
+        self.counts[index] += 1
+        self.lengths[index * self.row + (length if length < self.max_length else self.max_length)] += 1
+        self.total += 1
+        if not self.known[index]:
+            samples = self.samples[index]
+            if len(samples) < self.samples_per_id:
+                samples.append(bytes(payload))
+        elif (self.expected[index] >= 0 and length != self.expected[index]) or \
+                (self.layout[index] >= 0 and length != self.layout[index]):
+            self.mismatches[index] += 1
+            samples = self.samples[index]
+            if len(samples) < self.samples_per_id:
+                samples.append(bytes(payload))
+
+    def length_counts(self, index, top=5):
+        """Most common (length, count) pairs of one (direction, id) slot"""
+        row = self.lengths[index * self.row:(index + 1) * self.row]
+        pairs = [(length, count) for length, count in enumerate(row) if count]
+        pairs.sort(key=lambda pair: pair[1], reverse=True)
+        return pairs[:top]
+
+    def entries(self):
+        """One dict per observed (direction, id), most frequent first"""
+        result = []
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            direction, packet_id = index >> 8, index & 0xFF
+            expected = self.expected[index]
+            layout = self.layout[index]
+            result.append({
+                'direction': DIRECTION_NAMES[direction],
+                'packet_id': f"0x{packet_id:02X}",
+                'name': self.names[index],
+                'count': count,
+                'expected_size': expected if expected >= 0 else None,
+                'layout_size': layout if layout >= 0 else None,
+                'size_mismatches': self.mismatches[index],
+                'lengths': [{'length': length if length < self.max_length else f">={self.max_length}",
+                             'count': length_count}
+                            for length, length_count in self.length_counts(index)],
+                'samples': [sample.hex() for sample in self.samples[index]],
+            })
+        result.sort(key=lambda entry: entry['count'], reverse=True)
+        return result
+
+    def report_lines(self):
+        entries = self.entries()
+        lines = [f"Packet discovery: {self.total} game payloads, {len(entries)} (direction, id) pairs", ""]
+        for direction in DIRECTION_NAMES:
+            lines.append(f"{direction.upper()} -> {'SERVER' if direction == 'client' else 'CLIENT'}")
+            lines.append(f"  {'Id':<5} {'Name':<32} {'Count':>9} {'Size':>5} {'Layout':>6} "
+                         f"{'Bad len':>8}  Lengths")
+            for entry in entries:
+                if entry['direction'] != direction:
+                    continue
+                size = entry['expected_size'] if entry['expected_size'] is not None else "var"
+                layout = entry['layout_size'] if entry['layout_size'] is not None else "var"
+                lengths = ", ".join(f"{item['length']}x{item['count']}" for item in entry['lengths'])
+                name = entry['name'] or "UNKNOWN"
+                lines.append(f"  {entry['packet_id']:<5} {name:<32} {entry['count']:>9} "
+                             f"{size:>5} {layout:>6} {entry['size_mismatches']:>8}  {lengths}")
+            lines.append("")
+
+        unknown = [entry for entry in entries if entry['name'] is None]
+        if unknown:
+            lines.append("Unknown packet ids (sampled payloads):")
+            for entry in unknown:
+                lines.append(f"  {entry['direction']} {entry['packet_id']} ({entry['count']} seen)")
+                lines.extend(f"    {sample}" for sample in entry['samples'])
+            lines.append("")
+
+        mismatched = [entry for entry in entries if entry['size_mismatches']]
+        if mismatched:
+            lines.append("Length differs from the definition Size or layout (framing errors, "
+                         "coalesced messages or wrong definitions):")
+            for entry in mismatched:
+                lines.append(f"  {entry['direction']} {entry['packet_id']} {entry['name']}: "
+                             f"{entry['size_mismatches']} of {entry['count']} "
+                             f"(Size {entry['expected_size']}, layout {entry['layout_size'] or 'var'})")
+                lines.extend(f"    {sample}" for sample in entry['samples'])
+        return lines
+
+    def write_report(self, path):
+        """Write the report as text, or as JSON when path ends in .json"""
+        with open(path, 'w') as f:
+            if path.endswith(".json"):
+                json.dump({'total': self.total, 'entries': self.entries()}, f, indent=2)
+            else:
+                f.write("\n".join(self.report_lines()) + "\n")
+        print(f"Packet discovery report written to {path}")
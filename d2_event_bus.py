@@ -0,0 +1,256 @@
+import argparse
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from d2_packet_codec import D2PacketCodec
+from d2_recorder import DIRECTION_CLIENT, flow_address
+
+# Shared memory layout
+#
+#   header   := magic capacity slot_size write_seq writer_pid   (64 bytes)
+#   readers  := MAX_READERS x uint64 next sequence number  (128 bytes)
+#   slots    := capacity x slot_size
+#   slot     := seq timestamp_ns flow direction packet_id length pad payload
+#
+# A single writer fills slots round robin and never waits for readers. It
+# zeroes a slot's seq before rewriting it and stores the new seq last, so a
+# reader that sees the same seq before and after copying a slot has a
+# consistent record; a reader that falls a full ring behind loses events.
+# A new writer only replaces a leftover segment whose writer_pid has exited.
+BUS_MAGIC = b"D2BUS\x01\x00\x00"
+HEADER = struct.Struct('<8sIIQI')
+HEADER_SIZE = 64
+WRITE_SEQ_OFFSET = 16
+MAX_READERS = 16
+READERS_OFFSET = HEADER_SIZE
+SLOTS_OFFSET = READERS_OFFSET + 8 * MAX_READERS
+SLOT_HEADER = struct.Struct('<QqQBBH4x')
+SEQ = struct.Struct('<Q')
+
+DEFAULT_BUS_NAME = "d2_events"
+
+# Buses written by this process, whose resource tracker entry must stay
+_written = set()
+
+
+def attach_segment(name):
+    """Attach an existing segment without letting this process unlink it on exit
+
+    Python 3.13+ supports track=False. Older versions always register
+    attached segments with the resource tracker, so the registration is
+    removed again, unless this process is the writer or a child of the
+    writer sharing its tracker (whose entry must stay). Telling the two apart reads the private
+    resource_tracker._resource_tracker (_fd and _pid), which is stable from
+    Python 3.8 through 3.12 and unused on 3.13+.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        tracker = resource_tracker._resource_tracker
+        inherited = tracker._fd is not None and tracker._pid is None
+        shm = shared_memory.SharedMemory(name)
+        if not inherited and name not in _written:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def process_alive(pid):
+    """Whether pid is a running process (always True on Windows)"""
+    if os.name == 'nt':
+        # Windows frees a named segment with its last handle, so one that
+        # still exists is in use; os.kill would terminate the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class EventBus:
+    """Single-writer shared memory ring of game messages for local consumers
+
+    Every slot holds one message with its capture time, flow key and
+    direction; fixed-layout messages are stored in their struct layout so
+    readers can view them with the codecs without parsing the capture again.
+    """
+
+    def __init__(self, name=DEFAULT_BUS_NAME, capacity=65536, slot_size=64):
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError(f"slot_size must be larger than {SLOT_HEADER.size}")
+        self.name = name
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.payload_size = slot_size - SLOT_HEADER.size
+        size = SLOTS_OFFSET + capacity * slot_size
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self._remove_stale(name)
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        _written.add(name)
+        self.buf = self.shm.buf
+        self.buf[:SLOTS_OFFSET] = bytes(SLOTS_OFFSET)
+        HEADER.pack_into(self.buf, 0, BUS_MAGIC, capacity, slot_size, 0, os.getpid())
+        self.seq = 0
+        self.truncated = 0
+
+    @staticmethod
+    def _remove_stale(name):
+        """Unlink a bus left behind by a monitor that did not shut down cleanly
+
+        Raises FileExistsError if the segment is not a D2 event bus or its
+        writer is still running.
+        """
+        existing = attach_segment(name)
+        try:
+            magic, _, _, _, writer_pid = HEADER.unpack_from(existing.buf, 0)
+        except struct.error:
+            magic = writer_pid = None
+        existing.close()
+        if magic != BUS_MAGIC:
+            raise FileExistsError(f"Shared memory {name} exists and is not a D2 event bus")
+        if writer_pid and process_alive(writer_pid):
+            raise FileExistsError(f"Event bus {name} is in use by process {writer_pid}")
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+
+    def publish(self, timestamp_ns, flow, direction, payload):
+        """Append one message; payloads longer than the slot are truncated"""
+        buf = self.buf
+        seq = self.seq + 1
+        offset = SLOTS_OFFSET + ((seq - 1) % self.capacity) * self.slot_size
+        length = len(payload)
+        if length > self.payload_size:
+            length = self.payload_size
+            self.truncated += 1
+        SEQ.pack_into(buf, offset, 0)
+        SLOT_HEADER.pack_into(buf, offset, 0, timestamp_ns, flow, direction, payload[0], length)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + length] = payload[:length]
+        SEQ.pack_into(buf, offset, seq)
+        SEQ.pack_into(buf, WRITE_SEQ_OFFSET, seq)
+        self.seq = seq
+
+    def reader_lag(self):
+        """{reader_id: events not yet consumed} for registered readers"""
+        lag = {}
+        for reader_id in range(MAX_READERS):
+            next_seq = SEQ.unpack_from(self.buf, READERS_OFFSET + 8 * reader_id)[0]
+            if next_seq:
+                lag[reader_id] = self.seq + 1 - next_seq
+        return lag
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+        _written.discard(self.name)
+        print(f"Event bus {self.name} closed after {self.seq} events "
+              f"({self.truncated} truncated)")
+
+
+class EventBusReader:
+    """One consumer of an EventBus, possibly in another process
+
+    The reader keeps its own next sequence number. With a reader_id
+    (0..MAX_READERS-1) that position is also published in the bus header,
+    so the writer can report how far behind each consumer is.
+    """
+
+    def __init__(self, name=DEFAULT_BUS_NAME, reader_id=None, start="latest"):
+        # The writer owns the segment and unlinks it
+        self.shm = attach_segment(name)
+        self.buf = self.shm.buf
+        magic, self.capacity, self.slot_size, write_seq, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != BUS_MAGIC:
+            raise ValueError(f"{name} is not a D2 event bus")
+        self.reader_id = reader_id
+        if start == "oldest":
+            self.next_seq = max(write_seq - self.capacity, 0) + 1
+        else:
+            self.next_seq = write_seq + 1
+        self.lost = 0
+        self._store_position()
+
+    def _store_position(self):
+        if self.reader_id is not None:
+            SEQ.pack_into(self.buf, READERS_OFFSET + 8 * self.reader_id, self.next_seq)
+
+    def poll(self, max_events=1024):
+        """Events published since the last poll, as
+        (seq, timestamp_ns, flow, direction, packet_id, payload) tuples"""
+        buf = self.buf
+        write_seq = SEQ.unpack_from(buf, WRITE_SEQ_OFFSET)[0]
+        if write_seq - self.next_seq + 1 > self.capacity:
+            # Lapped by the writer: skip what was overwritten
+            skipped = write_seq - self.capacity + 1 - self.next_seq
+            self.lost += skipped
+            self.next_seq += skipped
+
+        events = []
+        while self.next_seq <= write_seq and len(events) < max_events:
+            seq = self.next_seq
+            offset = SLOTS_OFFSET + ((seq - 1) % self.capacity) * self.slot_size
+            slot = bytes(buf[offset:offset + self.slot_size])
+            slot_seq, timestamp_ns, flow, direction, packet_id, length = \
+                SLOT_HEADER.unpack_from(slot)
+            if slot_seq != seq or SEQ.unpack_from(buf, offset)[0] != seq:
+                # Overwritten while we were reading it
+                self.lost += 1
+            else:
+                payload = slot[SLOT_HEADER.size:SLOT_HEADER.size + length]
+                events.append((seq, timestamp_ns, flow, direction, packet_id, payload))
+            self.next_seq = seq + 1
+        self._store_position()
+        return events
+
+    def follow(self, interval=0.001):
+        """Yield events forever, sleeping interval seconds when the bus is idle"""
+        while True:
+            events = self.poll()
+            if not events:
+                time.sleep(interval)
+            yield from events
+
+    def close(self):
+        if self.reader_id is not None:
+            SEQ.pack_into(self.buf, READERS_OFFSET + 8 * self.reader_id, 0)
+        self.buf = None
+        self.shm.close()
+
+
+def main():
+    """Print the events on a bus, decoded with the JSON definitions"""
+    parser = argparse.ArgumentParser(description="Follow a D2 monitor event bus")
+    parser.add_argument("name", nargs="?", default=DEFAULT_BUS_NAME, help="bus name")
+    parser.add_argument("--reader-id", type=int, default=None, help="register as reader 0..15")
+    args = parser.parse_args()
+
+    codecs = (D2PacketCodec.from_file("client2gs.json"), D2PacketCodec.from_file("gs2client.json"))
+    reader = EventBusReader(args.name, args.reader_id)
+    print(f"Following event bus {args.name} (Ctrl+C to stop)")
+    try:
+        for seq, timestamp_ns, flow, direction, packet_id, payload in reader.follow():
+            codec = codecs[direction].by_id.get(packet_id)
+            ip, port = flow_address(flow)
+            side = "CLIENT" if direction == DIRECTION_CLIENT else "SERVER"
+            if codec is not None and codec.fixed_size == len(payload):
+                fields = codec.decode(payload)
+                fields.pop('PacketId', None)
+                print(f"{seq:>8} {ip}:{port} {side} {codec.name} {fields}")
+            else:
+                name = codec.name if codec is not None else f"0x{packet_id:02X}"
+                print(f"{seq:>8} {ip}:{port} {side} {name} {payload.hex()}")
+    except KeyboardInterrupt:
+        print(f"\nStopped ({reader.lost} events lost)")
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
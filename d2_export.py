@@ -0,0 +1,289 @@
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+# Wire format
+#
+#   frame    := FRAME_HEADER body                   (body zlib-compressed if flagged)
+#   hello    := JSON {"node", "started"}
+#   events   := base_ns flow_count flow* event*
+#   event    := EVENT payload                       (time in us after base_ns)
+#   sessions := SESSION*                            (per-session aggregates)
+#   snapshot := JSON of the node's MonitorSnapshot fields
+#
+# Flows are sent once per frame and referenced by index, so an event costs
+# 9 bytes plus its payload before compression. A batch is split into
+# several frames when its time span, flow count or size would not fit.
+FRAME_HEADER = struct.Struct('<IBB2x')
+FRAME_HELLO = 1
+FRAME_EVENTS = 2
+FRAME_SESSIONS = 3
+FRAME_SNAPSHOT = 4
+FLAG_COMPRESSED = 0x01
+
+EVENTS_HEADER = struct.Struct('<qH')
+EVENT = struct.Struct('<IHBH')
+MAX_DELTA_US = 0xFFFFFFFF
+MAX_FLOWS = 0xFFFF
+MAX_PAYLOAD = 0xFFFF
+SESSION = struct.Struct('<QIIddff')
+
+SNAPSHOT_FIELDS = ('version', 'packets', 'client_x', 'client_y', 'server_x', 'server_y',
+                   'server_hp', 'server_mp', 'server_stamina', 'server_hp_percent',
+                   'client_packet_count', 'server_packet_count', 'position_error',
+                   'reconciliation', 'latency', 'alerts_fired', 'flows')
+
+
+def parse_target(target):
+    """(family, address) for tcp://host:port, host:port or unix:///path"""
+    if target.startswith("unix://"):
+        return socket.AF_UNIX, target[len("unix://"):]
+    if target.startswith("tcp://"):
+        target = target[len("tcp://"):]
+    host, _, port = target.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def encode_frame(frame_type, body, compress=False):
+    flags = 0
+    if compress and len(body) > 64:
+        body = zlib.compress(body, 6)
+        flags = FLAG_COMPRESSED
+    return FRAME_HEADER.pack(len(body), frame_type, flags) + body
+
+
+def decode_events(body):
+    """Yield (timestamp_ns, flow, direction, payload) from an events body"""
+    base_ns, flow_count = EVENTS_HEADER.unpack_from(body)
+    offset = EVENTS_HEADER.size
+    flows = struct.unpack_from(f'<{flow_count}Q', body, offset)
+    offset += 8 * flow_count
+    end = len(body)
+    while offset < end:
+        delta_us, flow_index, direction, length = EVENT.unpack_from(body, offset)
+        offset += EVENT.size
+        yield base_ns + delta_us * 1000, flows[flow_index], direction, body[offset:offset + length]
+        offset += length
+
+
+def decode_sessions(body):
+    """Yield per-session aggregate dicts from a sessions body"""
+    for flow, packets, size, first_seen, last_seen, p50, p99 in SESSION.iter_unpack(body):
+        yield {'flow': flow, 'packets': packets, 'bytes': size, 'first_seen': first_seen,
+               'last_seen': last_seen, 'ping_p50_ms': round(p50, 2), 'ping_p99_ms': round(p99, 2)}
+
+
+class StreamExporter:
+    """Ships selected game events and per-session aggregates to a collector
+
+    event() is called on the capture path and only appends to a bounded
+    deque (overflow is counted in dropped). A sender thread packs the
+    events into one frame every batch_interval seconds, compresses it and
+    writes it to a TCP or Unix socket, reconnecting with backoff; frames
+    produced while disconnected are counted and discarded.
+
+    Only packet ids passed to select() are exported. Conflated ids are
+    state updates where the latest value wins: only the last one per flow
+    and id is kept, and sent with the aggregates every aggregate_interval.
+    """
+
+    def __init__(self, target, node=None, compress=True, batch_interval=1.0, max_pending=100000,
+                 aggregate_interval=10.0, frame_bytes=1024 * 1024):
+        self.target = target
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.compress = compress
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.aggregate_interval = aggregate_interval
+        self.frame_bytes = frame_bytes
+        self.export_ids = (bytearray(256), bytearray(256))
+        self.conflate_ids = (bytearray(256), bytearray(256))
+
+        self.pending = deque()
+        self.latest = {}
+        self.next_latest = time.monotonic() + aggregate_interval
+        self.frames = deque()
+        self.raw_bytes = 0
+        self.events = 0
+        self.conflated = 0
+        self.dropped = 0
+        self.frames_lost = 0
+        self.truncated = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.sock = None
+        self.next_connect = 0.0
+        self.started = time.time()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def selected(self):
+        return any(self.export_ids[0]) or any(self.export_ids[1])
+
+    def select(self, direction, packet_ids, conflate=False):
+        """Export these packet ids of one direction (DIRECTION_CLIENT/SERVER)"""
+        for packet_id in packet_ids:
+            self.export_ids[direction][packet_id] = 1
+            self.conflate_ids[direction][packet_id] = 1 if conflate else 0
+
+    def event(self, timestamp_ns, flow, direction, payload):
+        """Queue one game message if its id is exported (capture thread)"""
+        if not self.export_ids[direction][payload[0]]:
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((timestamp_ns, flow, direction, payload))
+
+    def sessions(self, records):
+        """Queue per-session aggregates: (flow, packets, bytes, first_seen,
+        last_seen, ping_p50_ms, ping_p99_ms) tuples"""
+        body = b"".join(SESSION.pack(*record) for record in records)
+        if body:
+            self.frames.append((FRAME_SESSIONS, body))
+
+    def snapshot(self, snapshot):
+        """Queue the node's current MonitorSnapshot"""
+        values = {name: getattr(snapshot, name) for name in SNAPSHOT_FIELDS}
+        body = json.dumps(values, default=str).encode('utf-8')
+        self.frames.append((FRAME_SNAPSHOT, body))
+
+    def _events_frames(self, final=False):
+        pending = self.pending
+        conflate = self.conflate_ids
+        latest = self.latest
+        batch = []
+        for _ in range(len(pending)):
+            item = pending.popleft()
+            packet_id = item[3][0]
+            if conflate[item[2]][packet_id]:
+                self.conflated += 1
+                latest[(item[1], item[2], packet_id)] = item
+            else:
+                batch.append(item)
+        if final or time.monotonic() >= self.next_latest:
+            self.next_latest = time.monotonic() + self.aggregate_interval
+            latest, self.latest = self.latest, {}
+            batch.extend(latest.values())
+            self.conflated -= len(latest)
+        if not batch:
+            return []
+
+        # Time order keeps every delta positive; a new frame starts whenever
+        # the delta, the flow index or the frame size would overflow
+        batch.sort(key=lambda item: item[0])
+        frames = []
+        base_ns = batch[0][0]
+        flow_index = {}
+        records = []
+        size = 0
+        for timestamp_ns, flow, direction, payload in batch:
+            delta_us = (timestamp_ns - base_ns) // 1000
+            if delta_us > MAX_DELTA_US or size >= self.frame_bytes or \
+                    (flow not in flow_index and len(flow_index) == MAX_FLOWS):
+                frames.append(self._pack_events(base_ns, flow_index, records))
+                base_ns, delta_us = timestamp_ns, 0
+                flow_index = {}
+                records = []
+                size = 0
+            index = flow_index.get(flow)
+            if index is None:
+                index = flow_index[flow] = len(flow_index)
+            if len(payload) > MAX_PAYLOAD:
+                payload = payload[:MAX_PAYLOAD]
+                self.truncated += 1
+            records.append(EVENT.pack(delta_us, index, direction, len(payload)))
+            records.append(payload)
+            size += EVENT.size + len(payload)
+        frames.append(self._pack_events(base_ns, flow_index, records))
+        self.events += len(batch)
+        return frames
+
+    def _pack_events(self, base_ns, flow_index, records):
+        header = EVENTS_HEADER.pack(base_ns, len(flow_index)) + \
+            struct.pack(f'<{len(flow_index)}Q', *flow_index)
+        return encode_frame(FRAME_EVENTS, header + b"".join(records), self.compress)
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self.next_connect:
+            return False
+        family, address = parse_target(self.target)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(5.0)
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            self.next_connect = now + 2.0
+            return False
+        self.sock = sock
+        hello = json.dumps({'node': self.node, 'started': self.started}).encode('utf-8')
+        return self._send(encode_frame(FRAME_HELLO, hello))
+
+    def _send(self, frame):
+        try:
+            self.sock.sendall(frame)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            self.next_connect = time.monotonic() + 2.0
+            return False
+        self.bytes_sent += len(frame)
+        return True
+
+    def _flush(self, final=False):
+        frames = self._events_frames(final)
+        while self.frames:
+            frames.append(encode_frame(*self.frames.popleft(), self.compress))
+        if not frames:
+            return
+        if self.sock is None and not self._connect():
+            self.frames_lost += len(frames)
+            return
+        for index, frame in enumerate(frames):
+            if not self._send(frame):
+                self.frames_lost += len(frames) - index
+                return
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.batch_interval)
+            self._flush_safely()
+        self._flush_safely(final=True)
+        if self.sock is not None:
+            self.sock.close()
+
+    def _flush_safely(self, final=False):
+        # The sender thread must outlive a bad batch, or every later event
+        # would only pile up and be dropped
+        try:
+            self._flush(final)
+        except Exception as e:
+            self.errors += 1
+            if self.errors == 1:
+                print(f"Export error: {e!r}")
+
+    def stats(self):
+        ratio = self.bytes_sent / self.raw_bytes if self.raw_bytes else 0.0
+        return {'events': self.events, 'conflated': self.conflated, 'dropped': self.dropped,
+                'frames_lost': self.frames_lost, 'truncated': self.truncated,
+                'errors': self.errors, 'bytes_sent': self.bytes_sent,
+                'raw_bytes': self.raw_bytes, 'bandwidth_ratio': round(ratio, 4)}
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        stats = self.stats()
+        print(f"Export to {self.target}: {stats['events']} events ({stats['conflated']} conflated, "
+              f"{stats['dropped']} dropped), {stats['bytes_sent']} bytes sent = "
+              f"{stats['bandwidth_ratio'] * 100:.2f}% of {stats['raw_bytes']} captured bytes, "
+              f"{stats['frames_lost']} frame(s) lost")
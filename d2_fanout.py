@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from d2_latency import LatencyHistogram
+from d2_packet_crafter import D2PacketCrafter
+from d2_packet_template import PacketTemplate
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Scripted steps a session picks from, with their relative weights
+SCRIPT_WEIGHTS = (("walk", 4), ("run", 3), ("skill", 2), ("belt", 1))
+
+BELT_ITEM_GUIDS = (0x101, 0x102, 0x103, 0x104)
+
+
+def raise_open_file_limit():
+    """Lift the soft descriptor limit to the hard limit (thousands of sockets)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class StandInServer:
+    """Local stand-in game server for capacity tests
+
+    Splits the client byte stream into messages by their fixed Size,
+    answers every D2GS_PING with a D2GS_PONG echoing nTickCount and
+    discards everything else. Connections with a message it cannot frame
+    are closed.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, client_json="client2gs.json",
+                 server_json="gs2client.json"):
+        self.host = host
+        self.port = port
+        self.client_codec = D2PacketCrafter(client_json).codec
+        self.pong = PacketTemplate(D2PacketCrafter(server_json).codec['D2GS_PONG'])
+        ping = self.client_codec['D2GS_PING']
+        self.ping_id = ping.packet_id
+        self.ping_tick = ping.slots['nTickCount']
+        self.sizes = [0] * 256
+        for packet in self.client_codec.packets.values():
+            if packet.packet_id is not None and packet.fixed_size is not None:
+                self.sizes[packet.packet_id] = packet.fixed_size
+        self.messages = 0
+        self.framing_errors = 0
+
+    async def handle(self, reader, writer):
+        sizes = self.sizes
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                pending += data
+                offset = 0
+                while offset < len(pending):
+                    size = sizes[pending[offset]]
+                    if not size:
+                        self.framing_errors += 1
+                        return
+                    if offset + size > len(pending):
+                        break
+                    if pending[offset] == self.ping_id:
+                        position, tick_struct, _, _ = self.ping_tick
+                        tick = tick_struct.unpack_from(pending, offset + position)[0]
+                        writer.write(bytes(self.pong.patch(nTickCount=tick)))
+                    self.messages += 1
+                    offset += size
+                pending = pending[offset:]
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        raise_open_file_limit()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+
+def _serve(host, port, client_json, server_json):
+    StandInServer(host, port, client_json, server_json).serve_forever()
+
+
+class FanoutWorker:
+    """Runs a contiguous range of scripted sessions on one asyncio event loop
+
+    Every session keeps one connection open for the whole run and sends
+    walk/run/skill/belt-item steps at its rate, with a D2GS_PING every
+    ping_interval seconds. Pong round trips go into a LatencyHistogram.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        crafter = D2PacketCrafter(config['client_json'])
+        self.templates = {name: crafter.template(name) for name in
+                          ("D2GS_WALKTOLOCATION", "D2GS_RUNTOLOCATION",
+                           "D2GS_LEFTSKILLONLOCATION", "D2GS_USEBELTITEM", "D2GS_PING")}
+        pong = D2PacketCrafter(config['server_json']).codec['D2GS_PONG']
+        self.pong_size = pong.fixed_size
+        self.pong_tick = pong.slots['nTickCount']
+        self.latency = LatencyHistogram()
+        self.sent = {}
+        self.bytes = 0
+        self.connected = 0
+        self.connect_errors = 0
+        self.session_errors = 0
+
+    def message(self, name, **fields):
+        payload = bytes(self.templates[name].patch(**fields))
+        self.sent[name] = self.sent.get(name, 0) + 1
+        self.bytes += len(payload)
+        return payload
+
+    def step(self, kind, rng, position):
+        x, y = position
+        if kind in ("walk", "run"):
+            x += rng.randint(-20, 20)
+            y += rng.randint(-20, 20)
+            position[:] = x, y
+            name = "D2GS_WALKTOLOCATION" if kind == "walk" else "D2GS_RUNTOLOCATION"
+            return self.message(name, nTargetX=x, nTargetY=y)
+        if kind == "skill":
+            return self.message("D2GS_LEFTSKILLONLOCATION",
+                                nTargetX=x + rng.randint(-8, 8), nTargetY=y + rng.randint(-8, 8))
+        return self.message("D2GS_USEBELTITEM", nItemGUID=rng.choice(BELT_ITEM_GUIDS),
+                            bOnMerc=0, Unused=0)
+
+    async def read_pongs(self, reader, pings):
+        size = self.pong_size
+        position, tick_struct, _, _ = self.pong_tick
+        while True:
+            data = await reader.readexactly(size)
+            sent = pings.pop(tick_struct.unpack_from(data, position)[0], None)
+            if sent is not None:
+                self.latency.record(time.perf_counter() - sent)
+
+    async def session(self, index, deadline):
+        config = self.config
+        ports = config['ports']
+        rng = random.Random(config['seed'] * 1000003 + index)
+        # Spread connection setup so thousands of sessions do not SYN at once
+        await asyncio.sleep(rng.random() * min(1.0, config['duration'] / 10))
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(config['host'], ports[index % len(ports)]), 10)
+        except (OSError, asyncio.TimeoutError):
+            self.connect_errors += 1
+            return
+        self.connected += 1
+
+        pings = {}
+        pong_task = asyncio.create_task(self.read_pongs(reader, pings))
+        kinds = [kind for kind, _ in SCRIPT_WEIGHTS]
+        weights = [weight for _, weight in SCRIPT_WEIGHTS]
+        position = [5000 + rng.randint(-500, 500), 5000 + rng.randint(-500, 500)]
+        interval = 1.0 / config['rate']
+        next_ping = time.perf_counter() + rng.random() * config['ping_interval']
+        # Session index in the high half, so ticks stay unique up to 65536 sessions
+        tick = (index & 0xFFFF) << 16
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                writer.write(self.step(rng.choices(kinds, weights)[0], rng, position))
+                if now >= next_ping:
+                    tick = (tick + 1) & 0xFFFFFFFF
+                    pings[tick] = now
+                    writer.write(self.message("D2GS_PING", nTickCount=tick, nDelay=0,
+                                              nWardenOrZero=0))
+                    next_ping = now + config['ping_interval']
+                await writer.drain()
+                await asyncio.sleep(interval * (0.5 + rng.random()))
+        except (OSError, asyncio.IncompleteReadError):
+            self.session_errors += 1
+        finally:
+            # Retrieve the reader's outcome too, it may have died on a closed connection
+            pong_task.cancel()
+            try:
+                await pong_task
+            except (asyncio.CancelledError, OSError, asyncio.IncompleteReadError):
+                pass
+            writer.close()
+
+    async def run_sessions(self, first, count):
+        deadline = time.perf_counter() + self.config['duration']
+        await asyncio.gather(*(self.session(index, deadline)
+                               for index in range(first, first + count)))
+
+    def run(self, first, count):
+        raise_open_file_limit()
+        started = time.perf_counter()
+        asyncio.run(self.run_sessions(first, count))
+        return {
+            'worker': os.getpid(),
+            'sessions': count,
+            'connected': self.connected,
+            'connect_errors': self.connect_errors,
+            'session_errors': self.session_errors,
+            'sent': self.sent,
+            'bytes': self.bytes,
+            'elapsed': time.perf_counter() - started,
+            'latency': self.latency,
+        }
+
+
+def run_worker(config, first, count):
+    """Process pool entry point"""
+    return FanoutWorker(config).run(first, count)
+
+
+class FanoutReport:
+    """Throughput and ping latency aggregated over all workers"""
+
+    def __init__(self, results, duration):
+        self.results = results
+        self.duration = duration
+        self.latency = LatencyHistogram()
+        self.sent = {}
+        for result in results:
+            self.latency.merge(result['latency'])
+            for name, count in result['sent'].items():
+                self.sent[name] = self.sent.get(name, 0) + count
+        self.packets = sum(self.sent.values())
+        self.bytes = sum(result['bytes'] for result in results)
+        self.elapsed = max((result['elapsed'] for result in results), default=0.0)
+
+    def summary(self):
+        return {
+            'workers': len(self.results),
+            'sessions': sum(result['sessions'] for result in self.results),
+            'connected': sum(result['connected'] for result in self.results),
+            'connect_errors': sum(result['connect_errors'] for result in self.results),
+            'session_errors': sum(result['session_errors'] for result in self.results),
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'packets_per_second': round(self.packets / self.elapsed) if self.elapsed else 0,
+            'latency': self.latency.summary(),
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        latency = summary['latency']
+        lines = [
+            f"Fan-out: {summary['sessions']} sessions on {summary['workers']} workers, "
+            f"{summary['connected']} connected ({summary['connect_errors']} connect errors, "
+            f"{summary['session_errors']} dropped)",
+            f"  Sent {summary['packets']} packets ({summary['bytes']} bytes) in {self.elapsed:.2f}s: "
+            f"{summary['packets_per_second']} packets/s",
+            f"  Ping RTT ms: p50 {latency['p50_ms']}  p90 {latency['p90_ms']}  "
+            f"p99 {latency['p99_ms']}  max {latency['max_ms']}  ({latency['count']} pongs)",
+        ]
+        for name, count in sorted(self.sent.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"  {name:<28} {count:>10}")
+        return "\n".join(lines)
+
+
+class FanoutInjector:
+    """Spreads scripted client sessions over a process pool
+
+    Sessions are split into contiguous ranges, one per worker process, and
+    each worker drives its range on an asyncio event loop. With servers > 0
+    that many StandInServer processes are started on port, port + 1, ...
+    and sessions are spread across them.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, sessions=1000, workers=None, duration=10.0,
+                 rate=5.0, ping_interval=1.0, seed=0, servers=0,
+                 client_json="client2gs.json", server_json="gs2client.json"):
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.workers = max(1, min(workers or os.cpu_count() or 1, sessions))
+        self.servers = servers
+        self.config = {
+            'host': host,
+            'ports': [port + offset for offset in range(max(servers, 1))],
+            'duration': duration,
+            'rate': rate,
+            'ping_interval': ping_interval,
+            'seed': seed,
+            'client_json': client_json,
+            'server_json': server_json,
+        }
+
+    def start_servers(self):
+        processes = []
+        for port in self.config['ports'][:self.servers]:
+            process = multiprocessing.Process(
+                target=_serve, args=(self.host, port, self.config['client_json'],
+                                     self.config['server_json']), daemon=True)
+            process.start()
+            processes.append(process)
+        for port in self.config['ports'][:self.servers]:
+            self._wait_for_port(port)
+        return processes
+
+    def _wait_for_port(self, port, timeout=10.0):
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                socket.create_connection((self.host, port), 1).close()
+                return
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def run(self):
+        servers = self.start_servers() if self.servers else []
+        try:
+            base, extra = divmod(self.sessions, self.workers)
+            ranges = []
+            first = 0
+            for worker in range(self.workers):
+                count = base + (1 if worker < extra else 0)
+                ranges.append((first, count))
+                first += count
+            print(f"Running {self.sessions} sessions on {self.workers} workers for "
+                  f"{self.config['duration']}s against {self.host}:{self.config['ports']}")
+            with ProcessPoolExecutor(self.workers) as pool:
+                futures = [pool.submit(run_worker, self.config, first, count)
+                           for first, count in ranges]
+                results = [future.result() for future in futures]
+        finally:
+            for process in servers:
+                process.terminate()
+                process.join()
+        return FanoutReport(results, self.config['duration'])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Process-pool fan-out injector for capacity tests")
+    parser.add_argument("--host", default="127.0.0.1", help="game server address")
+    parser.add_argument("--port", type=int, default=4000, help="game server port (first port with --servers)")
+    parser.add_argument("--sessions", type=int, default=1000, help="scripted client sessions")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--duration", type=float, default=10.0, help="test length in seconds")
+    parser.add_argument("--rate", type=float, default=5.0, help="actions per second per session")
+    parser.add_argument("--ping-interval", type=float, default=1.0, help="seconds between pings")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--servers", type=int, default=0,
+                        help="start this many local stand-in servers (0 = use an existing server)")
+    parser.add_argument("--serve", action="store_true",
+                        help="only run one stand-in server on --host:--port")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.serve:
+        print(f"Stand-in game server on {args.host}:{args.port} (Ctrl+C to stop)")
+        StandInServer(args.host, args.port).serve_forever()
+        return
+    injector = FanoutInjector(args.host, args.port, args.sessions, args.workers, args.duration,
+                              args.rate, args.ping_interval, args.seed, args.servers)
+    print(injector.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import socket
+from collections import OrderedDict
+
+TCP_FIN = 0x01
+TCP_RST = 0x04
+
+EVICTION_REASONS = ("lru", "idle", "fin", "rst")
+
+
+def pack_flow(client_ip, client_port, server_ip, server_port, protocol):
+    """Pack a 5-tuple, client end first, into one integer key"""
+    return (int.from_bytes(socket.inet_aton(client_ip), 'big') << 80 |
+            int.from_bytes(socket.inet_aton(server_ip), 'big') << 48 |
+            client_port << 32 | server_port << 16 | protocol)
+
+
+def unpack_flow(key):
+    """Inverse of pack_flow: (client_ip, client_port, server_ip, server_port, protocol)"""
+    return (socket.inet_ntoa((key >> 80 & 0xFFFFFFFF).to_bytes(4, 'big')), key >> 32 & 0xFFFF,
+            socket.inet_ntoa((key >> 48 & 0xFFFFFFFF).to_bytes(4, 'big')), key >> 16 & 0xFFFF,
+            key & 0xFF)
+
+
+class FlowEntry:
+    """Per-flow state; state is free for per-flow consumers (reassembly, ...)"""
+    __slots__ = ('key', 'session', 'client_flow', 'first_seen', 'last_seen',
+                 'packets', 'bytes', 'fins', 'state')
+
+    def __init__(self, key, session, client_flow, now):
+        self.key = key
+        self.session = session
+        self.client_flow = client_flow
+        self.first_seen = now
+        self.last_seen = now
+        self.packets = 0
+        self.bytes = 0
+        self.fins = 0
+        self.state = None
+
+
+class FlowTable:
+    """Bounded table of live flows keyed by packed 5-tuples
+
+    Entries are kept in least-recently-seen order, so lookup, refresh and
+    LRU eviction are O(1) and the idle sweep only walks the stale front of
+    the table. A flow is dropped when both sides have sent FIN, on RST, after
+    idle_timeout seconds without packets, or as the least recently seen
+    flow once max_flows is reached. on_evict(entry, reason) is called for
+    every removed flow so per-session state elsewhere can be released.
+    """
+
+    def __init__(self, max_flows=65536, idle_timeout=600.0, sweep_interval=1.0, on_evict=None):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self.flows = OrderedDict()
+        self.next_sweep = None
+        self.created = 0
+        self.evictions = dict.fromkeys(EVICTION_REASONS, 0)
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, key):
+        return key in self.flows
+
+    def get(self, key):
+        return self.flows.get(key)
+
+    def track(self, client_ip, client_port, server_ip, server_port, protocol, now, size=0):
+        """Entry of this flow, created if new and marked as just seen"""
+        if self.next_sweep is None:
+            self.next_sweep = now + self.sweep_interval
+        elif now >= self.next_sweep:
+            self.sweep(now)
+
+        key = pack_flow(client_ip, client_port, server_ip, server_port, protocol)
+        flows = self.flows
+        entry = flows.get(key)
+        if entry is None:
+            if len(flows) >= self.max_flows:
+                self._evict(flows.popitem(last=False)[1], "lru")
+            entry = flows[key] = FlowEntry(key, f"{client_ip}:{client_port}",
+                                           key >> 80 << 16 | client_port, now)
+            self.created += 1
+        else:
+            flows.move_to_end(key)
+        entry.last_seen = now
+        entry.packets += 1
+        entry.bytes += size
+        return entry
+
+    def tcp_flags(self, entry, flags, direction):
+        """Drop the flow on RST, or once both directions have sent FIN"""
+        if flags & TCP_RST:
+            self.remove(entry.key, "rst")
+        elif flags & TCP_FIN:
+            entry.fins |= 1 << direction
+            if entry.fins == 3:
+                self.remove(entry.key, "fin")
+
+    def remove(self, key, reason):
+        entry = self.flows.pop(key, None)
+        if entry is not None:
+            self._evict(entry, reason)
+
+    def sweep(self, now):
+        """Evict flows idle for longer than idle_timeout"""
+        self.next_sweep = now + self.sweep_interval
+        cutoff = now - self.idle_timeout
+        flows = self.flows
+        while flows:
+            entry = next(iter(flows.values()))
+            if entry.last_seen >= cutoff:
+                break
+            del flows[entry.key]
+            self._evict(entry, "idle")
+
+    def _evict(self, entry, reason):
+        self.evictions[reason] += 1
+        if self.on_evict is not None:
+            self.on_evict(entry, reason)
+
+    def stats(self):
+        """Occupancy and eviction counters"""
+        result = {'flows': len(self.flows), 'max_flows': self.max_flows, 'created': self.created}
+        for reason, count in self.evictions.items():
+            result[f"evicted_{reason}"] = count
+        return result
@@ -0,0 +1,210 @@
+from array import array
+from collections import OrderedDict
+
+# Recorded values are whole microseconds
+MICROSECONDS = 1000000
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram in fixed memory
+
+    Values below 2**sub_bucket_bits us are counted exactly; above that every
+    power-of-two range is split into 2**(sub_bucket_bits - 1) linear buckets,
+    so the relative error stays under 2**(1 - sub_bucket_bits) (about 1.6%
+    with the default 7 bits) from 1us up to highest_seconds.
+    """
+
+    def __init__(self, highest_seconds=60.0, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.highest = int(highest_seconds * MICROSECONDS)
+        self.counts = array('Q', bytes(8 * (self._index(self.highest) + 1)))
+        self.total = 0
+        self.sum = 0
+        self.minimum = None
+        self.maximum = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + \
+            (value >> shift) - self.half_count
+
+    def _value_at(self, index):
+        """Midpoint of the range counted by a bucket"""
+        if index < self.sub_bucket_count:
+            return index
+        offset = index - self.sub_bucket_count
+        shift = offset // self.half_count + 1
+        lower = (offset % self.half_count + self.half_count) << shift
+        return lower + ((1 << shift) >> 1)
+
+    def record(self, seconds):
+        value = min(max(int(seconds * MICROSECONDS), 0), self.highest)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, percentile):
+        """Latency in seconds at or below which percentile % of samples fall"""
+        if not self.total:
+            return 0.0
+        target = max(1, -(-self.total * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= target:
+                    return min(self._value_at(index), self.maximum) / MICROSECONDS
+        return self.maximum / MICROSECONDS
+
+    def mean(self):
+        return self.sum / self.total / MICROSECONDS if self.total else 0.0
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        self.maximum = max(self.maximum, other.maximum)
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """{'count', 'min_ms', 'mean_ms', 'p50_ms', ..., 'max_ms'}"""
+        result = {'count': self.total,
+                  'min_ms': round((self.minimum or 0) / 1000, 2),
+                  'mean_ms': round(self.mean() * 1000, 2)}
+        for percentile in percentiles:
+            result[f"p{percentile:g}_ms"] = round(self.percentile(percentile) * 1000, 2)
+        result['max_ms'] = round(self.maximum / 1000, 2)
+        return result
+
+
+class PingTracker:
+    """Pairs client D2GS_PING with the server D2GS_PONG echoing its nTickCount
+
+    Keeps one LatencyHistogram per session plus an overall one. When a drop
+    source (a callable returning cumulative capture drops, such as
+    CaptureDropCounter) is given, every latency spike is tagged with the
+    drops seen since the previous sample, so spikes can be told apart from
+    capture-side loss.
+    """
+
+    def __init__(self, max_pending=16, spike_factor=3.0, spike_floor=0.050, drop_source=None):
+        self.max_pending = max_pending
+        self.spike_factor = spike_factor
+        self.spike_floor = spike_floor
+        self.drop_source = drop_source
+        self.pending = {}
+        self.sessions = {}
+        self.baselines = {}
+        self.overall = LatencyHistogram()
+        self.unmatched = 0
+        self.expired = 0
+        self.last_drops = None
+        # (samples, samples with drops) for spikes and for normal samples
+        self.spike_drops = [0, 0]
+        self.normal_drops = [0, 0]
+        self.spikes = []
+
+    def set_drop_source(self, drop_source):
+        self.drop_source = drop_source
+
+    def ping(self, session, timestamp, tick_count):
+        """A client ping left at timestamp"""
+        pending = self.pending.get(session)
+        if pending is None:
+            pending = self.pending[session] = OrderedDict()
+        pending[tick_count] = timestamp
+        if len(pending) > self.max_pending:
+            pending.popitem(last=False)
+            self.expired += 1
+
+    def pong(self, session, timestamp, tick_count):
+        """A server pong arrived; returns the round trip in seconds or None"""
+        pending = self.pending.get(session)
+        sent = pending.pop(tick_count, None) if pending is not None else None
+        if sent is None:
+            self.unmatched += 1
+            return None
+        rtt = timestamp - sent
+        histogram = self.sessions.get(session)
+        if histogram is None:
+            histogram = self.sessions[session] = LatencyHistogram()
+        # Moving baseline instead of a percentile scan on every sample
+        baseline = self.baselines.get(session)
+        self.baselines[session] = rtt if baseline is None else baseline + (rtt - baseline) / 8
+        if histogram.total < 10:
+            baseline = None
+        histogram.record(rtt)
+        self.overall.record(rtt)
+        self._correlate(session, timestamp, rtt, baseline)
+        return rtt
+
+    def _drops_since_last(self):
+        if self.drop_source is None:
+            return None
+        drops = self.drop_source()
+        if drops is None:
+            return None
+        delta = drops - self.last_drops if self.last_drops is not None else 0
+        self.last_drops = drops
+        return delta
+
+    def _correlate(self, session, timestamp, rtt, baseline):
+        drops = self._drops_since_last()
+        spike = baseline is not None and rtt >= self.spike_floor and \
+            rtt >= baseline * self.spike_factor
+        tally = self.spike_drops if spike else self.normal_drops
+        tally[0] += 1
+        if drops:
+            tally[1] += 1
+        if spike:
+            self.spikes.append((timestamp, session, rtt, baseline, drops))
+            if len(self.spikes) > 100:
+                self.spikes.pop(0)
+
+    def drop_correlation(self):
+        """Share of spikes and of normal samples that coincided with capture drops"""
+        spikes, spikes_with_drops = self.spike_drops
+        normal, normal_with_drops = self.normal_drops
+        return {
+            'spikes': spikes,
+            'spikes_with_drops': spikes_with_drops,
+            'spike_drop_share': round(spikes_with_drops / spikes, 3) if spikes else 0.0,
+            'normal_drop_share': round(normal_with_drops / normal, 3) if normal else 0.0,
+        }
+
+    def forget(self, session):
+        """Drop the state of a finished session (the overall histogram keeps its samples)"""
+        self.pending.pop(session, None)
+        self.sessions.pop(session, None)
+        self.baselines.pop(session, None)
+
+    def session_summary(self, session):
+        histogram = self.sessions.get(session)
+        return histogram.summary() if histogram is not None else {}
+
+    def print_report(self):
+        print(f"\nPing latency ({self.overall.total} samples, {len(self.sessions)} session(s), "
+              f"{self.unmatched} unmatched pongs)")
+        print(f"{'Session':<24} {'Count':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'Max ms':>8}")
+        print("-" * 68)
+        rows = [("ALL", self.overall)] + sorted(self.sessions.items())
+        for session, histogram in rows:
+            summary = histogram.summary()
+            print(f"{session:<24} {summary['count']:>7} {summary['p50_ms']:>8} "
+                  f"{summary['p90_ms']:>8} {summary['p99_ms']:>8} {summary['max_ms']:>8}")
+        if self.drop_source is not None:
+            correlation = self.drop_correlation()
+            print(f"Spikes: {correlation['spikes']}, "
+                  f"{correlation['spike_drop_share'] * 100:.1f}% with capture drops "
+                  f"(vs {correlation['normal_drop_share'] * 100:.1f}% of normal samples)")
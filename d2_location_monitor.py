@@ -1,3 +1,4 @@
+import argparse
 import json
 import struct
 import threading
@@ -6,13 +7,130 @@ from datetime import datetime
 from scapy.all import *
 from scapy.layers.inet import IP, TCP, UDP
 from scapy.layers.l2 import Ether
+from d2_packet_codec import (D2PacketCodec, DecodeError, HPMPUPDATE_BITS, HPMPUPDATE2_BITS,
+                             WALKVERIFY_BITS, unpack_bits)
+from d2_discovery import PacketDiscovery
+from d2_event_bus import EventBus, DEFAULT_BUS_NAME
+from d2_flows import FlowTable, TCP_FIN, TCP_RST, pack_flow
+from d2_pcap_writer import RotatingPcapWriter
+from d2_export import StreamExporter
+from d2_latency import PingTracker
+from d2_metrics import D2Metrics, PACKET_ID_LABELS
+from d2_alerts import AlertEngine, FileSink, WebhookSink
+from d2_profiler import HotPathProfiler
+from d2_reconciliation import LARGE_PATH_ERROR, MODERATE_PATH_ERROR, ReconcilerTable
+from d2_recorder import SessionRecorder, DIRECTION_CLIENT, DIRECTION_SERVER, flow_key
+from d2_replay import PcapReplayer
+from d2_snapshot import MonitorSnapshot
 
 class D2DualLocationMonitor:
-    def __init__(self, client_json="client2gs.json", server_json="gs2client.json"):
+    def __init__(self, client_json="client2gs.json", server_json="gs2client.json", metrics=None,
+                 profiler=None, recorder=None, alerts=None, discovery=None, bus=None,
+                 pcap_writer=None, exporter=None):
         """Initialize the dual location monitor with packet definitions"""
         self.client_packet_definitions = self.load_packet_definitions(client_json)
         self.server_packet_definitions = self.load_packet_definitions(server_json)
         
+        # Compiled codecs shared by all parsers
+        self.client_codec = D2PacketCodec(self.client_packet_definitions)
+        self.server_codec = D2PacketCodec(self.server_packet_definitions)
+        
+        # Packet IDs loaded from JSON
+        self.client_movement_packets = {}
+        self.client_stamina_packets = {}
+        self.server_movement_packets = {}
+        self.server_status_packets = {}
+        self.load_packet_ids()
+        
+        # Movement history length for both client and server
+        self.max_history = 50
+        
+        # Display update thread
+        self.running = False
+        self.display_thread = None
+        
+        # Game server ports and optional D2Metrics instrumentation
+        self.game_ports = (4000, 6112)
+        self.metrics = metrics
+        
+        # Optional HotPathProfiler for per-stage timings
+        self.profiler = profiler
+        
+        # Optional SessionRecorder that keeps every game message on disk
+        self.recorder = recorder
+        if recorder is not None:
+            recorder.set_codecs(self.client_codec, self.server_codec)
+        
+        # Optional EventBus that shares every game message with local processes
+        self.bus = bus
+        
+        # Optional RotatingPcapWriter for the raw game-port frames; with a
+        # pre-alert window it only keeps the traffic around fired alerts
+        self.pcap_writer = pcap_writer
+        if pcap_writer is not None and pcap_writer.pre_alert is not None and alerts is not None:
+            alerts.add_sink(pcap_writer.trigger)
+        
+        # Optional StreamExporter shipping selected messages and per-session
+        # aggregates to a collector; selected after the packet ids are loaded
+        self.exporter = exporter
+        self.next_export = 0.0
+        
+        # Optional AlertEngine fed per session ("client ip:port") as packets arrive
+        self.alerts = alerts
+        self.ping_id = self.client_codec['D2GS_PING'].packet_id if 'D2GS_PING' in self.client_codec else 0x6D
+        self.pong_id = self.server_codec['D2GS_PONG'].packet_id if 'D2GS_PONG' in self.server_codec else 0x8F
+        
+        # Optional census of every (direction, packet id, length); discovery is
+        # the path its report is written to when monitoring stops
+        self.discovery_path = discovery
+        self.discovery = PacketDiscovery(self.client_codec, self.server_codec) if discovery else None
+        
+        # Subscriber dispatch tables per direction, indexed by packet id; the
+        # monitor's own position and status tracking subscribes first
+        self.subscribers = ([None] * 256, [None] * 256)
+        self.subscriber_errors = 0
+        self.subscribe_builtins()
+        
+        # Positions, histories, flows and latency start out empty
+        self.reset_state()
+        
+        if exporter is not None and not exporter.selected:
+            # Movement commands and updates in full, HP/MP/stamina as latest value
+            exporter.select(DIRECTION_CLIENT, self.client_movement_packets)
+            exporter.select(DIRECTION_CLIENT, self.client_stamina_packets)
+            exporter.select(DIRECTION_SERVER, self.server_movement_packets)
+            exporter.select(DIRECTION_SERVER, self.server_status_packets, conflate=True)
+        
+        # Immutable state snapshot for the display and exporters, republished
+        # every snapshot_batch packets or snapshot_interval seconds. Only the
+        # capture thread builds snapshots; when a burst ended before the
+        # interval ran out, the display raises publish_requested instead
+        self.snapshot_batch = 256
+        self.snapshot_interval = 0.1
+        self.snapshot_version = 0
+        self.unpublished = 0
+        self.last_publish = 0.0
+        self.publish_requested = False
+        self.snapshot = None
+        self.publish_snapshot()
+        
+        print("D2 Enhanced Player Monitor Initialized")
+        print("Monitoring client commands and server updates...")
+        print(f"Client movement packets: {list(self.client_movement_packets.keys())}")
+        print(f"Client stamina packets: {list(self.client_stamina_packets.keys())}")
+        print(f"Server movement packets: {list(self.server_movement_packets.keys())}")
+        print(f"Server status packets: {list(self.server_status_packets.keys())}")
+        print("-" * 60)
+    
+    def reset_state(self):
+        """Forget everything learned from packets, keeping the attached sinks
+
+        Called on construction and by PcapReplayer before each replay speed,
+        so every run starts from the same state. The discovery census and
+        the alert engine's sessions and counts are reset as well; what was
+        already handed to the recorder, event bus, pcap writer, exporter
+        and alert sinks stays written, so their output holds every run.
+        """
         # Client-side position (movement commands sent TO server)
         self.client_x = 0
         self.client_y = 0
@@ -30,32 +148,38 @@ class D2DualLocationMonitor:
         self.server_stamina = 0
         self.server_max_stamina = 0
         self.server_hp_percent = 0
+        self.server_unit_guid = None
+        self.server_target_x = None
+        self.server_target_y = None
         self.server_last_update = None
         self.server_packet_count = 0
         
-        # Packet IDs loaded from JSON
-        self.client_movement_packets = {}
-        self.client_stamina_packets = {}
-        self.server_movement_packets = {}
-        self.server_status_packets = {}
-        self.load_packet_ids()
-        
         # Movement history for both client and server
         self.client_history = []
         self.server_history = []
-        self.max_history = 50
         
-        # Display update thread
-        self.running = False
-        self.display_thread = None
+        # Matches client commands to server moves and interpolates the server
+        # path, separately for every session
+        self.reconciler = ReconcilerTable()
         
-        print("D2 Enhanced Player Monitor Initialized")
-        print("Monitoring client commands and server updates...")
-        print(f"Client movement packets: {list(self.client_movement_packets.keys())}")
-        print(f"Client stamina packets: {list(self.client_stamina_packets.keys())}")
-        print(f"Server movement packets: {list(self.server_movement_packets.keys())}")
-        print(f"Server status packets: {list(self.server_status_packets.keys())}")
-        print("-" * 60)
+        # Capture time and session of the packet being handled (None outside packet_handler)
+        self.packet_time = None
+        self.session = None
+        
+        # Round trips of client pings, paired with the server pong per session
+        self.latency = PingTracker()
+        
+        if self.alerts is not None:
+            self.alerts.reset()
+        if self.discovery is not None:
+            self.discovery.reset()
+        
+        # Bounded table of live flows; per-session state elsewhere is released
+        # when a flow ends or is evicted. flow is the entry of the current packet
+        self.flows = FlowTable(on_evict=self.flow_evicted)
+        self.flow = None
+        if self.metrics is not None:
+            self.metrics.flows.set_function(self.flows.__len__)
     
     def load_packet_definitions(self, json_file):
         """Load packet definitions from JSON file"""
@@ -139,72 +263,74 @@ class D2DualLocationMonitor:
         else:
             self.server_status_packets[0x96] = "D2GS_WALKVERIFY"  # Default
 
-    def parse_client_movement_packet(self, packet_data, packet_type):
-        """Parse client movement packet and extract target coordinates"""
-        try:
-            if len(packet_data) < 5:  # Minimum size for movement packets
-                return None, None
-            
-            # Parse the packet structure: [PacketId][nTargetX][nTargetY]
-            packet_id = struct.unpack('B', packet_data[0:1])[0]
-            target_x = struct.unpack('<H', packet_data[1:3])[0]  # Little endian short
-            target_y = struct.unpack('<H', packet_data[3:5])[0]  # Little endian short
-            
-            return target_x, target_y
-            
-        except (struct.error, IndexError) as e:
-            return None, None
+    def count_decode_error(self, error):
+        """Record a packet that matched an id but failed to decode"""
+        if self.metrics is not None:
+            self.metrics.count_decode_error(error)
     
-    def parse_server_movement_packet(self, packet_data, packet_type):
-        """Parse server movement packets - D2GS_PLAYERSTOP and D2GS_PLAYERMOVE"""
-        try:
-            if packet_type == "D2GS_PLAYERSTOP":
-                # D2GS_PLAYERSTOP: [PacketId][nUnitType][nUnitGUID][bHitClass][nUnitX][nUnitY][nUnitHitClass][nUnitLife]
-                if len(packet_data) >= 13:
-                    packet_id = struct.unpack('B', packet_data[0:1])[0]
-                    unit_type = struct.unpack('B', packet_data[1:2])[0]
-                    unit_guid = struct.unpack('<I', packet_data[2:6])[0]
-                    hit_class = struct.unpack('B', packet_data[6:7])[0]
-                    pos_x = struct.unpack('<H', packet_data[7:9])[0]
-                    pos_y = struct.unpack('<H', packet_data[9:11])[0]
-                    unit_hit_class = struct.unpack('B', packet_data[11:12])[0]
-                    unit_life = struct.unpack('B', packet_data[12:13])[0]
-                    
-                    # Store life percentage
-                    self.server_hp_percent = unit_life
-                    return pos_x, pos_y
-                    
-            elif packet_type == "D2GS_PLAYERMOVE":
-                # D2GS_PLAYERMOVE: [PacketId][nUnitType][nUnitGUID][nMoveType][nTargetX][nTargetY][nUnitHitClass][nUnitX][nUnitY]
-                if len(packet_data) >= 16:
-                    packet_id = struct.unpack('B', packet_data[0:1])[0]
-                    unit_type = struct.unpack('B', packet_data[1:2])[0]
-                    unit_guid = struct.unpack('<I', packet_data[2:6])[0]
-                    move_type = struct.unpack('B', packet_data[6:7])[0]
-                    target_x = struct.unpack('<H', packet_data[7:9])[0]
-                    target_y = struct.unpack('<H', packet_data[9:11])[0]
-                    unit_hit_class = struct.unpack('B', packet_data[11:12])[0]
-                    current_x = struct.unpack('<H', packet_data[12:14])[0]
-                    current_y = struct.unpack('<H', packet_data[14:16])[0]
-                    
-                    return current_x, current_y
-            
-            return None, None
-            
-        except (struct.error, IndexError) as e:
-            return None, None
+    def subscribe_builtins(self):
+        """Track positions and status through on(), like any other consumer"""
+        builtins = ((self.client_movement_packets, self.on_client_movement, "client"),
+                    (self.client_stamina_packets, self.on_client_stamina, "client"),
+                    (self.server_movement_packets, self.on_server_movement, "server"),
+                    (self.server_status_packets, self.on_server_status, "server"))
+        for packets, callback, direction in builtins:
+            for packet_type in packets.values():
+                try:
+                    self.on(packet_type, callback, direction=direction)
+                except ValueError:
+                    print(f"Warning: {packet_type} missing from the {direction} definitions, not tracked")
+    
+    def on_client_movement(self, message, timestamp):
+        """Client WALKTOLOCATION/RUNTOLOCATION: the target the player was sent to"""
+        x, y = message['nTargetX'], message['nTargetY']
+        self.lap("decode")
+        self.update_client_location(x, y, message.name)
+    
+    def on_client_stamina(self, message, timestamp):
+        """Client STAMINA_ON/STAMINA_OFF: running or walking"""
+        self.lap("decode")
+        self.update_client_stamina(message.name == "D2GS_STAMINA_ON", message.name)
+    
+    def on_server_movement(self, message, timestamp):
+        """Server PLAYERSTOP/PLAYERMOVE: the authoritative position"""
+        # Every field is read before any state changes, so a short message changes nothing
+        unit_guid = message['nUnitGUID']
+        x, y = message['nUnitX'], message['nUnitY']
+        if message.name == "D2GS_PLAYERSTOP":
+            life = message['nUnitLife']
+        else:
+            target_x, target_y = message['nTargetX'], message['nTargetY']
+        self.lap("decode")
+        
+        self.server_unit_guid = unit_guid
+        if message.name == "D2GS_PLAYERSTOP":
+            # Store life percentage
+            self.server_hp_percent = life
+        else:
+            self.server_target_x = target_x
+            self.server_target_y = target_y
+        self.update_server_location(x, y, message.name)
+    
+    def on_server_status(self, message, timestamp):
+        """Server HPMPUPDATE/HPMPUPDATE2/WALKVERIFY bitstreams"""
+        payload = bytes(message.buffer[message.offset:])
+        hp, mp, stamina, x, y = self.parse_server_status_packet(payload, message.name)
+        self.lap("decode")
+        
+        if any(v is not None for v in [hp, mp, stamina, x, y]):
+            self.update_server_status(hp, mp, stamina, x, y, message.name)
     
     def parse_server_status_packet(self, packet_data, packet_type):
         """Parse server HP/MP/Stamina status packets"""
         try:
             if packet_type in ["D2GS_HPMPUPDATE2", "D2GS_HPMPUPDATE", "D2GS_WALKVERIFY"]:
-                # These packets contain bitstream data that needs special parsing
-                # For now, we'll extract what we can from the basic structure
+                # These packets carry LSB-first bitstreams, see HPMPUPDATE_BITS
+                # and friends in d2_packet_codec
                 
                 if packet_type == "D2GS_HPMPUPDATE2" and len(packet_data) >= 15:
                     # Contains HP, MP, Stamina, HPRegen, MPRegen, X, Y, dX, dY in bitstream
                     bitstream = packet_data[1:15]  # Skip packet ID
-                    # This would need proper bitstream parsing - placeholder for now
                     return self.parse_bitstream_hpmp_full(bitstream)
                     
                 elif packet_type == "D2GS_HPMPUPDATE" and len(packet_data) >= 13:
@@ -223,48 +349,28 @@ class D2DualLocationMonitor:
             return None, None, None, None, None
     
     def parse_bitstream_hpmp_full(self, bitstream):
-        """Parse full HP/MP/Stamina bitstream (15-bit values)"""
-        # Simplified parsing - would need proper bitstream implementation
-        # This is a placeholder that tries to extract basic info
+        """Parse the D2GS_HPMPUPDATE2 bitstream (HPMPUPDATE2_BITS)"""
         try:
-            if len(bitstream) >= 14:
-                # Rough approximation - actual bitstream parsing is complex
-                hp = struct.unpack('<H', bitstream[0:2])[0] & 0x7FFF  # 15 bits
-                mp = struct.unpack('<H', bitstream[2:4])[0] & 0x7FFF  # 15 bits
-                stamina = struct.unpack('<H', bitstream[4:6])[0] & 0x7FFF  # 15 bits
-                x = struct.unpack('<H', bitstream[8:10])[0]  # 16 bits
-                y = struct.unpack('<H', bitstream[10:12])[0]  # 16 bits
-                return hp, mp, stamina, x, y
-        except:
-            pass
-        return None, None, None, None, None
+            values = unpack_bits(HPMPUPDATE2_BITS, bitstream)
+        except ValueError:
+            return None, None, None, None, None
+        return values['hp'], values['mp'], values['stamina'], values['x'], values['y']
     
     def parse_bitstream_hpmp(self, bitstream):
-        """Parse HP/MP/Stamina bitstream (15-bit values)"""
-        # Simplified parsing - would need proper bitstream implementation
+        """Parse the D2GS_HPMPUPDATE bitstream (HPMPUPDATE_BITS)"""
         try:
-            if len(bitstream) >= 12:
-                hp = struct.unpack('<H', bitstream[0:2])[0] & 0x7FFF
-                mp = struct.unpack('<H', bitstream[2:4])[0] & 0x7FFF
-                stamina = struct.unpack('<H', bitstream[4:6])[0] & 0x7FFF
-                x = struct.unpack('<H', bitstream[6:8])[0]
-                y = struct.unpack('<H', bitstream[8:10])[0]
-                return hp, mp, stamina, x, y
-        except:
-            pass
-        return None, None, None, None, None
+            values = unpack_bits(HPMPUPDATE_BITS, bitstream)
+        except ValueError:
+            return None, None, None, None, None
+        return values['hp'], values['mp'], values['stamina'], values['x'], values['y']
     
     def parse_bitstream_stamina(self, bitstream):
-        """Parse Stamina/Position bitstream"""
+        """Parse the D2GS_WALKVERIFY bitstream (WALKVERIFY_BITS)"""
         try:
-            if len(bitstream) >= 8:
-                stamina = struct.unpack('<H', bitstream[0:2])[0] & 0x7FFF
-                x = struct.unpack('<H', bitstream[2:4])[0]
-                y = struct.unpack('<H', bitstream[4:6])[0]
-                return None, None, stamina, x, y
-        except:
-            pass
-        return None, None, None, None, None
+            values = unpack_bits(WALKVERIFY_BITS, bitstream)
+        except ValueError:
+            return None, None, None, None, None
+        return None, None, values['stamina'], values['x'], values['y']
 
     def update_client_location(self, x, y, packet_type):
         """Update client-side location (movement commands)"""
@@ -285,10 +391,17 @@ class D2DualLocationMonitor:
         if len(self.client_history) > self.max_history:
             self.client_history.pop(0)
         
+        if self.session is not None:
+            self.reconciler.client_command(self.session, self.event_time(), x, y,
+                                           packet_type == "D2GS_RUNTOLOCATION")
+        
+        self.lap("state")
+        
         # Log the movement
         timestamp = self.client_last_update.strftime("%H:%M:%S.%f")[:-3]
         stamina_status = "🏃‍♂️" if self.client_stamina_running else "🚶‍♂️"
         print(f"[{timestamp}] CLIENT {packet_type}: Target ({x}, {y}) {stamina_status}")
+        self.lap("display")
     
     def update_client_stamina(self, running, packet_type):
         """Update client-side stamina status"""
@@ -296,10 +409,13 @@ class D2DualLocationMonitor:
         self.client_last_update = datetime.now()
         self.client_packet_count += 1
         
+        self.lap("state")
+        
         # Log the stamina change
         timestamp = self.client_last_update.strftime("%H:%M:%S.%f")[:-3]
         status = "🏃‍♂️ Running" if running else "🚶‍♂️ Walking"
         print(f"[{timestamp}] CLIENT {packet_type}: {status}")
+        self.lap("display")
     
     def update_server_location(self, x, y, packet_type):
         """Update server-side location (position updates)"""
@@ -320,15 +436,32 @@ class D2DualLocationMonitor:
         if len(self.server_history) > self.max_history:
             self.server_history.pop(0)
         
+        if self.session is not None:
+            fixes = self.reconciler.path_error.count
+            if packet_type == "D2GS_PLAYERMOVE":
+                rtt = self.reconciler.server_move(self.session, self.event_time(), self.server_unit_guid,
+                                                  x, y, self.server_target_x, self.server_target_y)
+                if rtt is not None and self.metrics is not None:
+                    self.metrics.command_rtt.observe(rtt)
+            else:
+                self.reconciler.server_position(self.session, self.event_time(), self.server_unit_guid,
+                                                x, y, stopped=True)
+            if self.reconciler.path_error.count != fixes:
+                self.alert("desync", self.reconciler.path_error.last)
+        
+        self.lap("state")
+        
         # Log the movement
         timestamp = self.server_last_update.strftime("%H:%M:%S.%f")[:-3]
         health_info = f" (HP: {self.server_hp_percent}%)" if self.server_hp_percent > 0 else ""
         print(f"[{timestamp}] SERVER {packet_type}: Position ({x}, {y}){health_info}")
+        self.lap("display")
     
     def update_server_status(self, hp, mp, stamina, x, y, packet_type):
         """Update server-side status (HP/MP/Stamina updates)"""
         if hp is not None:
             self.server_hp = hp
+            self.alert("hp", hp)
         if mp is not None:
             self.server_mp = mp
         if stamina is not None:
@@ -354,6 +487,8 @@ class D2DualLocationMonitor:
         if len(self.server_history) > self.max_history:
             self.server_history.pop(0)
         
+        self.lap("state")
+        
         # Log the status update
         timestamp = self.server_last_update.strftime("%H:%M:%S.%f")[:-3]
         status_parts = []
@@ -368,111 +503,343 @@ class D2DualLocationMonitor:
         
         status_str = ", ".join(status_parts) if status_parts else "Status update"
         print(f"[{timestamp}] SERVER {packet_type}: {status_str}")
+        self.lap("display")
     
     def calculate_position_difference(self):
-        """Calculate the difference between client and server positions"""
-        if self.client_x == 0 and self.client_y == 0:
-            return 0, 0, 0
-        if self.server_x == 0 and self.server_y == 0:
-            return 0, 0, 0
-        
-        diff_x = self.client_x - self.server_x
-        diff_y = self.client_y - self.server_y
-        distance = (diff_x**2 + diff_y**2)**0.5
-        
-        return diff_x, diff_y, round(distance, 2)
+        """Error of the last server position against the interpolated server path"""
+        return self.reconciler.last_error
+    
+    def event_time(self):
+        """Capture time of the current packet, or now outside the capture path"""
+        return self.packet_time if self.packet_time is not None else time.time()
     
     def packet_handler(self, packet):
         """Handle captured packets and check for movement commands/updates"""
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        packet_type = "non-game"
         try:
-            # Check TCP packets
-            if packet.haslayer(TCP) and packet.haslayer(Raw):
-                tcp_layer = packet[TCP]
-                
-                # Check D2 ports
-                if tcp_layer.dport in [4000, 6112] or tcp_layer.sport in [4000, 6112]:
-                    payload = packet[Raw].load
-                    
-                    if len(payload) >= 1:
-                        packet_id = payload[0]
-                        
-                        # Check for client movement commands (TO server)
-                        if packet_id in self.client_movement_packets:
-                            packet_type = self.client_movement_packets[packet_id]
-                            x, y = self.parse_client_movement_packet(payload, packet_type)
-                            
-                            if x is not None and y is not None:
-                                self.update_client_location(x, y, packet_type)
-                        
-                        # Check for client stamina commands
-                        elif packet_id in self.client_stamina_packets:
-                            packet_type = self.client_stamina_packets[packet_id]
-                            running = self.parse_client_stamina_packet(payload, packet_type)
-                            
-                            if running is not None:
-                                self.update_client_stamina(running, packet_type)
-                        
-                        # Check for server movement updates (FROM server)
-                        elif packet_id in self.server_movement_packets:
-                            packet_type = self.server_movement_packets[packet_id]
-                            x, y = self.parse_server_movement_packet(payload, packet_type)
-                            
-                            if x is not None and y is not None:
-                                self.update_server_location(x, y, packet_type)
-                        
-                        # Check for server status updates (FROM server)
-                        elif packet_id in self.server_status_packets:
-                            packet_type = self.server_status_packets[packet_id]
-                            hp, mp, stamina, x, y = self.parse_server_status_packet(payload, packet_type)
-                            
-                            if any(v is not None for v in [hp, mp, stamina, x, y]):
-                                self.update_server_status(hp, mp, stamina, x, y, packet_type)
+            if self.publish_requested:
+                self.publish_snapshot()
+                self.lap("snapshot")
+            self.packet_time = float(packet.time)
+            self.flow = None
+            self.session = None
+            
+            # Check TCP packets, then UDP packets
+            if packet.haslayer(TCP):
+                transport = packet[TCP]
+            elif packet.haslayer(UDP):
+                transport = packet[UDP]
+            else:
+                return
+            game_port = transport.dport in self.game_ports or transport.sport in self.game_ports
+            
+            # Every game-port frame is saved, handshakes and bare ACK/FIN/RST included
+            if game_port and self.pcap_writer is not None:
+                self.write_frame(packet)
+                self.lap("pcap")
             
-            # Check UDP packets
-            elif packet.haslayer(UDP) and packet.haslayer(Raw):
-                udp_layer = packet[UDP]
+            if not packet.haslayer(Raw):
+                # Bare FIN/RST segments still end their flow
+                if isinstance(transport, TCP) and transport.flags & (TCP_FIN | TCP_RST):
+                    self.close_flow(packet, transport)
+                return
+            
+            # Check D2 ports
+            if game_port:
+                payload = packet[Raw].load
+                if self.exporter is not None:
+                    self.exporter.raw_bytes += len(getattr(packet, 'original', None) or payload)
+            else:
+                payload = b""
+            self.lap("extract")
+            
+            if len(payload) >= 1:
+                direction = DIRECTION_CLIENT if transport.dport in self.game_ports else DIRECTION_SERVER
+                flow = self.track_flow(packet, transport, direction, len(payload))
+                self.lap("flows")
+                if metrics is not None:
+                    label = "client" if direction == DIRECTION_CLIENT else "server"
+                    metrics.packets.inc(label)
+                    metrics.bytes.inc(label, amount=len(payload))
+                    metrics.packet_ids.inc(label, PACKET_ID_LABELS[payload[0]])
+                    self.lap("metrics")
+                if self.discovery is not None:
+                    self.discovery.record(direction, payload)
+                    self.lap("discovery")
+                if self.recorder is not None or self.bus is not None or self.exporter is not None:
+                    self.record_event(packet, transport, payload)
+                    self.lap("record")
+                # Per-session consumers need a flow; non-IPv4 packets have none
+                if self.alerts is not None and flow is not None:
+                    self.alert_event(packet, transport, payload)
+                    self.lap("alerts")
+                if (payload[0] == self.ping_id or payload[0] == self.pong_id) and flow is not None:
+                    self.latency_event(packet, transport, payload)
+                    self.lap("latency")
+                # Only subscribed packet ids are decoded at all
+                subscriptions = self.subscribers[direction][payload[0]]
+                if subscriptions is not None:
+                    packet_type = subscriptions[0][0].name
+                    self.lap("framing")
+                    self.dispatch(subscriptions, payload)
+                else:
+                    packet_type = "unknown"
                 
-                if udp_layer.dport in [4000, 6112] or udp_layer.sport in [4000, 6112]:
-                    payload = packet[Raw].load
-                    
-                    if len(payload) >= 1:
-                        packet_id = payload[0]
-                        
-                        # Check for client movement commands
-                        if packet_id in self.client_movement_packets:
-                            packet_type = self.client_movement_packets[packet_id]
-                            x, y = self.parse_client_movement_packet(payload, packet_type)
-                            
-                            if x is not None and y is not None:
-                                self.update_client_location(x, y, packet_type)
-                        
-                        # Check for client stamina commands
-                        elif packet_id in self.client_stamina_packets:
-                            packet_type = self.client_stamina_packets[packet_id]
-                            running = self.parse_client_stamina_packet(payload, packet_type)
-                            
-                            if running is not None:
-                                self.update_client_stamina(running, packet_type)
-                        
-                        # Check for server movement updates
-                        elif packet_id in self.server_movement_packets:
-                            packet_type = self.server_movement_packets[packet_id]
-                            x, y = self.parse_server_movement_packet(payload, packet_type)
-                            
-                            if x is not None and y is not None:
-                                self.update_server_location(x, y, packet_type)
-                        
-                        # Check for server status updates
-                        elif packet_id in self.server_status_packets:
-                            packet_type = self.server_status_packets[packet_id]
-                            hp, mp, stamina, x, y = self.parse_server_status_packet(payload, packet_type)
-                            
-                            if any(v is not None for v in [hp, mp, stamina, x, y]):
-                                self.update_server_status(hp, mp, stamina, x, y, packet_type)
+                self.unpublished += 1
+                if self.unpublished >= self.snapshot_batch or \
+                        time.perf_counter() - self.last_publish >= self.snapshot_interval:
+                    self.publish_snapshot()
+                    self.lap("snapshot")
+                
+                if flow is not None and isinstance(transport, TCP) and \
+                        transport.flags & (TCP_FIN | TCP_RST):
+                    self.flows.tcp_flags(flow, int(transport.flags), direction)
                                 
         except Exception as e:
-            # Silently ignore parsing errors
-            pass
+            # Parsing errors are only counted, never allowed to stop the capture
+            if metrics is not None:
+                metrics.count_decode_error(e)
+        finally:
+            if metrics is not None:
+                metrics.handler_seconds.observe(time.perf_counter() - started)
+            if profiler is not None:
+                profiler.finish(packet_type)
+    
+    def write_frame(self, packet):
+        """Queue the captured frame, as received, for the pcap writer"""
+        writer = self.pcap_writer
+        if writer.linktype is None:
+            writer.linktype = conf.l2types.layer2num.get(type(packet), 1)
+        frame = getattr(packet, 'original', None)
+        writer.write(self.packet_time, frame if frame else bytes(packet))
+    
+    def track_flow(self, packet, transport, direction, size):
+        """Refresh the flow table entry of a game packet and make it current
+
+        Packets without an IPv4 layer have no flow; self.flow and
+        self.session stay None, and the per-session consumers skip them.
+        """
+        if not packet.haslayer(IP):
+            return None
+        ip_layer = packet[IP]
+        protocol = ip_layer.proto
+        if direction == DIRECTION_CLIENT:
+            flow = self.flows.track(ip_layer.src, transport.sport, ip_layer.dst, transport.dport,
+                                    protocol, self.packet_time, size)
+        else:
+            flow = self.flows.track(ip_layer.dst, transport.dport, ip_layer.src, transport.sport,
+                                    protocol, self.packet_time, size)
+        self.flow = flow
+        self.session = flow.session
+        return flow
+    
+    def close_flow(self, packet, transport):
+        """Apply a payload-less FIN/RST to its flow, if the flow is tracked"""
+        if not packet.haslayer(IP):
+            return
+        ip_layer = packet[IP]
+        if transport.dport in self.game_ports:
+            direction = DIRECTION_CLIENT
+            key = pack_flow(ip_layer.src, transport.sport, ip_layer.dst, transport.dport, ip_layer.proto)
+        elif transport.sport in self.game_ports:
+            direction = DIRECTION_SERVER
+            key = pack_flow(ip_layer.dst, transport.dport, ip_layer.src, transport.sport, ip_layer.proto)
+        else:
+            return
+        flow = self.flows.get(key)
+        if flow is not None:
+            self.flows.tcp_flags(flow, int(transport.flags), direction)
+    
+    def flow_evicted(self, flow, reason):
+        """Release per-session state of a flow that left the flow table"""
+        if self.alerts is not None:
+            self.alerts.forget(flow.session)
+        self.latency.forget(flow.session)
+        self.reconciler.forget(flow.session)
+        if self.metrics is not None:
+            self.metrics.flow_evictions.inc(reason)
+    
+    def record_event(self, packet, transport, payload):
+        """Hand a game message to the recorder, event bus and exporter, keyed by the client end of its flow"""
+        if self.flow is not None:
+            direction = DIRECTION_CLIENT if transport.dport in self.game_ports else DIRECTION_SERVER
+            flow = self.flow.client_flow
+        elif not packet.haslayer(IP):
+            return
+        elif transport.dport in self.game_ports:
+            direction = DIRECTION_CLIENT
+            flow = flow_key(packet[IP].src, transport.sport)
+        else:
+            direction = DIRECTION_SERVER
+            flow = flow_key(packet[IP].dst, transport.dport)
+        timestamp_ns = int(packet.time * 1e9)
+        if self.recorder is not None:
+            self.recorder.record(timestamp_ns, flow, direction, payload)
+        if self.bus is not None:
+            self.bus.publish(timestamp_ns, flow, direction, payload)
+        if self.exporter is not None:
+            self.exporter.event(timestamp_ns, flow, direction, payload)
+    
+    def identify_session(self, packet, transport):
+        """True for client packets; self.session was set by track_flow"""
+        return transport.dport in self.game_ports
+    
+    def alert_event(self, packet, transport, payload):
+        """Feed per-packet alert metrics: packet rate, unknown ids and pings"""
+        client_to_server = self.identify_session(packet, transport)
+        codec = self.client_codec if client_to_server else self.server_codec
+        
+        packet_id = payload[0]
+        self.alert("packet")
+        if packet_id not in codec.by_id:
+            self.alert("unknown_packet", packet_id)
+        elif client_to_server and packet_id == self.ping_id:
+            self.alert("ping")
+    
+    def latency_event(self, packet, transport, payload):
+        """Pair a client D2GS_PING with the server D2GS_PONG carrying its tick count"""
+        client_to_server = self.identify_session(packet, transport)
+        try:
+            if client_to_server and payload[0] == self.ping_id:
+                fields = self.client_codec['D2GS_PING'].decode(payload)
+                self.latency.ping(self.session, self.event_time(), fields['nTickCount'])
+            elif not client_to_server and payload[0] == self.pong_id:
+                fields = self.server_codec['D2GS_PONG'].decode(payload)
+                rtt = self.latency.pong(self.session, self.event_time(), fields['nTickCount'])
+                if rtt is not None:
+                    if self.metrics is not None:
+                        self.metrics.ping_rtt.observe(rtt)
+                    self.alert("latency", rtt)
+        except (struct.error, KeyError) as e:
+            self.count_decode_error(e)
+    
+    def alert(self, metric, value=1.0):
+        """Pass one metric event of the current session to the alert engine"""
+        if self.alerts is not None and self.session is not None:
+            self.alerts.observe(self.session, metric, self.event_time(), value)
+    
+    def on(self, packet_name, callback, fields=None, direction=None):
+        """Call callback(message, timestamp) for every packet_name message
+        
+        direction is "client", "server" or None for whichever definition file
+        has the packet. message is a LazyMessage that unpacks fields when they
+        are read; with fields, callback gets a dict of just those fields.
+        Only subscribed packet ids are decoded at all.
+        """
+        codecs = []
+        if direction in (None, "client") and packet_name in self.client_codec:
+            codecs.append((DIRECTION_CLIENT, self.client_codec[packet_name]))
+        if direction in (None, "server") and packet_name in self.server_codec:
+            codecs.append((DIRECTION_SERVER, self.server_codec[packet_name]))
+        if not codecs:
+            raise ValueError(f"Packet {packet_name} not found in {direction or 'any'} definitions")
+        
+        for side, codec in codecs:
+            if fields is not None:
+                unknown = [name for name in fields if name not in codec.field_names]
+                if unknown:
+                    raise ValueError(f"{packet_name} has no field(s) {', '.join(unknown)}")
+            table = self.subscribers[side]
+            entries = list(table[codec.packet_id] or ())
+            entries.append((codec, callback, tuple(fields) if fields is not None else None))
+            table[codec.packet_id] = entries
+        return callback
+    
+    def off(self, packet_name, callback):
+        """Remove a subscription made with on()"""
+        for table in self.subscribers:
+            for packet_id, entries in enumerate(table):
+                if entries is None:
+                    continue
+                remaining = [entry for entry in entries
+                             if not (entry[0].name == packet_name and entry[1] == callback)]
+                table[packet_id] = remaining or None
+    
+    def dispatch(self, subscriptions, payload):
+        """Hand one message to its subscribers as a lazy view"""
+        view = memoryview(payload)
+        timestamp = self.event_time()
+        for codec, callback, fields in subscriptions:
+            message = codec.view(view)
+            try:
+                callback(message.fields(fields) if fields is not None else message, timestamp)
+            except DecodeError as e:
+                # Raised by the message itself: too short or malformed for its layout
+                self.count_decode_error(e)
+            except Exception as e:
+                # A failing subscriber must not starve the others or stop the capture
+                self.subscriber_errors += 1
+                if self.subscriber_errors == 1:
+                    print(f"Subscriber error in {getattr(callback, '__name__', callback)}: {e!r}")
+            self.lap("subscribers")
+    
+    def publish_if_requested(self):
+        """Publish for the display when the capture side is idle (capture thread only)"""
+        if self.publish_requested:
+            self.publish_snapshot()
+    
+    def publish_snapshot(self):
+        """Swap in a new MonitorSnapshot (capture thread only)"""
+        alerts = self.alerts
+        self.snapshot_version += 1
+        self.snapshot = MonitorSnapshot(
+            version=self.snapshot_version,
+            published=datetime.now(),
+            packets=self.client_packet_count + self.server_packet_count,
+            client_x=self.client_x,
+            client_y=self.client_y,
+            client_stamina_running=self.client_stamina_running,
+            client_last_update=self.client_last_update,
+            client_packet_count=self.client_packet_count,
+            client_recent=tuple(self.client_history[-5:]),
+            server_x=self.server_x,
+            server_y=self.server_y,
+            server_hp=self.server_hp,
+            server_mp=self.server_mp,
+            server_stamina=self.server_stamina,
+            server_hp_percent=self.server_hp_percent,
+            server_last_update=self.server_last_update,
+            server_packet_count=self.server_packet_count,
+            server_recent=tuple(self.server_history[-5:]),
+            position_error=self.calculate_position_difference(),
+            reconciliation=self.reconciler.summary(),
+            latency=self.latency.overall.summary(),
+            flows=self.flows.stats(),
+            alerts_fired=alerts.fired if alerts is not None else 0,
+            recent_alerts=tuple(alerts.recent[-3:]) if alerts is not None else ())
+        self.unpublished = 0
+        self.publish_requested = False
+        self.last_publish = time.perf_counter()
+        if self.exporter is not None and self.last_publish >= self.next_export:
+            self.export_state()
+        return self.snapshot
+    
+    def export_state(self):
+        """Queue the snapshot and per-flow aggregates for the collector"""
+        exporter = self.exporter
+        self.next_export = self.last_publish + exporter.aggregate_interval
+        records = []
+        for flow in self.flows.flows.values():
+            histogram = self.latency.sessions.get(flow.session)
+            if histogram is not None and histogram.total:
+                p50, p99 = histogram.percentile(50) * 1000, histogram.percentile(99) * 1000
+            else:
+                p50 = p99 = 0.0
+            records.append((flow.client_flow, flow.packets, flow.bytes, flow.first_seen,
+                            flow.last_seen, p50, p99))
+        exporter.sessions(records)
+        exporter.snapshot(self.snapshot)
+    
+    def lap(self, stage):
+        """Close a hot-path stage when profiling"""
+        if self.profiler is not None:
+            self.profiler.lap(stage)
     
     def display_status(self):
         """Display current location and status for both client and server"""
@@ -487,15 +854,22 @@ class D2DualLocationMonitor:
                 print("=" * 80)
                 print()
                 
+                # Read one published snapshot; the capture thread never mutates it.
+                # Packets left over from a burst are published by the capture
+                # thread on its next packet or idle tick
+                snapshot = self.snapshot
+                if self.unpublished:
+                    self.publish_requested = True
+                
                 # Client position and status
                 print("CLIENT STATUS (Commands Sent to Server):")
-                print(f"  Target Location:  X={self.client_x:>6}, Y={self.client_y:>6}")
-                stamina_status = "🏃‍♂️ Running" if self.client_stamina_running else "🚶‍♂️ Walking"
+                print(f"  Target Location:  X={snapshot.client_x:>6}, Y={snapshot.client_y:>6}")
+                stamina_status = "🏃‍♂️ Running" if snapshot.client_stamina_running else "🚶‍♂️ Walking"
                 print(f"  Movement Mode:    {stamina_status}")
-                print(f"  Commands Sent:    {self.client_packet_count}")
-                if self.client_last_update:
-                    time_diff = datetime.now() - self.client_last_update
-                    print(f"  Last Command:     {self.client_last_update.strftime('%H:%M:%S')} ({time_diff.seconds}s ago)")
+                print(f"  Commands Sent:    {snapshot.client_packet_count}")
+                if snapshot.client_last_update:
+                    time_diff = datetime.now() - snapshot.client_last_update
+                    print(f"  Last Command:     {snapshot.client_last_update.strftime('%H:%M:%S')} ({time_diff.seconds}s ago)")
                 else:
                     print("  Last Command:     No commands detected")
                 
@@ -503,37 +877,52 @@ class D2DualLocationMonitor:
                 
                 # Server position and status
                 print("SERVER STATUS (Updates from Server):")
-                print(f"  Current Location: X={self.server_x:>6}, Y={self.server_y:>6}")
-                if self.server_hp > 0 or self.server_mp > 0 or self.server_stamina > 0:
-                    print(f"  Health (HP):      {self.server_hp:>6}")
-                    print(f"  Mana (MP):        {self.server_mp:>6}")
-                    print(f"  Stamina:          {self.server_stamina:>6}")
-                if self.server_hp_percent > 0:
-                    print(f"  Health Percent:   {self.server_hp_percent:>6}%")
-                print(f"  Updates Received: {self.server_packet_count}")
-                if self.server_last_update:
-                    time_diff = datetime.now() - self.server_last_update
-                    print(f"  Last Update:      {self.server_last_update.strftime('%H:%M:%S')} ({time_diff.seconds}s ago)")
+                print(f"  Current Location: X={snapshot.server_x:>6}, Y={snapshot.server_y:>6}")
+                if snapshot.server_hp > 0 or snapshot.server_mp > 0 or snapshot.server_stamina > 0:
+                    print(f"  Health (HP):      {snapshot.server_hp:>6}")
+                    print(f"  Mana (MP):        {snapshot.server_mp:>6}")
+                    print(f"  Stamina:          {snapshot.server_stamina:>6}")
+                if snapshot.server_hp_percent > 0:
+                    print(f"  Health Percent:   {snapshot.server_hp_percent:>6}%")
+                print(f"  Updates Received: {snapshot.server_packet_count}")
+                if snapshot.server_last_update:
+                    time_diff = datetime.now() - snapshot.server_last_update
+                    print(f"  Last Update:      {snapshot.server_last_update.strftime('%H:%M:%S')} ({time_diff.seconds}s ago)")
                 else:
                     print("  Last Update:      No updates detected")
                 
                 print()
                 
                 # Position difference analysis
-                diff_x, diff_y, distance = self.calculate_position_difference()
+                diff_x, diff_y, distance = snapshot.position_error
+                reconciliation = snapshot.reconciliation
                 print("POSITION ANALYSIS:")
-                print(f"  Difference:       ΔX={diff_x:>6}, ΔY={diff_y:>6}")
-                print(f"  Distance Apart:   {distance:>6} units")
+                print(f"  Path Error:       ΔX={diff_x:>6}, ΔY={diff_y:>6}")
+                print(f"  Distance Apart:   {distance:>6} units "
+                      f"(avg {reconciliation['path_error']}, max {reconciliation['path_error_max']})")
+                latency = snapshot.latency
+                print(f"  Ping RTT:         p50 {latency['p50_ms']}ms, p99 {latency['p99_ms']}ms "
+                      f"({latency['count']} pings)")
+                print(f"  Command RTT:      {reconciliation['rtt_ms']}ms "
+                      f"(±{reconciliation['rtt_jitter_ms']}ms, "
+                      f"{reconciliation['acknowledged']} acked, "
+                      f"{reconciliation['unacknowledged']} unacked)")
                 
-                if distance > 100:
+                if distance > LARGE_PATH_ERROR:
                     print("  Status:           ⚠️  Large desync detected!")
-                elif distance > 50:
+                elif distance > MODERATE_PATH_ERROR:
                     print("  Status:           ⚠️  Moderate desync")
                 elif distance > 0:
                     print("  Status:           ✅ Minor difference (normal)")
                 else:
                     print("  Status:           ✅ Positions synchronized")
                 
+                if snapshot.recent_alerts:
+                    print()
+                    print(f"ALERTS ({snapshot.alerts_fired} fired):")
+                    for alert in snapshot.recent_alerts:
+                        print(f"  {alert}")
+                
                 print()
                 print("Monitoring D2 traffic on ports 4000, 6112...")
                 print("Tracking: Movement, Health, Mana, Stamina")
@@ -545,8 +934,8 @@ class D2DualLocationMonitor:
                 print("-" * 50)
                 
                 # Show last 5 activities from each side
-                recent_client = self.client_history[-5:] if self.client_history else []
-                recent_server = self.server_history[-5:] if self.server_history else []
+                recent_client = snapshot.client_recent
+                recent_server = snapshot.server_recent
                 
                 if recent_client:
                     print("Client Commands:")
@@ -584,8 +973,13 @@ class D2DualLocationMonitor:
                 print(f"Display error: {e}")
                 time.sleep(1)
     
-    def start_monitoring(self, interface=None, filter_str="tcp or udp"):
-        """Start dual packet monitoring"""
+    def start_monitoring(self, interface=None, filter_str="tcp or udp", offline=None, speeds=None):
+        """Start dual packet monitoring (offline replays a pcap file instead)
+
+        With speeds, the pcap is replayed once per speed factor on its
+        original timeline (0 means as fast as possible) and a lag report is
+        printed for each run.
+        """
         self.running = True
         
         # Start display thread
@@ -598,7 +992,17 @@ class D2DualLocationMonitor:
             print("Monitoring for D2 player packets (movement, health, mana, stamina)...")
             
             # Start packet capture
-            if interface:
+            if offline and speeds:
+                PcapReplayer(self, offline).run_speeds(speeds)
+            elif offline:
+                sniff(offline=offline, prn=self.packet_handler, store=0)
+            elif self.metrics is not None:
+                # Open the socket ourselves so its kernel drop counters can be exported
+                capture_socket = conf.L2listen(iface=interface, filter=filter_str)
+                self.metrics.watch_capture_socket(capture_socket)
+                self.latency.set_drop_source(self.metrics.kernel_drops.function)
+                sniff(opened_socket=capture_socket, prn=self.packet_handler, store=0)
+            elif interface:
                 sniff(iface=interface, prn=self.packet_handler, filter=filter_str, store=0)
             else:
                 sniff(prn=self.packet_handler, filter=filter_str, store=0)
@@ -609,103 +1013,200 @@ class D2DualLocationMonitor:
             print(f"Monitoring error: {e}")
         finally:
             self.running = False
+            self.publish_snapshot()
+            if self.profiler is not None:
+                self.profiler.report()
+            if self.latency.overall.total:
+                self.latency.print_report()
+            flow_stats = self.flows.stats()
+            print(f"Flow table: {flow_stats['flows']}/{flow_stats['max_flows']} flows, "
+                  f"{flow_stats['created']} seen, evicted "
+                  + ", ".join(f"{reason} {flow_stats['evicted_' + reason]}"
+                              for reason in ("lru", "idle", "fin", "rst")))
+            if self.discovery is not None:
+                self.discovery.write_report(self.discovery_path)
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.bus is not None:
+                self.bus.close()
+            if self.pcap_writer is not None:
+                self.pcap_writer.close()
+            if self.exporter is not None:
+                self.export_state()
+                self.exporter.close()
+            if self.alerts is not None:
+                self.alerts.close()
     
     def get_desync_statistics(self):
         """Calculate desynchronization statistics"""
         if not self.client_history or not self.server_history:
             return {}
         
-        # Calculate average desync distance
-        total_distance = 0
-        comparisons = 0
-        
-        for client_move in self.client_history:
-            # Find closest server update in time
-            closest_server = None
-            min_time_diff = float('inf')
-            
-            for server_move in self.server_history:
-                time_diff = abs((client_move['timestamp'] - server_move['timestamp']).total_seconds())
-                if time_diff < min_time_diff:
-                    min_time_diff = time_diff
-                    closest_server = server_move
-            
-            if closest_server and min_time_diff < 5:  # Within 5 seconds
-                distance = ((client_move['x'] - closest_server['x'])**2 + 
-                           (client_move['y'] - closest_server['y'])**2)**0.5
-                total_distance += distance
-                comparisons += 1
-        
-        avg_desync = total_distance / comparisons if comparisons > 0 else 0
-        
-        return {
-            'average_desync': round(avg_desync, 2),
-            'total_comparisons': comparisons,
+        # Path error against the interpolated server path, plus command lag
+        statistics = {
+            'average_desync': round(self.reconciler.path_error.mean, 2),
+            'total_comparisons': self.reconciler.path_error.count,
             'client_movements': len(self.client_history),
             'server_updates': len(self.server_history)
         }
+        statistics.update(self.reconciler.summary())
+        return statistics
 
-    def parse_client_stamina_packet(self, packet_data, packet_type):
-        """Parse client stamina packets"""
-        try:
-            if packet_type == "D2GS_STAMINA_ON":
-                return True
-            elif packet_type == "D2GS_STAMINA_OFF":
-                return False
-        except Exception as e:
-            pass
-        return None
+def parse_arguments():
+    """Command line options; without --pcap the interactive menu is shown"""
+    parser = argparse.ArgumentParser(description="D2 Enhanced Player Monitor")
+    parser.add_argument("--profile", nargs="?", const="d2_profile.folded", default=None,
+                        metavar="FILE", help="time hot-path stages and write collapsed stacks to FILE")
+    parser.add_argument("--profile-sample", type=int, default=1, metavar="N",
+                        help="profile one packet in N (default: every packet)")
+    parser.add_argument("--pcap", metavar="FILE", help="replay a capture file instead of sniffing")
+    parser.add_argument("--speed", metavar="X[,X...]",
+                        help="replay --pcap on its original timeline at these speed factors "
+                             "(e.g. 1,10,100; 0 = max) and report lag per speed")
+    parser.add_argument("--iface", help="network interface to sniff on")
+    parser.add_argument("--metrics", metavar="PORT|FILE",
+                        help="serve Prometheus metrics on PORT, or rewrite them to the textfile FILE")
+    parser.add_argument("--record", metavar="DIR", help="record game messages to DIR")
+    parser.add_argument("--bus", nargs="?", const=DEFAULT_BUS_NAME, default=None, metavar="NAME",
+                        help="publish game messages to the shared memory event bus NAME "
+                             "(follow it with d2_event_bus.py)")
+    parser.add_argument("--write-pcap", metavar="DIR",
+                        help="write game-port frames to rotating pcap files in DIR")
+    parser.add_argument("--rotate-mb", type=float, default=100, metavar="MB",
+                        help="start a new pcap file after MB megabytes (default 100)")
+    parser.add_argument("--rotate-seconds", type=float, default=None, metavar="S",
+                        help="start a new pcap file every S seconds of capture")
+    parser.add_argument("--keep-files", type=int, default=None, metavar="N",
+                        help="delete the oldest pcap files beyond N")
+    parser.add_argument("--pre-alert", type=float, default=None, metavar="S",
+                        help="with --write-pcap and alerts, only keep the S seconds before each alert")
+    parser.add_argument("--export", metavar="TARGET",
+                        help="stream selected messages and session aggregates to a collector at "
+                             "tcp://HOST:PORT or unix:///PATH (see d2_collector.py)")
+    parser.add_argument("--node", help="node name reported to the collector (default host:pid)")
+    parser.add_argument("--discover", nargs="?", const="d2_discovery.txt", default=None, metavar="FILE",
+                        help="count every packet id/length and write a discovery report to FILE "
+                             "(.json for JSON)")
+    parser.add_argument("--alerts", metavar="FILE", help="evaluate alert rules and append alerts to FILE")
+    parser.add_argument("--webhook", metavar="URL", help="evaluate alert rules and POST alerts to URL")
+    return parser.parse_args()
+
+def open_metrics(target):
+    """D2Metrics served on a port (all digits) or written to a textfile path"""
+    metrics = D2Metrics()
+    if target.isdigit():
+        metrics.serve(int(target))
+    else:
+        metrics.export_textfile(target)
+    return metrics
+
+def open_monitor(args, metrics, profiler):
+    """D2DualLocationMonitor with the recorder, bus, pcap writer, exporter and alerts from args
+
+    The sinks are only opened right before capture starts; start_monitoring()
+    closes them, and if setting up fails the ones already open are closed.
+    """
+    opened = []
+    try:
+        recorder = SessionRecorder(args.record) if args.record else None
+        opened.append(recorder)
+        bus = EventBus(args.bus) if args.bus else None
+        opened.append(bus)
+        pcap_writer = None
+        if args.write_pcap:
+            pcap_writer = RotatingPcapWriter(args.write_pcap, max_bytes=int(args.rotate_mb * 1024 * 1024),
+                                             max_seconds=args.rotate_seconds, max_files=args.keep_files,
+                                             pre_alert=args.pre_alert)
+        opened.append(pcap_writer)
+        exporter = StreamExporter(args.export, node=args.node) if args.export else None
+        opened.append(exporter)
+        alerts = None
+        if args.alerts or args.webhook or (args.write_pcap and args.pre_alert is not None):
+            alerts = AlertEngine(sinks=[print])
+            opened.append(alerts)
+            if args.alerts:
+                alerts.add_sink(FileSink(args.alerts))
+            if args.webhook:
+                alerts.add_sink(WebhookSink(args.webhook))
+        return D2DualLocationMonitor(metrics=metrics, profiler=profiler, recorder=recorder,
+                                     alerts=alerts, discovery=args.discover, bus=bus,
+                                     pcap_writer=pcap_writer, exporter=exporter)
+    except BaseException:
+        for sink in opened:
+            if sink is not None:
+                sink.close()
+        raise
 
 def main():
     """Main function with user interface"""
-    print("D2 Enhanced Player Monitor")
-    print("=" * 40)
-    print("Tracks player location, health, mana, and stamina")
-    print("Monitors both client commands and server updates")
-    print()
-    print("1. Start Enhanced Player Monitor")
-    print("2. List Network Interfaces")
-    print("3. Monitor Info & Packet Details")
-    print("0. Exit")
-    
-    choice = input("\nSelect option: ").strip()
-    
-    if choice == "0":
-        return
-    elif choice == "1":
-        monitor = D2DualLocationMonitor()
-        interface = input("Enter network interface (or press Enter for default): ").strip()
-        interface = interface if interface else None
-        monitor.start_monitoring(interface)
-    elif choice == "2":
-        print("\nAvailable network interfaces:")
-        interfaces = get_if_list()
-        for i, iface in enumerate(interfaces):
-            print(f"{i+1}. {iface}")
-    elif choice == "3":
-        print("\nD2 Enhanced Player Monitor - Packet Information")
-        print("=" * 50)
-        print("\nClient-side packets monitored (commands TO server):")
-        print("• D2GS_WALKTOLOCATION (0x01) - Walk movement commands")
-        print("• D2GS_RUNTOLOCATION (0x03) - Run movement commands") 
-        print("• D2GS_STAMINA_ON (0x53) - Start running mode")
-        print("• D2GS_STAMINA_OFF (0x54) - Stop running mode")
-        print("\nServer-side packets monitored (updates FROM server):")
-        print("• D2GS_PLAYERSTOP (0x0D) - Player stopped with position and life%")
-        print("• D2GS_PLAYERMOVE (0x0F) - Player movement with current position")
-        print("• D2GS_HPMPUPDATE2 (0x18) - Full HP/MP/Stamina/Position update")
-        print("• D2GS_HPMPUPDATE (0x95) - HP/MP/Stamina/Position update") 
-        print("• D2GS_WALKVERIFY (0x96) - Stamina/Position verification")
-        print("\nThis monitor provides comprehensive tracking of:")
-        print("- Player position (client commands vs server position)")
-        print("- Health, Mana, and Stamina values")
-        print("- Movement mode (walking vs running)")
-        print("- Desynchronization detection")
-        input("\nPress Enter to return to main menu...")
-        main()
-    else:
-        print("Invalid choice")
-        main()
+    args = parse_arguments()
+    metrics = open_metrics(args.metrics) if args.metrics else None
+    profiler = HotPathProfiler(args.profile_sample, args.profile) if args.profile else None
+    
+    try:
+        if args.pcap:
+            monitor = open_monitor(args, metrics, profiler)
+            speeds = [float(speed) for speed in args.speed.split(",")] if args.speed else None
+            monitor.start_monitoring(args.iface, offline=args.pcap, speeds=speeds)
+            return
+        
+        while True:
+            print("D2 Enhanced Player Monitor")
+            print("=" * 40)
+            print("Tracks player location, health, mana, and stamina")
+            print("Monitors both client commands and server updates")
+            print()
+            print("1. Start Enhanced Player Monitor")
+            print("2. List Network Interfaces")
+            print("3. Monitor Info & Packet Details")
+            print("0. Exit")
+            
+            choice = input("\nSelect option: ").strip()
+            
+            if choice == "0":
+                return
+            elif choice == "1":
+                if metrics is None:
+                    metrics_target = input("Metrics port or textfile path (or press Enter to disable): ").strip()
+                    if metrics_target:
+                        metrics = open_metrics(metrics_target)
+                interface = input("Enter network interface (or press Enter for default): ").strip()
+                interface = interface if interface else args.iface
+                monitor = open_monitor(args, metrics, profiler)
+                monitor.start_monitoring(interface)
+                return
+            elif choice == "2":
+                print("\nAvailable network interfaces:")
+                interfaces = get_if_list()
+                for i, iface in enumerate(interfaces):
+                    print(f"{i+1}. {iface}")
+                return
+            elif choice == "3":
+                print("\nD2 Enhanced Player Monitor - Packet Information")
+                print("=" * 50)
+                print("\nClient-side packets monitored (commands TO server):")
+                print("• D2GS_WALKTOLOCATION (0x01) - Walk movement commands")
+                print("• D2GS_RUNTOLOCATION (0x03) - Run movement commands") 
+                print("• D2GS_STAMINA_ON (0x53) - Start running mode")
+                print("• D2GS_STAMINA_OFF (0x54) - Stop running mode")
+                print("\nServer-side packets monitored (updates FROM server):")
+                print("• D2GS_PLAYERSTOP (0x0D) - Player stopped with position and life%")
+                print("• D2GS_PLAYERMOVE (0x0F) - Player movement with current position")
+                print("• D2GS_HPMPUPDATE2 (0x18) - Full HP/MP/Stamina/Position update")
+                print("• D2GS_HPMPUPDATE (0x95) - HP/MP/Stamina/Position update") 
+                print("• D2GS_WALKVERIFY (0x96) - Stamina/Position verification")
+                print("\nThis monitor provides comprehensive tracking of:")
+                print("- Player position (client commands vs server position)")
+                print("- Health, Mana, and Stamina values")
+                print("- Movement mode (walking vs running)")
+                print("- Desynchronization detection")
+                input("\nPress Enter to return to main menu...")
+            else:
+                print("Invalid choice")
+    finally:
+        # Created once for the whole session, whichever way the menu is left
+        if metrics is not None:
+            metrics.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
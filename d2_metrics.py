@@ -0,0 +1,253 @@
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Label values for packet ids, formatted once instead of per packet
+PACKET_ID_LABELS = [f"0x{packet_id:02X}" for packet_id in range(256)]
+
+# Default latency buckets in seconds (10us .. 1s)
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Linux packet socket statistics (struct tpacket_stats)
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+
+def _format_labels(labelnames, labels, extra=""):
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+    kind = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self.values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, description, labelnames=(), function=None):
+        super().__init__(name, description, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            if value is not None:
+                yield self.name, "", value
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    """Fixed-bucket histogram; buckets are cumulated only when rendered"""
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (self.name + "_bucket",
+                       _format_labels(self.labelnames, labels, f'le="{bound}"'), cumulative)
+            yield (self.name + "_bucket",
+                   _format_labels(self.labelnames, labels, 'le="+Inf"'), count)
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), total
+            yield self.name + "_count", _format_labels(self.labelnames, labels), count
+
+
+class CaptureDropCounter:
+    """Cumulative kernel drop count of a Linux AF_PACKET capture socket
+
+    PACKET_STATISTICS resets on every read, so reads are accumulated here.
+    Returns None where the statistic is not available.
+    """
+
+    def __init__(self, capture_socket):
+        # Scapy SuperSockets keep the OS socket in .ins
+        self.sock = getattr(capture_socket, 'ins', capture_socket)
+        self.received = 0
+        self.drops = 0
+        self.lock = threading.Lock()
+
+    def poll(self):
+        try:
+            raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8)
+        except (OSError, AttributeError, TypeError):
+            return None
+        packets, drops = struct.unpack('II', raw)
+        with self.lock:
+            self.received += packets
+            self.drops += drops
+            return self.drops
+
+    def __call__(self):
+        return self.poll()
+
+
+class D2Metrics:
+    """Prometheus/OpenMetrics text exposition for the monitor and injector"""
+
+    def __init__(self):
+        self.metrics = []
+        self.packets = self.counter("d2_packets_total", "Game packets captured", ("direction",))
+        self.bytes = self.counter("d2_bytes_total", "Game payload bytes captured", ("direction",))
+        self.packet_ids = self.counter("d2_packet_id_total", "Packets captured per packet id",
+                                       ("direction", "packet_id"))
+        self.decode_errors = self.counter("d2_decode_errors_total",
+                                          "Packets that failed to decode", ("error",))
+        self.handler_seconds = self.histogram("d2_handler_seconds",
+                                              "Time spent in packet_handler per packet")
+        self.command_rtt = self.histogram("d2_command_rtt_seconds",
+                                          "Client move command to server acknowledgement")
+        self.ping_rtt = self.histogram("d2_ping_rtt_seconds",
+                                       "Client D2GS_PING to server D2GS_PONG round trip")
+        self.queue_depth = self.gauge("d2_queue_depth",
+                                      "Packets waiting in the replay queue (--pcap with --speed only)")
+        self.flows = self.gauge("d2_flows", "Flows in the monitor flow table")
+        self.flow_evictions = self.counter("d2_flow_evictions_total",
+                                           "Flows removed from the flow table", ("reason",))
+        self.kernel_drops = self.gauge("d2_capture_kernel_drops",
+                                       "Packets dropped by the kernel before capture")
+        self.injected = self.counter("d2_injector_packets_total", "Packets sent by the injector",
+                                     ("packet",))
+        self.injected_bytes = self.counter("d2_injector_bytes_total",
+                                           "Payload bytes sent by the injector")
+        self.injector_lag = self.histogram("d2_injector_lag_seconds",
+                                           "Delay between scheduled and actual send time")
+        self.server = None
+        self.server_thread = None
+        self.textfile_thread = None
+        self.textfile_path = None
+        self.running = False
+
+    def counter(self, name, description, labelnames=()):
+        return self.register(Counter(name, description, labelnames))
+
+    def gauge(self, name, description, labelnames=()):
+        return self.register(Gauge(name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labelnames, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def count_decode_error(self, error):
+        """Count a decode failure labelled with its exception type"""
+        name = "struct.error" if isinstance(error, struct.error) else type(error).__name__
+        self.decode_errors.inc(name)
+
+    def watch_capture_socket(self, capture_socket):
+        """Export kernel drops of the socket sniff() reads from"""
+        self.kernel_drops.set_function(CaptureDropCounter(capture_socket))
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        lines.append("")
+        return "\n".join(lines)
+
+    def write_textfile(self, path):
+        """Atomically write the metrics for node_exporter's textfile collector"""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def export_textfile(self, path, interval=15):
+        """Rewrite the textfile every interval seconds from a daemon thread"""
+        def writer():
+            while self.running:
+                try:
+                    self.write_textfile(path)
+                except OSError as e:
+                    print(f"Metrics textfile error: {e}")
+                time.sleep(interval)
+
+        self.running = True
+        self.textfile_path = path
+        self.textfile_thread = threading.Thread(target=writer, daemon=True)
+        self.textfile_thread.start()
+        print(f"Writing metrics to {path} every {interval}s")
+
+    def serve(self, port=9100, address="127.0.0.1"):
+        """Serve /metrics over HTTP from a daemon thread"""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        print(f"Metrics available at http://{address}:{port}/metrics")
+        return self.server
+
+    def stop(self):
+        """Stop serving; the textfile is written one last time"""
+        self.running = False
+        if self.textfile_path is not None:
+            self.write_textfile(self.textfile_path)
+            self.textfile_path = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -3,6 +3,8 @@ import struct
 from scapy.all import *
 from scapy.layers.inet import IP, TCP, UDP
 import socket
+from d2_packet_codec import D2PacketCodec
+from d2_packet_template import PacketTemplate, RawTcpTemplate
 
 class D2PacketCrafter:
     def __init__(self, json_file="client2gs.json"):
@@ -10,16 +12,8 @@ class D2PacketCrafter:
         with open(json_file, 'r') as f:
             self.packet_definitions = json.load(f)
         
-        # Type mappings for struct packing
-        self.type_mapping = {
-            'BYTE': 'B',
-            'char': 'c',
-            'short': 'H',
-            'WORD': 'H',
-            'int': 'I',
-            'DWORD': 'I',
-            'std::string': 's'
-        }
+        # Compiled codecs for every definition (header groups are flattened)
+        self.codec = D2PacketCodec(self.packet_definitions)
     
     def craft_packet(self, packet_name, **kwargs):
         """Craft a packet based on its definition"""
@@ -27,46 +21,54 @@ class D2PacketCrafter:
             raise ValueError(f"Packet {packet_name} not found in definitions")
         
         packet_def = self.packet_definitions[packet_name]
-        packet_data = bytearray()
+        codec = self.codec[packet_name]
+        values = codec.prepare(kwargs)
+        
+        # Encode into one preallocated buffer; SID/MCP nSize is back-patched
+        packet_data = codec.build(values)
         
         print(f"Crafting packet: {packet_name}")
         print(f"Packet ID: {packet_def['PacketId']}")
         
-        for field in packet_def['Structure']:
-            field_type = list(field.keys())[0]
-            field_name = list(field.values())[0]
-            
-            if field_name == "PacketId":
-                # Convert hex string to int
-                packet_id = int(packet_def['PacketId'], 16)
-                packet_data.extend(struct.pack('B', packet_id))
-                print(f"  {field_name}: 0x{packet_id:02X}")
-            
-            elif field_type in ['BYTE', 'char']:
-                value = kwargs.get(field_name, 0)
-                packet_data.extend(struct.pack('B', value))
-                print(f"  {field_name}: {value}")
-            
-            elif field_type in ['short', 'WORD']:
-                value = kwargs.get(field_name, 0)
-                packet_data.extend(struct.pack('<H', value))  # Little endian
-                print(f"  {field_name}: {value}")
-            
-            elif field_type in ['int', 'DWORD']:
-                value = kwargs.get(field_name, 0)
-                packet_data.extend(struct.pack('<I', value))  # Little endian
-                print(f"  {field_name}: {value}")
-            
-            elif field_type == 'std::string':
-                value = kwargs.get(field_name, "")
-                if isinstance(value, str):
-                    value = value.encode('utf-8')
-                packet_data.extend(value)
-                packet_data.extend(b'\x00')  # Null terminator
-                print(f"  {field_name}: {value.decode('utf-8') if isinstance(value, bytes) else value}")
+        for field_name in codec.field_names:
+            if field_name in ("PacketId", "AlwaysFF"):
+                print(f"  {field_name}: 0x{values[field_name]:02X}")
+            else:
+                print(f"  {field_name}: {values.get(field_name, '')}")
         
         return bytes(packet_data)
     
+    def craft_batch(self, packet_name, columns, count=None):
+        """Craft many packets of one type into a single contiguous buffer
+        
+        columns maps field names to per-packet sequences (or a scalar shared
+        by every packet). Returns (buffer, offsets); packet i is
+        buffer[offsets[i]:offsets[i + 1]] and the whole buffer can be handed
+        to a single sendall, or split_batch() views to sendmsg/writev.
+        """
+        if packet_name not in self.packet_definitions:
+            raise ValueError(f"Packet {packet_name} not found in definitions")
+        
+        return self.codec[packet_name].pack_batch(columns, count)
+    
+    def template(self, packet_name, **kwargs):
+        """Pre-encoded packet for repeated sends; change fields with patch()"""
+        if packet_name not in self.packet_definitions:
+            raise ValueError(f"Packet {packet_name} not found in definitions")
+        
+        return PacketTemplate(self.codec[packet_name], kwargs)
+    
+    def raw_template(self, packet_name, target_ip="127.0.0.1", target_port=4000, **kwargs):
+        """Pre-built IP/TCP frame for raw-socket sends with incremental checksums"""
+        if packet_name not in self.packet_definitions:
+            raise ValueError(f"Packet {packet_name} not found in definitions")
+        
+        return RawTcpTemplate(self.codec[packet_name], target_ip, target_port, kwargs)
+    
+    def decode_packet(self, payload, packet_name=None):
+        """Decode a payload back into its field values"""
+        return self.codec.decode(payload, packet_name)
+    
     def create_scapy_packet(self, packet_name, target_ip="127.0.0.1", target_port=4000, **kwargs):
         """Create a complete Scapy packet with IP/TCP headers"""
         payload = self.craft_packet(packet_name, **kwargs)
@@ -78,7 +80,15 @@ class D2PacketCrafter:
     def send_packet(self, packet_name, target_ip="127.0.0.1", target_port=4000, **kwargs):
         """Send a crafted packet"""
         packet = self.create_scapy_packet(packet_name, target_ip, target_port, **kwargs)
-        
+        return self.send_scapy_packet(packet, target_ip, target_port)
+    
+    def send_payload(self, payload, target_ip="127.0.0.1", target_port=4000):
+        """Send an already encoded payload (e.g. a slice of a craft_batch buffer)"""
+        packet = IP(dst=target_ip) / TCP(dport=target_port) / Raw(load=bytes(payload))
+        return self.send_scapy_packet(packet, target_ip, target_port)
+    
+    def send_scapy_packet(self, packet, target_ip, target_port):
+        """Send a complete Scapy packet"""
         print(f"\nSending packet to {target_ip}:{target_port}")
         print(f"Packet summary: {packet.summary()}")
         
@@ -101,7 +111,7 @@ class D2PacketCrafter:
         """List all available packet types"""
         print("Available packet types:")
         for name, definition in self.packet_definitions.items():
-            print(f"  {name} (ID: {definition['PacketId']}) - Size: {definition['Size']}")
+            print(f"  {name} (ID: {definition['PacketId']}) - Size: {definition.get('Size', -1)}")
             if definition.get('Description'):
                 print(f"    Description: {definition['Description']}")
     
@@ -114,7 +124,7 @@ class D2PacketCrafter:
         packet_def = self.packet_definitions[packet_name]
         print(f"\nPacket: {packet_name}")
         print(f"ID: {packet_def['PacketId']}")
-        print(f"Size: {packet_def['Size']}")
+        print(f"Size: {packet_def.get('Size', -1)}")
         print(f"Description: {packet_def.get('Description', 'N/A')}")
         print("Structure:")
         
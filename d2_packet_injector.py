@@ -4,28 +4,72 @@ import threading
 import math
 import random
 from d2_packet_crafter import D2PacketCrafter
+from d2_packet_codec import split_batch
+from d2_packet_template import open_raw_socket
+from d2_transmitter import BatchTransmitter
+from d2_scenario import compile_scenario, play, tcp_sender
 
 class D2PacketInjector:
-    def __init__(self):
+    def __init__(self, raw_socket=False, metrics=None):
         self.crafter = D2PacketCrafter()
         self.running = False
         self.injection_thread = None
+        
+        # Send repeated packets from pre-built IP/TCP frames on a raw socket
+        self.raw_socket = raw_socket
+        
+        # Optional D2Metrics instrumentation (send rate and scheduling lag)
+        self.metrics = metrics
+    
+    def record_send(self, packet_name, size, scheduled=None):
+        """Count a sent packet and how late it went out"""
+        if self.metrics is None:
+            return
+        self.metrics.injected.inc(packet_name)
+        self.metrics.injected_bytes.inc(amount=size)
+        if scheduled is not None:
+            self.metrics.injector_lag.observe(max(time.perf_counter() - scheduled, 0.0))
     
     def inject_movement_sequence(self, target_ip, target_port, coordinates):
         """Inject a sequence of movement packets"""
         try:
-            for x, y in coordinates:
-                packet = self.crafter.send_packet("D2GS_WALKTOLOCATION",
-                                                target_ip=target_ip,
-                                                target_port=target_port,
-                                                nTargetX=x,
-                                                nTargetY=y)
+            # Encode the whole sequence up front into one buffer
+            xs = [x for x, _ in coordinates]
+            ys = [y for _, y in coordinates]
+            buffer, offsets = self.crafter.craft_batch("D2GS_WALKTOLOCATION",
+                                                       {"nTargetX": xs, "nTargetY": ys})
+            scheduled = time.perf_counter()
+            for payload in split_batch(buffer, offsets):
+                packet = self.crafter.send_payload(payload,
+                                                   target_ip=target_ip,
+                                                   target_port=target_port)
+                self.record_send("D2GS_WALKTOLOCATION", len(payload), scheduled)
                 time.sleep(0.1)  # Small delay between packets
+                scheduled += 0.1
             return True
         except Exception as e:
             print(f"Error in movement sequence: {e}")
             return False
     
+    def flood_movement(self, target_ip, target_port, coordinates, batch_size=64):
+        """Send a movement sequence as fast as possible in sendmmsg batches (Linux, root)"""
+        try:
+            walk = self.crafter.raw_template("D2GS_WALKTOLOCATION", target_ip, target_port)
+            transmitter = BatchTransmitter(walk, batch_size=batch_size)
+            try:
+                transmitter.send_columns({"nTargetX": [x for x, _ in coordinates],
+                                          "nTargetY": [y for _, y in coordinates]})
+            finally:
+                transmitter.close()
+            transmitter.report()
+            if self.metrics is not None:
+                self.metrics.injected.inc("D2GS_WALKTOLOCATION", amount=transmitter.packets)
+                self.metrics.injected_bytes.inc(amount=transmitter.packets * walk.payload_size)
+            return transmitter.stats()
+        except Exception as e:
+            print(f"Error in movement flood: {e}")
+            return None
+    
     def inject_skill_cast(self, target_ip, target_port, skill_type="left", x=None, y=None, unit_guid=None):
         """Inject skill casting packets"""
         try:
@@ -131,8 +175,38 @@ class D2PacketInjector:
             print(f"Error in automated sequence: {e}")
             return False
     
+    def run_scenario(self, scenario_file, target_ip, target_port, speed=1.0):
+        """Play a compiled scenario file (see d2_scenario.py) against a target
+
+        The precompiled buffer is streamed over one TCP connection, so each
+        send is a single sendall of a buffer slice instead of building and
+        sending a new scapy packet.
+        """
+        try:
+            compiled = compile_scenario(scenario_file)
+            print(f"Playing {compiled.name}: {len(compiled)} packets over {compiled.duration:.1f}s")
+            
+            on_sent = None
+            if self.metrics is not None:
+                def on_sent(index, scheduled):
+                    step = compiled.step_names[compiled.steps[index]]
+                    self.record_send(step, len(compiled.payload(index)), scheduled)
+            
+            send, close = tcp_sender(target_ip, target_port)
+            try:
+                result = play(compiled, send, speed, on_sent)
+            finally:
+                close()
+            print(f"Sent {result['sent']} packets in {result['elapsed']}s, "
+                  f"lag mean {result['mean_lag_ms']}ms max {result['max_lag_ms']}ms")
+            return result
+        except Exception as e:
+            print(f"Error in scenario: {e}")
+            return None
+    
     def inject_continuous_movement(self, target_ip, target_port, pattern="circle", duration=10):
         """Inject continuous movement in a pattern"""
+        sock = None
         try:
             start_time = time.time()
             center_x, center_y = 500, 500
@@ -141,6 +215,16 @@ class D2PacketInjector:
             
             print(f"Starting continuous {pattern} movement for {duration} seconds...")
             
+            # Only nTargetX/nTargetY change between sends
+            if self.raw_socket:
+                walk = self.crafter.raw_template("D2GS_WALKTOLOCATION", target_ip, target_port)
+                sock = open_raw_socket()
+            else:
+                walk = self.crafter.template("D2GS_WALKTOLOCATION")
+            # Game message bytes only; raw frames also carry 40 header bytes
+            size = walk.payload_size
+            
+            scheduled = time.perf_counter()
             while time.time() - start_time < duration:
                 if pattern == "circle":
                     x = int(center_x + radius * math.cos(angle))
@@ -162,12 +246,16 @@ class D2PacketInjector:
                     x = center_x + random.randint(-radius, radius)
                     y = center_y + random.randint(-radius, radius)
                 
-                self.crafter.send_packet("D2GS_WALKTOLOCATION",
-                                       target_ip=target_ip,
-                                       target_port=target_port,
-                                       nTargetX=x,
-                                       nTargetY=y)
+                payload = walk.patch(nTargetX=x, nTargetY=y)
+                if sock is not None:
+                    walk.send(sock)
+                else:
+                    self.crafter.send_payload(payload,
+                                              target_ip=target_ip,
+                                              target_port=target_port)
+                self.record_send("D2GS_WALKTOLOCATION", size, scheduled)
                 time.sleep(0.2)
+                scheduled += 0.2
             
             print("Continuous movement completed")
             return True
@@ -175,6 +263,9 @@ class D2PacketInjector:
         except Exception as e:
             print(f"Error in continuous movement: {e}")
             return False
+        finally:
+            if sock is not None:
+                sock.close()
 
 def interactive_injector():
     """Interactive packet injection interface"""
@@ -0,0 +1,177 @@
+import socket
+import struct
+
+IP_HEADER_SIZE = 20
+TCP_HEADER_SIZE = 20
+
+# Offsets inside the IPv4 + TCP frame built by RawTcpTemplate
+IP_ID_OFFSET = 4
+IP_CHECKSUM_OFFSET = 10
+TCP_OFFSET = IP_HEADER_SIZE
+TCP_SEQ_OFFSET = TCP_OFFSET + 4
+TCP_CHECKSUM_OFFSET = TCP_OFFSET + 16
+PAYLOAD_OFFSET = IP_HEADER_SIZE + TCP_HEADER_SIZE
+
+_WORD = struct.Struct('!H')
+_DWORD = struct.Struct('!I')
+
+
+def fold(total):
+    """Fold carries back into a 16-bit one's complement sum"""
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+
+def ones_complement_sum(data, start=0, end=None):
+    """16-bit one's complement sum of data[start:end] (odd tails padded with zero)"""
+    chunk = bytes(data[start:end])
+    if len(chunk) % 2:
+        chunk += b'\x00'
+    return fold(sum(struct.unpack(f'!{len(chunk) // 2}H', chunk)))
+
+
+def internet_checksum(data):
+    """RFC 1071 checksum"""
+    return ~ones_complement_sum(data) & 0xFFFF
+
+
+def checksum_update(checksum, old_sum, new_sum):
+    """RFC 1624 incremental update: HC' = ~(~HC + ~m + m')"""
+    return ~fold((~checksum & 0xFFFF) + (~old_sum & 0xFFFF) + new_sum) & 0xFFFF
+
+
+def source_address_for(target_ip):
+    """Local address the kernel would use to reach target_ip"""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect((target_ip, 9))
+        return probe.getsockname()[0]
+    finally:
+        probe.close()
+
+
+def open_raw_socket():
+    """Raw IPv4 socket that sends frames with our own IP header (Linux)"""
+    return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+
+
+class PacketTemplate:
+    """Pre-encoded packet whose fields are patched in place with pack_into"""
+
+    def __init__(self, codec, values=None, buffer=None, offset=0):
+        if codec.fixed_size is None or len(codec.segments) != 1:
+            raise ValueError(f"{codec.name} has a variable layout and cannot be templated")
+        self.codec = codec
+        self.size = codec.fixed_size
+        self.offset = offset
+        if buffer is None:
+            buffer = bytearray(self.size)
+        self.buffer = buffer
+        self.payload = memoryview(buffer)[offset:offset + self.size]
+
+        # Precomputed (offset, struct, width) per field
+        segment = codec.segments[0]
+        self.slots = {}
+        position = offset
+        for name, fmt, width, _ in segment.fields:
+            field_struct = struct.Struct('<' + fmt)
+            self.slots[name] = (position, field_struct, width)
+            position += field_struct.size
+
+        prepared = codec.prepare(values or {})
+        codec.pack_into(buffer, offset, prepared)
+
+    @property
+    def payload_size(self):
+        """Game message bytes sent per packet, like RawTcpTemplate.payload_size"""
+        return self.size
+
+    def field_range(self, name):
+        """Absolute (start, end) byte range of a field in the buffer"""
+        position, field_struct, _ = self.slots[name]
+        return position, position + field_struct.size
+
+    def patch(self, **fields):
+        """Overwrite the given fields; everything else is left untouched"""
+        for name, value in fields.items():
+            position, field_struct, width = self.slots[name]
+            if width:
+                field_struct.pack_into(self.buffer, position, *value)
+            else:
+                field_struct.pack_into(self.buffer, position, value)
+        return self.payload
+
+
+class RawTcpTemplate:
+    """IPv4/TCP frame around a PacketTemplate with incrementally updated checksums
+
+    Patching a payload field or advancing the sequence number touches only
+    the changed words and adjusts the IP/TCP checksums per RFC 1624 instead
+    of rebuilding the frame.
+    """
+
+    def __init__(self, codec, target_ip, target_port, values=None, source_ip=None,
+                 source_port=50000, seq=0, ack=0, flags=0x18, window=65535, ttl=64):
+        self.target_ip = target_ip
+        self.target_port = target_port
+        self.source_ip = source_ip or source_address_for(target_ip)
+        self.frame = bytearray(PAYLOAD_OFFSET + (codec.fixed_size or 0))
+        self.template = PacketTemplate(codec, values, self.frame, PAYLOAD_OFFSET)
+        self.payload_size = self.template.size
+        self.ip_id = 0
+        self.seq = seq & 0xFFFFFFFF
+
+        source = socket.inet_aton(self.source_ip)
+        destination = socket.inet_aton(target_ip)
+        struct.pack_into('!BBHHHBBH4s4s', self.frame, 0,
+                         0x45, 0, len(self.frame), self.ip_id, 0x4000, ttl,
+                         socket.IPPROTO_TCP, 0, source, destination)
+        struct.pack_into('!HHIIBBHHH', self.frame, TCP_OFFSET,
+                         source_port, target_port, self.seq, ack,
+                         TCP_HEADER_SIZE << 2, flags, window, 0, 0)
+
+        _WORD.pack_into(self.frame, IP_CHECKSUM_OFFSET,
+                        internet_checksum(self.frame[:IP_HEADER_SIZE]))
+        pseudo_header = struct.pack('!4s4sBBH', source, destination, 0, socket.IPPROTO_TCP,
+                                    len(self.frame) - IP_HEADER_SIZE)
+        tcp_sum = fold(ones_complement_sum(pseudo_header) + ones_complement_sum(self.frame, TCP_OFFSET))
+        _WORD.pack_into(self.frame, TCP_CHECKSUM_OFFSET, ~tcp_sum & 0xFFFF)
+
+    def _aligned(self, start, end, base):
+        """Widen [start, end) to 16-bit words counted from base"""
+        start -= (start - base) % 2
+        end += (end - base) % 2
+        return start, end
+
+    def _adjust(self, checksum_offset, old_sum, new_sum):
+        checksum = _WORD.unpack_from(self.frame, checksum_offset)[0]
+        _WORD.pack_into(self.frame, checksum_offset, checksum_update(checksum, old_sum, new_sum))
+
+    def patch(self, **fields):
+        """Patch payload fields and fix up the TCP checksum incrementally"""
+        for name, value in fields.items():
+            start, end = self._aligned(*self.template.field_range(name), TCP_OFFSET)
+            old_sum = ones_complement_sum(self.frame, start, end)
+            self.template.patch(**{name: value})
+            self._adjust(TCP_CHECKSUM_OFFSET, old_sum, ones_complement_sum(self.frame, start, end))
+        return self.frame
+
+    def advance(self):
+        """Step the IP id and TCP sequence number to the next segment"""
+        old_sum = ones_complement_sum(self.frame, IP_ID_OFFSET, IP_ID_OFFSET + 2)
+        self.ip_id = (self.ip_id + 1) & 0xFFFF
+        _WORD.pack_into(self.frame, IP_ID_OFFSET, self.ip_id)
+        self._adjust(IP_CHECKSUM_OFFSET, old_sum, self.ip_id)
+
+        old_sum = ones_complement_sum(self.frame, TCP_SEQ_OFFSET, TCP_SEQ_OFFSET + 4)
+        self.seq = (self.seq + self.payload_size) & 0xFFFFFFFF
+        _DWORD.pack_into(self.frame, TCP_SEQ_OFFSET, self.seq)
+        self._adjust(TCP_CHECKSUM_OFFSET, old_sum,
+                     ones_complement_sum(self.frame, TCP_SEQ_OFFSET, TCP_SEQ_OFFSET + 4))
+
+    def send(self, sock):
+        """Send the current frame on a raw socket and advance for the next one"""
+        sent = sock.sendto(self.frame, (self.target_ip, 0))
+        self.advance()
+        return sent
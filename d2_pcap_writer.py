@@ -0,0 +1,191 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+LINKTYPE_ETHERNET = 1
+
+
+def pcap_global_header(linktype, snaplen=65535):
+    return struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, snaplen, linktype)
+
+
+class RotatingPcapWriter:
+    """Background pcap writer for frames seen by the capture path
+
+    write() only appends to a bounded deque; frames that do not fit are
+    counted in dropped, so the capture thread never waits on the disk. A
+    writer thread packs records into blocks of block_size bytes and writes
+    them in one call, rotating files at max_bytes or every max_seconds of
+    capture time and keeping at most max_files of them.
+
+    With pre_alert seconds set, frames are only held in memory for that
+    long; trigger(alert) (usable as an AlertEngine sink) writes the held
+    frames plus the next post_alert seconds to a file named after the alert.
+    """
+
+    def __init__(self, directory, prefix="d2", max_bytes=100 * 1024 * 1024, max_seconds=None,
+                 max_files=None, queue_size=100000, block_size=1024 * 1024, flush_interval=1.0,
+                 pre_alert=None, post_alert=5.0, max_buffer_bytes=64 * 1024 * 1024,
+                 linktype=None, snaplen=65535):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_files = max_files
+        self.queue_size = queue_size
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.pre_alert = pre_alert
+        self.post_alert = post_alert
+        self.max_buffer_bytes = max_buffer_bytes
+        self.linktype = linktype
+        self.snaplen = snaplen
+        os.makedirs(directory, exist_ok=True)
+
+        self.queue = deque()
+        self.written = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.files = []
+        self.triggers = 0
+
+        # Writer thread state
+        self.file = None
+        self.file_size = 0
+        self.file_start = None
+        self.file_index = 0
+        self.block = bytearray()
+        self.last_flush = time.monotonic()
+        self.held = deque()
+        self.held_bytes = 0
+        self.record_until = None
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, timestamp, frame):
+        """Queue one frame (capture thread); dropped and counted when full"""
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            return False
+        self.queue.append((timestamp, frame))
+        return True
+
+    def trigger(self, alert):
+        """Keep the pre_alert window around an alert (AlertEngine sink)"""
+        if self.pre_alert is not None:
+            # Never dropped, and ordered with the frames queued before it
+            self.queue.append((alert.timestamp, alert))
+
+    def _run(self):
+        queue = self.queue
+        while True:
+            try:
+                timestamp, item = queue.popleft()
+            except IndexError:
+                if self.block and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self._flush()
+                if not self.running:
+                    break
+                time.sleep(0.01)
+                continue
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                if self.pre_alert is None:
+                    self._record(timestamp, item)
+                else:
+                    self._hold(timestamp, item)
+            else:
+                self._start_alert_file(timestamp, item)
+        self._flush()
+        self._close_file()
+
+    def _hold(self, timestamp, frame):
+        if self.record_until is not None:
+            if timestamp <= self.record_until:
+                self._record(timestamp, frame)
+                return
+            self.record_until = None
+            self._flush()
+            self._close_file()
+        held = self.held
+        held.append((timestamp, frame))
+        self.held_bytes += len(frame)
+        cutoff = timestamp - self.pre_alert
+        while held and (held[0][0] < cutoff or self.held_bytes > self.max_buffer_bytes):
+            self.held_bytes -= len(held.popleft()[1])
+
+    def _start_alert_file(self, timestamp, alert):
+        self.triggers += 1
+        if self.record_until is None:
+            rule = getattr(alert, 'rule', 'alert')
+            self._open_file(timestamp, f"alert_{rule}_")
+            for held_timestamp, frame in self.held:
+                self._record(held_timestamp, frame)
+            self.held.clear()
+            self.held_bytes = 0
+        self.record_until = timestamp + self.post_alert
+
+    def _record(self, timestamp, frame):
+        size = PCAP_RECORD_HEADER.size + min(len(frame), self.snaplen)
+        if self.file is None:
+            self._open_file(timestamp)
+        elif self.pre_alert is None and (
+                self.file_size + size > self.max_bytes or
+                (self.max_seconds is not None and timestamp - self.file_start >= self.max_seconds)):
+            self._flush()
+            self._close_file()
+            self._open_file(timestamp)
+        seconds = int(timestamp)
+        self.block += PCAP_RECORD_HEADER.pack(seconds, int((timestamp - seconds) * 1000000),
+                                              min(len(frame), self.snaplen), len(frame))
+        self.block += frame[:self.snaplen]
+        self.file_size += size
+        self.written += 1
+        self.bytes += size
+        if len(self.block) >= self.block_size:
+            self._flush()
+
+    def _open_file(self, timestamp, label=""):
+        stamp = datetime.fromtimestamp(timestamp).strftime("%Y%m%d_%H%M%S")
+        self.file_index += 1
+        path = os.path.join(self.directory, f"{self.prefix}_{label}{stamp}_{self.file_index:04d}.pcap")
+        self.file = open(path, 'wb', buffering=0)
+        header = pcap_global_header(self.linktype or LINKTYPE_ETHERNET, self.snaplen)
+        self.file.write(header)
+        self.file_size = len(header)
+        self.file_start = timestamp
+        self.files.append(path)
+        if self.max_files is not None:
+            while len(self.files) > self.max_files:
+                try:
+                    os.remove(self.files.pop(0))
+                except OSError:
+                    pass
+
+    def _flush(self):
+        if self.block and self.file is not None:
+            self.file.write(self.block)
+        self.block = bytearray()
+        self.last_flush = time.monotonic()
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'bytes': self.bytes,
+                'files': len(self.files), 'queued': len(self.queue), 'alerts': self.triggers}
+
+    def close(self):
+        """Write everything still queued and close the current file"""
+        self.running = False
+        self.thread.join()
+        stats = self.stats()
+        print(f"Pcap writer: {stats['written']} frames in {stats['files']} file(s) under "
+              f"{self.directory}, {stats['dropped']} dropped")
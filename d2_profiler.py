@@ -0,0 +1,89 @@
+from time import perf_counter_ns
+
+# Hot-path stages in the order packet_handler runs them; stages of disabled
+# features are skipped, and "other" is whatever ran after the last lap
+STAGES = ("pcap", "extract", "flows", "metrics", "discovery", "record", "alerts", "latency",
+          "framing", "decode", "state", "display", "subscribers", "snapshot", "other")
+
+
+class HotPathProfiler:
+    """Per-stage timings of the packet hot path, broken down by packet type
+
+    Only every sample_rate-th packet is timed so the cost on unsampled
+    packets is a counter increment. Timings are kept as
+    {(packet_type, stage): [samples, total_ns, max_ns]}. Only time spent
+    in the handler is measured; waiting for the next packet is not.
+    """
+
+    def __init__(self, sample_rate=1, output_path=None):
+        self.sample_rate = max(int(sample_rate), 1)
+        self.output_path = output_path
+        self.packets = 0
+        self.sampled = False
+        self.last = 0
+        self.laps = []
+        self.timings = {}
+
+    def start(self):
+        """Begin a packet"""
+        self.packets += 1
+        self.sampled = self.packets % self.sample_rate == 0
+        if self.sampled:
+            self.laps = []
+            self.last = perf_counter_ns()
+
+    def lap(self, stage):
+        """Close the current stage"""
+        if self.sampled:
+            now = perf_counter_ns()
+            self.laps.append((stage, now - self.last))
+            self.last = now
+
+    def finish(self, packet_type="other"):
+        """Attribute the laps of this packet to its type"""
+        if self.sampled:
+            now = perf_counter_ns()
+            if now > self.last and self.laps:
+                self.laps.append(("other", now - self.last))
+            timings = self.timings
+            for stage, elapsed in self.laps:
+                key = (packet_type, stage)
+                entry = timings.get(key)
+                if entry is None:
+                    timings[key] = [1, elapsed, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    if elapsed > entry[2]:
+                        entry[2] = elapsed
+            self.sampled = False
+
+    def write_collapsed(self, path, root="packet_handler"):
+        """Write folded stacks (root;packet_type;stage total_ns) for flamegraph.pl"""
+        with open(path, 'w') as f:
+            for (packet_type, stage), (_, total_ns, _) in sorted(self.timings.items()):
+                f.write(f"{root};{packet_type};{stage} {total_ns}\n")
+        print(f"Collapsed stacks written to {path}")
+
+    def summary(self):
+        """Rows of (packet_type, stage, samples, mean_us, max_us, share_percent)"""
+        grand_total = sum(total for _, total, _ in self.timings.values()) or 1
+        rows = []
+        for (packet_type, stage), (count, total_ns, max_ns) in self.timings.items():
+            rows.append((packet_type, stage, count, total_ns / count / 1000,
+                         max_ns / 1000, 100 * total_ns / grand_total))
+        rows.sort(key=lambda row: row[5], reverse=True)
+        return rows
+
+    def print_summary(self):
+        print(f"\nHot path profile ({self.packets} packets, 1 in {self.sample_rate} sampled)")
+        print(f"{'Packet type':<24} {'Stage':<9} {'Samples':>8} {'Mean us':>9} {'Max us':>9} {'Share':>7}")
+        print("-" * 71)
+        for packet_type, stage, count, mean_us, max_us, share in self.summary():
+            print(f"{packet_type:<24} {stage:<9} {count:>8} {mean_us:>9.2f} {max_us:>9.1f} {share:>6.1f}%")
+
+    def report(self):
+        """Print the summary table and write the collapsed stacks if requested"""
+        self.print_summary()
+        if self.output_path:
+            self.write_collapsed(self.output_path)
@@ -0,0 +1,303 @@
+import glob
+import mmap
+import os
+import numpy as np
+from d2_packet_codec import D2PacketCodec, FixedSegment
+from d2_reconciliation import ReconcilerTable
+from d2_recorder import (CHUNK_HEADER, CHUNK_MAGIC, FILE_MAGIC, FILE_SUFFIX,
+                         DIRECTION_CLIENT, DIRECTION_SERVER, pad8)
+
+# NumPy equivalents of the codec struct formats (records are packed, little endian)
+NUMPY_FORMATS = {'B': 'u1', 'H': '<u2', 'I': '<u4', 'Q': '<u8'}
+
+# Server messages that carry the authoritative player position
+SERVER_POSITION_PACKETS = ("D2GS_PLAYERMOVE", "D2GS_PLAYERSTOP")
+CLIENT_TARGET_PACKETS = ("D2GS_WALKTOLOCATION", "D2GS_RUNTOLOCATION")
+
+# Event kinds in the order desync() replays them
+_WALK, _RUN, _MOVE, _STOP = range(4)
+
+
+def record_dtype(codec):
+    """Structured dtype matching a fixed-layout packet codec"""
+    segment = codec.segments[0] if len(codec.segments) == 1 else None
+    if codec.fixed_size is None or not isinstance(segment, FixedSegment):
+        return None
+    names, formats, offsets = [], [], []
+    position = 0
+    for name, fmt, width, is_bytes in segment.fields:
+        count = int(fmt[:-1]) if fmt[:-1] else 1
+        if is_bytes:
+            formats.append(f'S{count}')
+            size = count
+        else:
+            base = NUMPY_FORMATS[fmt[-1]]
+            formats.append((base, (width,)) if width else base)
+            size = np.dtype(base).itemsize * (width or 1)
+        names.append(name)
+        offsets.append(position)
+        position += size
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': codec.fixed_size})
+
+
+class Chunk:
+    """Location of one recorded chunk inside a memory-mapped file"""
+    __slots__ = ('buffer', 'name', 'direction', 'packet_id', 'count', 'record_size',
+                 't_min', 't_max', 'timestamps_offset', 'body_offset', 'body_size')
+
+    def timestamps(self):
+        return np.frombuffer(self.buffer, np.int64, self.count, self.timestamps_offset)
+
+    def flows(self):
+        return np.frombuffer(self.buffer, np.uint64, self.count,
+                             self.timestamps_offset + 8 * self.count)
+
+    def records(self, dtype):
+        return np.frombuffer(self.buffer, dtype, self.count, self.body_offset)
+
+    def payloads(self):
+        """Raw payload bytes of every event (copies; for variable-length chunks)"""
+        if self.record_size:
+            for index in range(self.count):
+                start = self.body_offset + index * self.record_size
+                yield bytes(self.buffer[start:start + self.record_size])
+            return
+        offsets = np.frombuffer(self.buffer, np.uint32, self.count + 1, self.body_offset)
+        data_offset = self.body_offset + 4 * (self.count + 1)
+        data_offset += pad8(4 * (self.count + 1))
+        for index in range(self.count):
+            yield bytes(self.buffer[data_offset + offsets[index]:data_offset + offsets[index + 1]])
+
+
+class QueryResult:
+    """Column arrays of the events matched by a query"""
+
+    def __init__(self, timestamps, flows, records):
+        self.timestamps = timestamps
+        self.flows = flows
+        self.records = records
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, field_name):
+        return self.records[field_name]
+
+
+class RecordingSet:
+    """Memory-mapped view over .d2rec files with sparse per-chunk indexes
+
+    Opening only walks the chunk headers. Each chunk keeps its min/max
+    timestamp, so time-range queries skip whole chunks, and chunks are
+    indexed by packet name and by (direction, packet id). Matching rows are
+    selected with NumPy masks over zero-copy views of the mapped files.
+    """
+
+    def __init__(self, paths, client_json="client2gs.json", server_json="gs2client.json"):
+        if isinstance(paths, str):
+            if os.path.isdir(paths):
+                paths = sorted(glob.glob(os.path.join(paths, f"*{FILE_SUFFIX}")))
+            else:
+                paths = [paths]
+        self.codecs = (D2PacketCodec.from_file(client_json), D2PacketCodec.from_file(server_json))
+        self.dtypes = {}
+        self.files = []
+        self.chunks = []
+        self.by_name = {}
+        self.by_id = {}
+        for path in paths:
+            self._index_file(path)
+
+    def _index_file(self, path):
+        if os.path.getsize(path) <= len(FILE_MAGIC):
+            return
+        f = open(path, 'rb')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.files.append((f, mapped))
+        if mapped[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+
+        offset = len(FILE_MAGIC)
+        while offset + CHUNK_HEADER.size <= len(mapped):
+            (magic, name_size, direction, packet_id, count, record_size, body_size,
+             t_min, t_max) = CHUNK_HEADER.unpack_from(mapped, offset)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"{path}: corrupt chunk at offset {offset}")
+            name_offset = offset + CHUNK_HEADER.size
+            chunk = Chunk()
+            chunk.buffer = mapped
+            chunk.name = mapped[name_offset:name_offset + name_size].decode('utf-8')
+            chunk.direction = direction
+            chunk.packet_id = packet_id
+            chunk.count = count
+            chunk.record_size = record_size
+            chunk.t_min = t_min
+            chunk.t_max = t_max
+            chunk.timestamps_offset = name_offset + name_size + pad8(CHUNK_HEADER.size + name_size)
+            chunk.body_offset = chunk.timestamps_offset + 16 * count
+            chunk.body_size = body_size
+            if chunk.body_offset + body_size > len(mapped):
+                # Truncated tail of a file that is still being written
+                break
+            self.chunks.append(chunk)
+            self.by_name.setdefault(chunk.name, []).append(chunk)
+            self.by_id.setdefault((direction, packet_id), []).append(chunk)
+            offset = chunk.body_offset + body_size
+
+    def close(self):
+        for f, mapped in self.files:
+            mapped.close()
+            f.close()
+        self.files = []
+        self.chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def dtype(self, packet_name, direction):
+        key = (packet_name, direction)
+        if key not in self.dtypes:
+            codec = self.codecs[direction]
+            self.dtypes[key] = record_dtype(codec[packet_name]) if packet_name in codec else None
+        return self.dtypes[key]
+
+    def packet_counts(self):
+        """Events per packet name"""
+        return {name: sum(chunk.count for chunk in chunks) for name, chunks in self.by_name.items()}
+
+    def select(self, packet_name, t1=None, t2=None, direction=None, flow=None, where=None):
+        """Fixed-layout events of one packet type, optionally filtered
+
+        t1/t2 are capture times in ns (inclusive), flow a packed flow key and
+        where a {field: value} equality filter on the decoded fields.
+        """
+        timestamps, flows, records = [], [], []
+        for chunk in self.by_name.get(packet_name, []):
+            if direction is not None and chunk.direction != direction:
+                continue
+            if (t1 is not None and chunk.t_max < t1) or (t2 is not None and chunk.t_min > t2):
+                continue
+            dtype = self.dtype(packet_name, chunk.direction)
+            if not chunk.record_size or dtype is None:
+                continue
+
+            chunk_timestamps = chunk.timestamps()
+            chunk_flows = chunk.flows()
+            chunk_records = chunk.records(dtype)
+            mask = None
+            if t1 is not None and chunk.t_min < t1:
+                mask = chunk_timestamps >= t1
+            if t2 is not None and chunk.t_max > t2:
+                mask = _and(mask, chunk_timestamps <= t2)
+            if flow is not None:
+                mask = _and(mask, chunk_flows == flow)
+            for field_name, value in (where or {}).items():
+                mask = _and(mask, chunk_records[field_name] == value)
+
+            if mask is None:
+                timestamps.append(chunk_timestamps)
+                flows.append(chunk_flows)
+                records.append(chunk_records)
+            elif mask.any():
+                timestamps.append(chunk_timestamps[mask])
+                flows.append(chunk_flows[mask])
+                records.append(chunk_records[mask])
+
+        if not timestamps:
+            dtype = self.dtype(packet_name, direction or 0) or self.dtype(packet_name, 1)
+            empty = np.empty(0, dtype) if dtype is not None else None
+            return QueryResult(np.empty(0, np.int64), np.empty(0, np.uint64), empty)
+        return QueryResult(np.concatenate(timestamps), np.concatenate(flows),
+                           np.concatenate(records))
+
+    def count_by(self, packet_name, field_name, **filters):
+        """{value: count} of one field over the matching events"""
+        result = self.select(packet_name, **filters)
+        if not len(result):
+            return {}
+        values, counts = np.unique(result[field_name], return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def desync(self, t1=None, t2=None, flow=None):
+        """Path error of each server position against the interpolated server path
+
+        The movement events of every flow are replayed in time order through
+        a ReconcilerTable, as the monitor does live, so a position is scored
+        against where the acknowledged move should have taken the player and
+        not against the client's target. Positions with no path to score
+        against (the first of a flow) are left out.
+
+        Returns (timestamps, flows, server_x, server_y, distance) arrays.
+        """
+        columns = ([], [], [], [], [], [], [], [])
+        sources = ((CLIENT_TARGET_PACKETS[0], DIRECTION_CLIENT, _WALK),
+                   (CLIENT_TARGET_PACKETS[1], DIRECTION_CLIENT, _RUN),
+                   (SERVER_POSITION_PACKETS[0], DIRECTION_SERVER, _MOVE),
+                   (SERVER_POSITION_PACKETS[1], DIRECTION_SERVER, _STOP))
+        for name, direction, kind in sources:
+            result = self.select(name, t1, t2, direction, flow)
+            if not len(result):
+                continue
+            count = len(result)
+            server = direction == DIRECTION_SERVER
+            columns[0].append(result.timestamps)
+            columns[1].append(result.flows)
+            columns[2].append(np.full(count, kind, np.int8))
+            columns[3].append(result['nUnitGUID'].astype(np.int64) if server else np.zeros(count, np.int64))
+            columns[4].append(result['nUnitX' if server else 'nTargetX'].astype(np.int64))
+            columns[5].append(result['nUnitY' if server else 'nTargetY'].astype(np.int64))
+            has_target = kind != _STOP
+            columns[6].append(result['nTargetX'].astype(np.int64) if has_target else np.zeros(count, np.int64))
+            columns[7].append(result['nTargetY'].astype(np.int64) if has_target else np.zeros(count, np.int64))
+        if not columns[0]:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty.astype(np.uint64), empty, empty, empty
+
+        timestamps, flows, kinds, units, xs, ys, target_xs, target_ys = \
+            (np.concatenate(column) for column in columns)
+        order = np.argsort(timestamps, kind='stable')
+        table = ReconcilerTable()
+        keep = []
+        distance = []
+        for row, timestamp, flow_value, kind, unit, x, y, target_x, target_y in zip(
+                order.tolist(), timestamps[order].tolist(), flows[order].tolist(),
+                kinds[order].tolist(), units[order].tolist(), xs[order].tolist(),
+                ys[order].tolist(), target_xs[order].tolist(), target_ys[order].tolist()):
+            seconds = timestamp / 1e9
+            if kind == _WALK or kind == _RUN:
+                table.client_command(flow_value, seconds, x, y, kind == _RUN)
+                continue
+            reconciler = table.get(flow_value)
+            fixes = reconciler.path_error.count
+            if kind == _MOVE:
+                table.server_move(flow_value, seconds, unit, x, y, target_x, target_y)
+            else:
+                table.server_position(flow_value, seconds, unit, x, y, stopped=True)
+            if reconciler.path_error.count != fixes:
+                keep.append(row)
+                distance.append(reconciler.path_error.last)
+        keep = np.array(keep, np.int64)
+        return (timestamps[keep], flows[keep], xs[keep].astype(np.float64),
+                ys[keep].astype(np.float64), np.array(distance, np.float64))
+
+    def desync_percentiles(self, percentile=99, area_size=256, **filters):
+        """Desync percentile per map area, areas being area_size x area_size tiles"""
+        _, _, x, y, distance = self.desync(**filters)
+        if not len(distance):
+            return {}
+        areas = (x.astype(np.int64) // area_size) << 32 | (y.astype(np.int64) // area_size)
+        order = np.argsort(areas, kind='stable')
+        areas, distance = areas[order], distance[order]
+        keys, starts = np.unique(areas, return_index=True)
+        result = {}
+        for key, values in zip(keys.tolist(), np.split(distance, starts[1:])):
+            result[(key >> 32, key & 0xFFFFFFFF)] = float(np.percentile(values, percentile))
+        return result
+
+
+def _and(mask, condition):
+    return condition if mask is None else mask & condition
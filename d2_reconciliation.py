@@ -0,0 +1,281 @@
+import math
+from collections import deque
+
+# Initial movement speeds in tiles per second, refined from observed moves
+DEFAULT_WALK_SPEED = 4.0
+DEFAULT_RUN_SPEED = 6.0
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.125
+
+# Path error (tiles) above which the status screen reports a moderate or a
+# large desync. Path error is scored against the interpolated server path,
+# so it stays near 0 while in sync; the 50/100 used before applied to the
+# distance between the client's target and the server position, which is
+# large during every normal move. The default desync alert uses 8 as well.
+MODERATE_PATH_ERROR = 8
+LARGE_PATH_ERROR = 20
+
+
+class _Ewma:
+    """Exponentially weighted mean, deviation, min and max of a stream"""
+    __slots__ = ('mean', 'deviation', 'minimum', 'maximum', 'last', 'count')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.deviation = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self.last = 0.0
+        self.count = 0
+
+    def add(self, value):
+        if self.count == 0:
+            self.mean = value
+        else:
+            self.deviation += EWMA_ALPHA * (abs(value - self.mean) - self.deviation)
+            self.mean += EWMA_ALPHA * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        self.last = value
+        self.count += 1
+
+
+class PositionReconciler:
+    """Incremental client/server position reconciliation
+
+    Client WALK/RUN commands wait in a short queue until the server
+    PLAYERMOVE that heads for the same target acknowledges them; the gap is
+    the command round trip. Between server fixes the player is interpolated
+    along the acknowledged path at a learned walk/run speed, and every new
+    fix is scored against that prediction as path error. All work per event
+    is bounded by max_pending, so it can stay on in production.
+
+    One reconciler follows one player; ReconcilerTable keeps one per session.
+    """
+
+    def __init__(self, max_pending=16, match_tolerance=2, command_timeout=2.0):
+        self.match_tolerance = match_tolerance
+        self.command_timeout = command_timeout
+        self.pending = deque(maxlen=max_pending)
+        self.speeds = [DEFAULT_WALK_SPEED, DEFAULT_RUN_SPEED]
+
+        # Player unit, learned from the first acknowledged command
+        self.unit_guid = None
+
+        # Current path: start time and position, target, walk (0) or run (1)
+        self.segment = None
+        self.last_fix = None
+
+        self.rtt = _Ewma()
+        self.path_error = _Ewma()
+        self.last_error = (0, 0, 0.0)
+        self.acknowledged = 0
+        self.unacknowledged = 0
+        self.server_moves = 0
+
+    def client_command(self, timestamp, target_x, target_y, running=False):
+        """A WALKTOLOCATION/RUNTOLOCATION sent by the client"""
+        pending = self.pending
+        while pending and timestamp - pending[0][0] > self.command_timeout:
+            pending.popleft()
+            self.unacknowledged += 1
+        if len(pending) == pending.maxlen:
+            self.unacknowledged += 1
+        pending.append((timestamp, target_x, target_y, running))
+
+    def _acknowledge(self, timestamp, target_x, target_y):
+        """Pop the command this server move answers; returns it or None"""
+        pending = self.pending
+        tolerance = self.match_tolerance
+        for index, command in enumerate(pending):
+            if abs(command[1] - target_x) <= tolerance and abs(command[2] - target_y) <= tolerance:
+                # Older commands were superseded before the server answered them
+                for _ in range(index):
+                    pending.popleft()
+                self.unacknowledged += index
+                pending.popleft()
+                self.rtt.add(timestamp - command[0])
+                self.acknowledged += 1
+                return command
+        return None
+
+    def _is_other_unit(self, unit_guid):
+        return unit_guid is not None and self.unit_guid is not None and unit_guid != self.unit_guid
+
+    def server_move(self, timestamp, unit_guid, x, y, target_x, target_y):
+        """A PLAYERMOVE: the unit at (x, y) starts moving toward the target
+
+        Returns the round trip of the acknowledged client command, or None.
+        """
+        if self._is_other_unit(unit_guid):
+            return None
+        self.server_moves += 1
+        command = self._acknowledge(timestamp, target_x, target_y)
+        if command is not None and self.unit_guid is None:
+            self.unit_guid = unit_guid
+        self._fix(timestamp, x, y)
+        running = command[3] if command is not None else \
+            (self.segment[5] if self.segment is not None else False)
+        self.segment = (timestamp, x, y, target_x, target_y, running)
+        return self.rtt.last if command is not None else None
+
+    def server_position(self, timestamp, unit_guid, x, y, stopped=False):
+        """A server position fix such as PLAYERSTOP; returns the path error"""
+        if self._is_other_unit(unit_guid):
+            return None
+        error = self._fix(timestamp, x, y)
+        if stopped:
+            self.segment = None
+        elif self.segment is not None:
+            # Continue along the same path from the corrected position
+            _, _, _, target_x, target_y, running = self.segment
+            self.segment = (timestamp, x, y, target_x, target_y, running)
+        return error
+
+    def _fix(self, timestamp, x, y):
+        """Score a server position against the interpolated one and learn the speed"""
+        error = None
+        segment = self.segment
+        if segment is not None:
+            predicted_x, predicted_y = self.position_at(timestamp)
+            dx = x - predicted_x
+            dy = y - predicted_y
+            error = math.hypot(dx, dy)
+            self.path_error.add(error)
+            self.last_error = (round(dx), round(dy), round(error, 2))
+
+            start_time, start_x, start_y, target_x, target_y, running = segment
+            elapsed = timestamp - start_time
+            travelled = math.hypot(x - start_x, y - start_y)
+            # Only moves still under way say anything about the speed
+            if elapsed > 0.05 and travelled > 0 and \
+                    math.hypot(target_x - x, target_y - y) > self.match_tolerance:
+                speeds = self.speeds
+                speeds[running] += EWMA_ALPHA * (travelled / elapsed - speeds[running])
+        self.last_fix = (timestamp, x, y)
+        return error
+
+    def position_at(self, timestamp):
+        """Interpolated server position at timestamp"""
+        segment = self.segment
+        if segment is None:
+            if self.last_fix is None:
+                return None
+            return self.last_fix[1], self.last_fix[2]
+        start_time, start_x, start_y, target_x, target_y, running = segment
+        length = math.hypot(target_x - start_x, target_y - start_y)
+        if length == 0:
+            return target_x, target_y
+        travelled = min(self.speeds[running] * max(timestamp - start_time, 0), length)
+        fraction = travelled / length
+        return start_x + (target_x - start_x) * fraction, start_y + (target_y - start_y) * fraction
+
+    def summary(self):
+        """Lag and path error statistics"""
+        rtt = self.rtt
+        error = self.path_error
+        return {
+            'rtt_ms': round(rtt.mean * 1000, 1),
+            'rtt_jitter_ms': round(rtt.deviation * 1000, 1),
+            'rtt_min_ms': round(rtt.minimum * 1000, 1) if rtt.count else 0.0,
+            'rtt_max_ms': round(rtt.maximum * 1000, 1),
+            'path_error': round(error.mean, 2),
+            'path_error_max': round(error.maximum, 2),
+            'acknowledged': self.acknowledged,
+            'unacknowledged': self.unacknowledged,
+            'server_moves': self.server_moves,
+            'walk_speed': round(self.speeds[0], 2),
+            'run_speed': round(self.speeds[1], 2),
+        }
+
+
+class ReconcilerTable:
+    """One PositionReconciler per session ("client ip:port"), plus totals
+
+    Each connection is a different player, so commands and server moves are
+    only matched within their own session. rtt and path_error aggregate all
+    sessions; counters of forgotten sessions are kept in the totals. last is
+    the reconciler of the most recent event.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.sessions = {}
+        self.last = None
+        self.rtt = _Ewma()
+        self.path_error = _Ewma()
+        self.retired = {'acknowledged': 0, 'unacknowledged': 0, 'server_moves': 0}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session):
+        reconciler = self.sessions.get(session)
+        if reconciler is None:
+            reconciler = self.sessions[session] = PositionReconciler(**self.options)
+        self.last = reconciler
+        return reconciler
+
+    def forget(self, session):
+        """Release a session that ended, keeping its counts in the totals"""
+        reconciler = self.sessions.pop(session, None)
+        if reconciler is None:
+            return
+        for name in self.retired:
+            self.retired[name] += getattr(reconciler, name)
+        if reconciler is self.last:
+            self.last = None
+
+    @property
+    def last_error(self):
+        return self.last.last_error if self.last is not None else (0, 0, 0.0)
+
+    def client_command(self, session, timestamp, target_x, target_y, running=False):
+        self.get(session).client_command(timestamp, target_x, target_y, running)
+
+    def server_move(self, session, timestamp, unit_guid, x, y, target_x, target_y):
+        """PositionReconciler.server_move of the session; returns the round trip or None"""
+        reconciler = self.get(session)
+        fixes = reconciler.path_error.count
+        rtt = reconciler.server_move(timestamp, unit_guid, x, y, target_x, target_y)
+        if rtt is not None:
+            self.rtt.add(rtt)
+        if reconciler.path_error.count != fixes:
+            self.path_error.add(reconciler.path_error.last)
+        return rtt
+
+    def server_position(self, session, timestamp, unit_guid, x, y, stopped=False):
+        """PositionReconciler.server_position of the session; returns the path error"""
+        error = self.get(session).server_position(timestamp, unit_guid, x, y, stopped)
+        if error is not None:
+            self.path_error.add(error)
+        return error
+
+    def summary(self):
+        """Lag and path error statistics over all sessions"""
+        rtt = self.rtt
+        error = self.path_error
+        totals = dict(self.retired)
+        speeds = [0.0, 0.0]
+        for reconciler in self.sessions.values():
+            for name in totals:
+                totals[name] += getattr(reconciler, name)
+            speeds[0] += reconciler.speeds[0]
+            speeds[1] += reconciler.speeds[1]
+        count = len(self.sessions)
+        summary = {
+            'rtt_ms': round(rtt.mean * 1000, 1),
+            'rtt_jitter_ms': round(rtt.deviation * 1000, 1),
+            'rtt_min_ms': round(rtt.minimum * 1000, 1) if rtt.count else 0.0,
+            'rtt_max_ms': round(rtt.maximum * 1000, 1),
+            'path_error': round(error.mean, 2),
+            'path_error_max': round(error.maximum, 2),
+        }
+        summary.update(totals)
+        summary['sessions'] = count
+        summary['walk_speed'] = round(speeds[0] / count, 2) if count else DEFAULT_WALK_SPEED
+        summary['run_speed'] = round(speeds[1] / count, 2) if count else DEFAULT_RUN_SPEED
+        return summary
@@ -0,0 +1,192 @@
+import os
+import socket
+import struct
+import time
+from array import array
+
+# File layout
+#
+#   file   := FILE_MAGIC chunk*
+#   chunk  := CHUNK_HEADER name pad8 timestamps flows body
+#
+# Every chunk holds the events of one (direction, packet id) pair from one
+# flush, column by column: int64 capture timestamps (ns), uint64 flow keys,
+# then the payloads. Fixed-layout packets are stored as record_size byte
+# records in their struct layout, so a reader can view them as a NumPy
+# structured array without decoding again. Other payloads are stored as
+# uint32 offsets (count + 1) followed by the concatenated bytes.
+FILE_MAGIC = b"D2REC\x01\x00\x00"
+CHUNK_MAGIC = b"D2CK"
+CHUNK_HEADER = struct.Struct('<4sHBBIIIqq')
+FILE_SUFFIX = ".d2rec"
+
+DIRECTION_CLIENT = 0
+DIRECTION_SERVER = 1
+
+
+def pad8(size):
+    """Bytes needed to align size to 8"""
+    return -size % 8
+
+
+def flow_key(ip_address, port):
+    """Pack the client side of a session (IPv4 address, port) into one integer"""
+    return struct.unpack('!I', socket.inet_aton(ip_address))[0] << 16 | port
+
+
+def flow_address(key):
+    """Inverse of flow_key"""
+    return socket.inet_ntoa(struct.pack('!I', key >> 16)), key & 0xFFFF
+
+
+class _PendingChunk:
+    """Column buffers of one (direction, packet id, layout) group awaiting a flush"""
+    __slots__ = ('name', 'record_size', 'timestamps', 'flows', 'payloads', 'offsets')
+
+    def __init__(self, name, record_size):
+        self.name = name
+        self.record_size = record_size
+        self.timestamps = array('q')
+        self.flows = array('Q')
+        self.payloads = bytearray()
+        self.offsets = array('I', [0]) if not record_size else None
+
+    def append(self, timestamp_ns, flow, payload):
+        self.timestamps.append(timestamp_ns)
+        self.flows.append(flow)
+        self.payloads += payload
+        if self.offsets is not None:
+            self.offsets.append(len(self.payloads))
+
+    def serialize(self, direction, packet_id):
+        name = self.name.encode('utf-8')
+        body = bytearray()
+        if self.offsets is not None:
+            body += self.offsets.tobytes()
+            body += bytes(pad8(len(body)))
+        body += self.payloads
+        body += bytes(pad8(len(body)))
+
+        count = len(self.timestamps)
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(name), direction, packet_id, count,
+                                   self.record_size, len(body),
+                                   min(self.timestamps), max(self.timestamps))
+        parts = [header, name, bytes(pad8(CHUNK_HEADER.size + len(name))),
+                 self.timestamps.tobytes(), self.flows.tobytes(), body]
+        return b"".join(parts)
+
+
+class SessionRecorder:
+    """Append-only recorder of decoded game events with batched writes and rotation
+
+    Events are grouped per (direction, packet id) in memory and written as
+    column chunks every batch_size events (or flush_interval seconds).
+    Files are rotated once they reach rotate_bytes or rotate_seconds.
+    """
+
+    def __init__(self, directory=".", prefix="session", client_codec=None, server_codec=None,
+                 batch_size=4096, flush_interval=1.0, rotate_bytes=64 * 1024 * 1024,
+                 rotate_seconds=None, buffer_size=1024 * 1024):
+        self.directory = directory
+        self.prefix = prefix
+        self.codecs = (client_codec, server_codec)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.buffer_size = buffer_size
+
+        self.pending = {}
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.file_path = None
+        self.file_opened = 0
+        self.file_index = 0
+        self.files = []
+        self.events_written = 0
+        self.bytes_written = 0
+
+        # Fixed record sizes per (direction, packet id), resolved lazily
+        self.layouts = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def set_codecs(self, client_codec, server_codec):
+        """Use these definitions to find fixed-layout packets"""
+        self.codecs = (client_codec, server_codec)
+        self.layouts = {}
+
+    def _layout(self, direction, packet_id):
+        key = (direction, packet_id)
+        layout = self.layouts.get(key)
+        if layout is None:
+            codec = self.codecs[direction]
+            packet = codec.by_id.get(packet_id) if codec is not None else None
+            if packet is not None:
+                layout = (packet.name, packet.fixed_size or 0)
+            else:
+                layout = (f"0x{packet_id:02X}", 0)
+            self.layouts[key] = layout
+        return layout
+
+    def record(self, timestamp_ns, flow, direction, payload):
+        """Queue one game message; writes happen in batches"""
+        packet_id = payload[0]
+        name, record_size = self._layout(direction, packet_id)
+        if record_size and len(payload) != record_size:
+            record_size = 0
+        key = (direction, packet_id, record_size)
+        chunk = self.pending.get(key)
+        if chunk is None:
+            chunk = self.pending[key] = _PendingChunk(name, record_size)
+        chunk.append(timestamp_ns, flow, payload)
+
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size or \
+                time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _open(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.file_index += 1
+        self.file_path = os.path.join(self.directory,
+                                      f"{self.prefix}-{stamp}-{self.file_index:04d}{FILE_SUFFIX}")
+        self.file = open(self.file_path, 'wb', buffering=self.buffer_size)
+        self.file.write(FILE_MAGIC)
+        self.file_opened = time.monotonic()
+        self.files.append(self.file_path)
+
+    def _should_rotate(self):
+        if self.rotate_bytes and self.file.tell() >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and \
+            time.monotonic() - self.file_opened >= self.rotate_seconds
+
+    def flush(self):
+        """Write all pending chunks with a single write call"""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.file is None:
+            self._open()
+        data = b"".join(chunk.serialize(direction, packet_id)
+                        for (direction, packet_id, _), chunk in self.pending.items())
+        self.file.write(data)
+        self.events_written += self.pending_count
+        self.bytes_written += len(data)
+        self.pending = {}
+        self.pending_count = 0
+        if self._should_rotate():
+            self.rotate()
+
+    def rotate(self):
+        """Close the current file; the next flush starts a new one"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.flush()
+        self.rotate()
+        print(f"Recorded {self.events_written} events ({self.bytes_written} bytes) "
+              f"in {len(self.files)} file(s)")
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+from array import array
+from scapy.all import PcapReader
+
+# Sleep until this close to a packet's due time, then spin for precision
+SPIN_SECONDS = 0.0005
+
+# End-to-end lag above which a replay is reported as not keeping up
+DEFAULT_LAG_BUDGET = 0.050
+
+# Wait for the next packet this long before giving the monitor an idle tick
+IDLE_SECONDS = 0.1
+
+
+class ReplayReport:
+    """Outcome of one replay run"""
+
+    def __init__(self, speed, packets, elapsed, capture_span, lags, max_queue_depth,
+                 lag_budget):
+        self.speed = speed
+        self.packets = packets
+        self.elapsed = elapsed
+        self.capture_span = capture_span
+        self.max_queue_depth = max_queue_depth
+        self.lag_budget = lag_budget
+        ordered = sorted(lags)
+        self.lag_p50 = _percentile(ordered, 50)
+        self.lag_p99 = _percentile(ordered, 99)
+        self.lag_max = ordered[-1] if ordered else 0.0
+        self.rate = packets / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def kept_up(self):
+        return self.lag_p99 <= self.lag_budget
+
+    def __str__(self):
+        speed = "max" if not self.speed else f"{self.speed:g}x"
+        status = "kept up" if self.kept_up else "FELL BEHIND"
+        if not self.speed:
+            # Without a timeline the lag is only time spent queued
+            status = "throughput run"
+        return (f"speed {speed:>6}: {self.packets} packets in {self.elapsed:.2f}s "
+                f"({self.rate:.0f} pkt/s, capture span {self.capture_span:.2f}s) | "
+                f"lag p50 {self.lag_p50 * 1000:.2f}ms p99 {self.lag_p99 * 1000:.2f}ms "
+                f"max {self.lag_max * 1000:.2f}ms | max queue {self.max_queue_depth} | {status}")
+
+
+def _percentile(ordered, percentile):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+    return ordered[index]
+
+
+class PcapReplayer:
+    """Feed a capture file through a monitor's packet_handler on a monotonic schedule
+
+    speed=1 keeps the original inter-arrival times, speed=10 plays ten times
+    faster and speed=None (or 0) as fast as possible. A producer thread
+    releases packets at their due time into a bounded queue that the
+    handler drains; the lag between due time and handled time, and the
+    queue depth, show whether the pipeline keeps up.
+    """
+
+    def __init__(self, monitor, pcap_file, queue_size=10000, preload=True,
+                 lag_budget=DEFAULT_LAG_BUDGET):
+        self.monitor = monitor
+        self.pcap_file = pcap_file
+        self.queue_size = queue_size
+        self.lag_budget = lag_budget
+        self.packets = self.load() if preload else None
+
+    def load(self):
+        """Read the whole capture up front so file parsing is not measured"""
+        with PcapReader(self.pcap_file) as reader:
+            return list(reader)
+
+    def source(self):
+        if self.packets is not None:
+            return iter(self.packets)
+        return iter(PcapReader(self.pcap_file))
+
+    def run(self, speed=1.0):
+        """Replay once at the given speed and return a ReplayReport"""
+        pending = queue.Queue(maxsize=self.queue_size)
+        lags = array('d')
+        depth = [0]
+        metrics = getattr(self.monitor, 'metrics', None)
+        capture_span = [0.0]
+
+        def produce():
+            start = time.perf_counter()
+            first_time = None
+            last_time = None
+            for packet in self.source():
+                packet_time = float(packet.time)
+                if first_time is None:
+                    first_time = packet_time
+                last_time = packet_time
+                due = start
+                if speed:
+                    due = start + (packet_time - first_time) / speed
+                    remaining = due - time.perf_counter()
+                    if remaining > SPIN_SECONDS:
+                        time.sleep(remaining - SPIN_SECONDS)
+                    # Yield the GIL while spinning so the handler keeps running
+                    while time.perf_counter() < due:
+                        time.sleep(0)
+                else:
+                    due = time.perf_counter()
+                pending.put((due, packet))
+                size = pending.qsize()
+                if size > depth[0]:
+                    depth[0] = size
+            if first_time is not None:
+                capture_span[0] = last_time - first_time
+            pending.put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        started = time.perf_counter()
+        producer.start()
+
+        handler = self.monitor.packet_handler
+        idle = getattr(self.monitor, 'publish_if_requested', None)
+        while True:
+            try:
+                item = pending.get(timeout=IDLE_SECONDS)
+            except queue.Empty:
+                # Quiet stretch of the capture: the handler thread may still publish
+                if idle is not None:
+                    idle()
+                continue
+            if item is None:
+                break
+            due, packet = item
+            handler(packet)
+            lags.append(time.perf_counter() - due)
+            if metrics is not None:
+                metrics.queue_depth.set(pending.qsize())
+
+        elapsed = time.perf_counter() - started
+        producer.join()
+        return ReplayReport(speed, len(lags), elapsed, capture_span[0], lags, depth[0],
+                            self.lag_budget)
+
+    def run_speeds(self, speeds=(1, 10, 100, None)):
+        """Replay once per speed and print a report line for each
+
+        The monitor's reset_state(), if it has one, is called before every
+        run after the first so each speed starts from the same state. The
+        recorder, bus, pcap writer and exporter stream every run out, so
+        their output holds the capture once per speed.
+        """
+        reports = []
+        reset = getattr(self.monitor, 'reset_state', None)
+        for index, speed in enumerate(speeds):
+            if index and reset is not None:
+                reset()
+            report = self.run(speed)
+            print(report)
+            reports.append(report)
+        return reports
@@ -0,0 +1,526 @@
+import argparse
+import os
+import struct
+import time
+from scapy.all import (Packet, bind_layers, bind_top_down, conf, Field, ByteField, LEShortField, LEIntField,
+                       LELongField, StrFixedLenField, StrLenField, StrNullField, FieldListField,
+                       PacketListField, RawPcapReader)
+from scapy.layers.inet import TCP, UDP
+from d2_packet_codec import (D2PacketCodec, FixedSegment, StringField, StringListField,
+                             CountedArray, BYTE_TYPES, STRING_TYPE, TYPE_FORMATS, SIZE_FIELD)
+from d2_recorder import DIRECTION_CLIENT, DIRECTION_SERVER
+
+GS_PORT = 4000
+REALM_PORT = 6112
+
+# (protocol, client definitions, server definitions); SID and MCP share the realm port
+PROTOCOLS = (
+    ("D2GS", "client2gs.json", "gs2client.json"),
+    ("MCP", "client2mcps.json", "mcps2client.json"),
+    ("SID", "client2sid.json", "sid2client.json"),
+)
+
+SCAPY_FIELDS = {'B': ByteField, 'H': LEShortField, 'I': LEIntField, 'Q': LELongField}
+
+# SID messages start with 0xFF; MCP messages with their length
+SID_MARKER = 0xFF
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 101, 228)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+
+class StrNullListField(Field):
+    """std::string[]: null terminated strings closed by an empty string"""
+    islist = 1
+
+    def __init__(self, name, default=None):
+        Field.__init__(self, name, default or [])
+
+    def getfield(self, pkt, s):
+        strings = []
+        offset = 0
+        while offset < len(s):
+            end = s.find(b'\x00', offset)
+            if end < 0:
+                break
+            if end == offset:
+                offset += 1
+                break
+            strings.append(s[offset:end])
+            offset = end + 1
+        return s[offset:], strings
+
+    def addfield(self, pkt, s, val):
+        return s + b"".join(bytes(value) + b'\x00' for value in val or []) + b'\x00'
+
+
+class D2Message(Packet):
+    """Base of the generated message layers; codec is the compiled PacketCodec"""
+    codec = None
+    stream = None
+
+    def guess_payload_class(self, payload):
+        # The rest of the segment is the next message of the same stream
+        return self.stream
+
+    def post_build(self, packet, payload):
+        offset = self.codec.size_offset
+        if offset is not None and self.getfieldval(SIZE_FIELD) is None:
+            packet = packet[:offset] + struct.pack('<H', len(packet)) + packet[offset + 2:]
+        return packet + payload
+
+
+class D2Record(Packet):
+    """Base of the generated records inside counted arrays"""
+
+    def extract_padding(self, s):
+        return b"", s
+
+
+class D2Stream(Packet):
+    """Picks the message layer of one protocol direction from its packet id"""
+    fields_desc = []
+    codecs = None
+    classes = None
+    messages = None
+
+    @classmethod
+    def layer_for(cls, data):
+        offset = cls.codecs.id_offset
+        if data is None or len(data) <= offset:
+            return conf.raw_layer
+        return cls.classes[data[offset]] or conf.raw_layer
+
+
+class D2RealmStream(Packet):
+    """Realm port traffic: SID when the message starts with 0xFF, MCP otherwise"""
+    fields_desc = []
+    streams = None
+
+    @classmethod
+    def layer_for(cls, data):
+        if not data:
+            return conf.raw_layer
+        sid, mcp = cls.streams
+        return (sid if data[0] == SID_MARKER else mcp).layer_for(data)
+
+
+def _dispatch(cls, _pkt=None, *args, **kargs):
+    return cls.layer_for(_pkt)
+
+
+def _scalar_fields(name, fields, codec):
+    """Scapy fields of one FixedSegment"""
+    result = []
+    for field_name, fmt, width, is_bytes in fields:
+        if is_bytes:
+            result.append(StrFixedLenField(field_name, b"", length=int(fmt[:-1])))
+        elif width:
+            result.append(FieldListField(field_name, [0] * width, SCAPY_FIELDS[fmt[-1]]("", 0),
+                                         count_from=lambda pkt, width=width: width))
+        elif field_name == 'PacketId' and codec.packet_id is not None:
+            result.append(ByteField(field_name, codec.packet_id))
+        elif field_name == 'AlwaysFF':
+            result.append(ByteField(field_name, SID_MARKER))
+        elif field_name == SIZE_FIELD and codec.header is not None:
+            result.append(LEShortField(field_name, None))
+        else:
+            result.append(SCAPY_FIELDS[fmt](field_name, 0))
+    return result
+
+
+def _counted_field(name, array):
+    count = array.count
+
+    def count_from(pkt):
+        return count.evaluate(pkt.fields)
+
+    # Constant lengths such as sUnitMessages[8] default to that many items
+    size = array.fixed_count or 0
+    if array.record is not None:
+        record = type(f"{name}_{array.name}", (D2Record,),
+                      {'fields_desc': _fields_desc(f"{name}_{array.name}", array.record)})
+        return PacketListField(array.name, [record() for _ in range(size)], record,
+                               count_from=count_from)
+    if array.element_type in BYTE_TYPES:
+        return StrLenField(array.name, bytes(size), length_from=count_from)
+    if array.element_type == STRING_TYPE:
+        return FieldListField(array.name, [b""] * size, StrNullField("", b""), count_from=count_from)
+    return FieldListField(array.name, [0] * size, SCAPY_FIELDS[TYPE_FORMATS[array.element_type]]("", 0),
+                          count_from=count_from)
+
+
+def _fields_desc(name, codec):
+    """fields_desc for a compiled PacketCodec, segment by segment"""
+    fields = []
+    for segment in codec.segments:
+        if isinstance(segment, FixedSegment):
+            fields.extend(_scalar_fields(name, segment.fields, codec))
+        elif isinstance(segment, StringField):
+            fields.append(StrNullField(segment.name, b""))
+        elif isinstance(segment, StringListField):
+            fields.append(StrNullListField(segment.name))
+        elif isinstance(segment, CountedArray):
+            fields.append(_counted_field(name, segment))
+    return fields
+
+
+class D2Layers:
+    """Scapy layers generated from the JSON definitions
+
+    Every message of every protocol direction becomes a D2Message subclass
+    named after its definition (server messages whose name is also a client
+    message get a _SERVER suffix). Classes are reachable as attributes,
+    items, or module globals of d2_scapy once generated.
+    """
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.classes = {}
+        self.streams = {}
+        for protocol, client_json, server_json in PROTOCOLS:
+            for direction, json_file in ((DIRECTION_CLIENT, client_json),
+                                         (DIRECTION_SERVER, server_json)):
+                self.streams[(protocol, direction)] = self._generate(protocol, direction, json_file)
+        self.realm = tuple(
+            type(f"D2Realm{side}", (D2RealmStream,),
+                 {'dispatch_hook': classmethod(_dispatch),
+                  'streams': (self.streams[("SID", direction)], self.streams[("MCP", direction)])})
+            for direction, side in ((DIRECTION_CLIENT, "Client"), (DIRECTION_SERVER, "Server")))
+
+    def _generate(self, protocol, direction, json_file):
+        codecs = D2PacketCodec.from_file(os.path.join(self.directory, json_file))
+        side = "Client" if direction == DIRECTION_CLIENT else "Server"
+        stream = type(f"{protocol}{side}", (D2Stream,),
+                      {'dispatch_hook': classmethod(_dispatch), 'codecs': codecs,
+                       'classes': [None] * 256, 'messages': []})
+        for codec in codecs.packets.values():
+            name = codec.name
+            if name in self.classes:
+                name += "_SERVER"
+            cls = type(name, (D2Message,), {'name': name, 'codec': codec, 'stream': stream,
+                                             'fields_desc': _fields_desc(name, codec)})
+            self.classes[name] = cls
+            stream.messages.append(cls)
+            if stream.classes[codec.packet_id] is None:
+                stream.classes[codec.packet_id] = cls
+        return stream
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['classes'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, name):
+        return self.classes[name]
+
+    def __iter__(self):
+        return iter(self.classes.values())
+
+    def bind(self, gs_port=GS_PORT, realm_port=REALM_PORT):
+        """Dissect TCP and UDP payloads on the game ports with these layers
+
+        Messages stacked on TCP/UDP when crafting get the matching port:
+        destination for client messages, source for server messages.
+        """
+        for transport in (TCP, UDP):
+            bind_layers(transport, self.streams[("D2GS", DIRECTION_CLIENT)], dport=gs_port)
+            bind_layers(transport, self.streams[("D2GS", DIRECTION_SERVER)], sport=gs_port)
+            bind_layers(transport, self.realm[DIRECTION_CLIENT], dport=realm_port)
+            bind_layers(transport, self.realm[DIRECTION_SERVER], sport=realm_port)
+            for (protocol, direction), stream in self.streams.items():
+                port = gs_port if protocol == "D2GS" else realm_port
+                side = 'dport' if direction == DIRECTION_CLIENT else 'sport'
+                for cls in stream.messages:
+                    bind_top_down(transport, cls, **{side: port})
+
+    def stream(self, realm, direction, payload):
+        """Stream class of a game payload; realm payloads are SID or MCP"""
+        if not realm:
+            return self.streams[("D2GS", direction)]
+        if payload:
+            return self.streams[("SID" if payload[0] == SID_MARKER else "MCP", direction)]
+        return None
+
+
+_generated = {}
+
+
+def generate_layers(directory=".", bind=True, gs_port=GS_PORT, realm_port=REALM_PORT):
+    """D2Layers for the definitions in directory, generated once per directory
+
+    The classes are also added to this module, so after generating
+    "from d2_scapy import D2GS_PLAYERMOVE" works. With bind, sniff() and
+    rdpcap() dissect the game ports with them.
+    """
+    layers = _generated.get(directory)
+    if layers is None:
+        layers = _generated[directory] = D2Layers(directory)
+        globals().update(layers.classes)
+        if bind:
+            layers.bind(gs_port, realm_port)
+    return layers
+
+
+class BulkPacket:
+    """One game segment from BulkDissector
+
+    Addresses come straight from the raw headers and messages are
+    LazyMessage views over the payload, so nothing is unpacked until read:
+    pkt[D2GS_PLAYERMOVE].nUnitX reads one struct slot. layer(index) and
+    packet build the full scapy objects only when asked for.
+    """
+    __slots__ = ('time', 'linktype', 'frame', 'src', 'sport', 'dst', 'dport', 'proto',
+                 'direction', 'payload', 'classes', 'messages', 'bounds', '_packet')
+
+    def __init__(self, timestamp, linktype, frame, src, sport, dst, dport, proto, direction, payload):
+        self.time = timestamp
+        self.linktype = linktype
+        self.frame = frame
+        self.src = src
+        self.sport = sport
+        self.dst = dst
+        self.dport = dport
+        self.proto = proto
+        self.direction = direction
+        self.payload = payload
+        self.classes = []
+        self.messages = []
+        self.bounds = [0]
+        self._packet = None
+
+    def _index(self, layer):
+        if isinstance(layer, str):
+            for index, cls in enumerate(self.classes):
+                if cls.__name__ == layer:
+                    return index
+        else:
+            for index, cls in enumerate(self.classes):
+                if cls is layer:
+                    return index
+        return None
+
+    def haslayer(self, layer):
+        return self._index(layer) is not None
+
+    __contains__ = haslayer
+
+    def __getitem__(self, layer):
+        index = self._index(layer)
+        if index is None:
+            name = layer if isinstance(layer, str) else layer.__name__
+            raise IndexError(f"Layer [{name}] not found")
+        return self.messages[index]
+
+    def layer(self, index=0):
+        """Scapy object of the index-th message, dissected from its bytes"""
+        return self.classes[index](bytes(self.payload[self.bounds[index]:self.bounds[index + 1]]))
+
+    @property
+    def packet(self):
+        """The whole frame dissected by scapy (cached)"""
+        if self._packet is None:
+            self._packet = conf.l2types.num2layer[self.linktype](self.frame)
+            self._packet.time = self.time
+        return self._packet
+
+    def summary(self):
+        side = "CLIENT" if self.direction == DIRECTION_CLIENT else "SERVER"
+        names = " / ".join(cls.__name__ for cls in self.classes) or "Raw"
+        return f"{self.src}:{self.sport} > {self.dst}:{self.dport} {side} {names}"
+
+    def __repr__(self):
+        return f"<BulkPacket {self.summary()}>"
+
+
+class BulkDissector:
+    """Game messages of a capture without scapy's per-layer dissection
+
+    Frames are read with RawPcapReader (or taken from already captured
+    packets), IPv4/TCP/UDP headers are parsed with struct, and each game
+    payload is framed into messages with the compiled codecs: fixed-size
+    messages by size, SID/MCP by their nSize header, anything else by one
+    decode. Iterating yields BulkPacket objects for game segments.
+    """
+
+    def __init__(self, layers=None, gs_port=GS_PORT, realm_port=REALM_PORT):
+        self.layers = layers or generate_layers()
+        self.gs_port = gs_port
+        self.realm_port = realm_port
+        self.ports = (gs_port, realm_port)
+        self.frames = 0
+        self.segments = 0
+        self.messages = 0
+        self.unframed = 0
+
+    def read(self, path):
+        """BulkPackets of a pcap or pcapng file"""
+        with RawPcapReader(path) as reader:
+            for frame, meta in reader:
+                if hasattr(meta, 'sec'):
+                    timestamp = meta.sec + meta.usec / 1000000
+                    linktype = reader.linktype
+                else:
+                    timestamp = (meta.tshigh << 32 | meta.tslow) / meta.tsresol
+                    linktype = meta.linktype
+                packet = self.dissect(frame, linktype, timestamp)
+                if packet is not None:
+                    yield packet
+
+    def packets(self, packets):
+        """BulkPackets of already captured scapy packets (sniff/rdpcap output)"""
+        for packet in packets:
+            frame = getattr(packet, 'original', None) or bytes(packet)
+            linktype = conf.l2types.layer2num.get(type(packet), LINKTYPE_ETHERNET)
+            result = self.dissect(frame, linktype, float(packet.time))
+            if result is not None:
+                yield result
+
+    def dissect(self, frame, linktype, timestamp):
+        """BulkPacket of one raw frame, or None if it carries no game payload"""
+        self.frames += 1
+        offset = self._ip_offset(frame, linktype)
+        if offset is None or len(frame) < offset + 20 or frame[offset] >> 4 != 4:
+            return None
+        header_length = (frame[offset] & 0x0F) * 4
+        total_length, = struct.unpack_from('!H', frame, offset + 2)
+        proto = frame[offset + 9]
+        transport = offset + header_length
+        end = min(offset + total_length, len(frame))
+        if proto == 6:
+            if end < transport + 20:
+                return None
+            start = transport + (frame[transport + 12] >> 4) * 4
+        elif proto == 17:
+            start = transport + 8
+        else:
+            return None
+        if start >= end:
+            return None
+        sport, dport = struct.unpack_from('!HH', frame, transport)
+        if dport in self.ports:
+            direction, port = DIRECTION_CLIENT, dport
+        elif sport in self.ports:
+            direction, port = DIRECTION_SERVER, sport
+        else:
+            return None
+
+        payload = memoryview(frame)[start:end]
+        packet = BulkPacket(timestamp, linktype, frame,
+                            ".".join(map(str, frame[offset + 12:offset + 16])), sport,
+                            ".".join(map(str, frame[offset + 16:offset + 20])), dport,
+                            proto, direction, payload)
+        self.segments += 1
+        stream = self.layers.stream(port == self.realm_port, direction, payload)
+        if stream is not None:
+            self._frame(stream, packet, payload)
+        return packet
+
+    def _frame(self, stream, packet, payload):
+        codecs = stream.codecs
+        classes = stream.classes
+        id_offset = codecs.id_offset
+        offset = 0
+        end = len(payload)
+        while offset + id_offset < end:
+            cls = classes[payload[offset + id_offset]]
+            if cls is None:
+                break
+            codec = cls.codec
+            message = codec.view(payload, offset)
+            if codec.fixed_size is not None:
+                length = codec.fixed_size
+            elif codec.size_offset is not None and offset + codec.size_offset + 2 <= end:
+                length, = codec.size_struct.unpack_from(payload, offset + codec.size_offset)
+            else:
+                try:
+                    message.decoded = {}
+                    length = codec.decode_into(bytes(payload), offset, message.decoded) - offset
+                except (struct.error, ValueError, IndexError):
+                    break
+            if not length or offset + length > end:
+                break
+            offset += length
+            packet.classes.append(cls)
+            packet.messages.append(message)
+            packet.bounds.append(offset)
+            self.messages += 1
+        if offset < end:
+            self.unframed += 1
+
+    @staticmethod
+    def _ip_offset(frame, linktype):
+        if linktype == LINKTYPE_ETHERNET:
+            if len(frame) < 14:
+                return None
+            ethertype, = struct.unpack_from('!H', frame, 12)
+            offset = 14
+            while ethertype in (0x8100, 0x88A8) and len(frame) >= offset + 4:
+                ethertype, = struct.unpack_from('!H', frame, offset + 2)
+                offset += 4
+            return offset if ethertype == 0x0800 else None
+        if linktype == LINKTYPE_LINUX_SLL:
+            return 16 if frame[14:16] == b'\x08\x00' else None
+        if linktype == LINKTYPE_LINUX_SLL2:
+            return 20 if frame[0:2] == b'\x08\x00' else None
+        if linktype == LINKTYPE_NULL:
+            return 4 if frame[:4] in (b'\x02\x00\x00\x00', b'\x00\x00\x00\x02') else None
+        if linktype in LINKTYPE_RAW:
+            return 0
+        return None
+
+    def stats(self):
+        return {'frames': self.frames, 'segments': self.segments, 'messages': self.messages,
+                'unframed': self.unframed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dissect D2 captures with generated scapy layers")
+    parser.add_argument("pcap", help="capture file")
+    parser.add_argument("--scapy", action="store_true",
+                        help="dissect every frame with scapy instead of the bulk dissector")
+    parser.add_argument("--show", type=int, default=0, metavar="N", help="print the first N game packets")
+    args = parser.parse_args()
+
+    layers = generate_layers()
+    print(f"Generated {len(layers.classes)} layers")
+    started = time.perf_counter()
+    counts = {}
+    shown = 0
+    if args.scapy:
+        from scapy.all import PcapReader
+        with PcapReader(args.pcap) as reader:
+            for packet in reader:
+                layer = packet
+                game = False
+                while layer:
+                    if isinstance(layer, D2Message):
+                        counts[layer.name] = counts.get(layer.name, 0) + 1
+                        game = True
+                    layer = layer.payload
+                if game and shown < args.show:
+                    packet.show()
+                    shown += 1
+    else:
+        dissector = BulkDissector(layers)
+        for packet in dissector.read(args.pcap):
+            for cls in packet.classes:
+                counts[cls.__name__] = counts.get(cls.__name__, 0) + 1
+            if shown < args.show:
+                print(packet.summary())
+                for message in packet.messages:
+                    print(f"    {message.to_dict()}")
+                shown += 1
+        print(dissector.stats())
+    elapsed = time.perf_counter() - started
+    print(f"{sum(counts.values())} messages in {elapsed:.3f}s")
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {name:<32} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import struct
+import time
+from array import array
+from d2_packet_crafter import D2PacketCrafter
+
+SCHEDULE_MAGIC = b"D2SCHED1"
+# magic, cache key, entries, payload bytes, step names length
+SCHEDULE_HEADER = struct.Struct('<8s32sIII')
+
+
+class FieldGenerator:
+    """Value of one field for the n-th send of a step
+
+    Accepted forms in a scenario file:
+      5                           constant
+      {"values": [1, 2, 3]}       cycled
+      {"range": [100, 400, 10]}   Python range, cycled
+      {"random": [0, 255]}        uniform integer (seeded per scenario)
+      {"elapsed_ms": 1000}        base + scheduled send time in ms (tick counts)
+    """
+
+    def __init__(self, spec, rng):
+        self.rng = rng
+        if not isinstance(spec, dict):
+            self.kind, self.values = "constant", spec
+        elif "values" in spec:
+            self.kind, self.values = "values", list(spec["values"])
+        elif "range" in spec:
+            self.kind, self.values = "values", list(range(*spec["range"]))
+        elif "random" in spec:
+            self.kind, self.values = "random", tuple(spec["random"])
+        elif "elapsed_ms" in spec:
+            self.kind, self.values = "elapsed_ms", int(spec["elapsed_ms"])
+        else:
+            raise ValueError(f"Unknown field generator {spec}")
+        if self.kind == "values" and not self.values:
+            raise ValueError(f"Empty field generator {spec}")
+        self.count = 0
+
+    def take(self, times):
+        """Values for the next len(times) sends"""
+        start = self.count
+        self.count += len(times)
+        if self.kind == "constant":
+            return self.values
+        if self.kind == "values":
+            values = self.values
+            return [values[(start + index) % len(values)] for index in range(len(times))]
+        if self.kind == "random":
+            low, high = self.values
+            return [self.rng.randint(low, high) for _ in times]
+        return [(self.values + int(t * 1000)) & 0xFFFFFFFF for t in times]
+
+
+class CompiledScenario:
+    """Flat send schedule: entry i is payload(i), sent at times[i] seconds
+    after the start; all payloads share one contiguous buffer"""
+
+    def __init__(self, name, times, buffer, bounds, steps, step_names):
+        self.name = name
+        self.times = times
+        self.buffer = buffer
+        self.bounds = bounds
+        self.steps = steps
+        self.step_names = step_names
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return self.times[-1] if len(self.times) else 0.0
+
+    def payload(self, index):
+        return memoryview(self.buffer)[self.bounds[index]:self.bounds[index + 1]]
+
+    def entries(self):
+        """(time, step name, payload) for every send, in order"""
+        view = memoryview(self.buffer)
+        bounds = self.bounds
+        for index, at in enumerate(self.times):
+            yield at, self.step_names[self.steps[index]], view[bounds[index]:bounds[index + 1]]
+
+    def save(self, path, key):
+        names = json.dumps(self.step_names).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(SCHEDULE_HEADER.pack(SCHEDULE_MAGIC, key, len(self.times),
+                                         len(self.buffer), len(names)))
+            f.write(self.times.tobytes())
+            f.write(self.bounds.tobytes())
+            f.write(self.steps.tobytes())
+            f.write(names)
+            f.write(self.buffer)
+
+    @classmethod
+    def load(cls, path, key, name):
+        """Cached schedule, or None when missing, stale or unreadable"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, cached_key, count, size, names_size = SCHEDULE_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != SCHEDULE_MAGIC or cached_key != key:
+            return None
+        offset = SCHEDULE_HEADER.size
+        times = array('d')
+        times.frombytes(data[offset:offset + 8 * count])
+        offset += 8 * count
+        bounds = array('Q')
+        bounds.frombytes(data[offset:offset + 8 * (count + 1)])
+        offset += 8 * (count + 1)
+        steps = array('H')
+        steps.frombytes(data[offset:offset + 2 * count])
+        offset += 2 * count
+        step_names = json.loads(data[offset:offset + names_size])
+        offset += names_size
+        return cls(name, times, bytes(data[offset:offset + size]), bounds, steps, step_names)
+
+
+class ScenarioCompiler:
+    """Turns a scenario file into a CompiledScenario
+
+    A scenario is {"name", "definitions", "seed", "steps"}. A step sends
+    one packet type: {"packet", "fields", "delay", "repeat", "interval"},
+    where delay is the gap before its first send and interval the gap
+    between repeats. A group {"repeat", "delay", "steps"} plays its steps
+    repeat times. Each packet step is encoded with one pack_batch call per
+    group iteration, so nothing is interpreted while sending.
+
+    A relative definitions path is resolved against directory, the one
+    holding the scenario file.
+    """
+
+    def __init__(self, scenario, directory="."):
+        self.scenario = scenario
+        self.crafter = D2PacketCrafter(definitions_path(scenario, directory))
+        self.rng = random.Random(scenario.get("seed", 0))
+        self.generators = {}
+        self.step_names = []
+        self.step_index = {}
+
+    def compile(self):
+        self.times = array('d')
+        self.steps = array('H')
+        self.chunks = []
+        self.clock = 0.0
+        self._steps(self.scenario.get("steps", []), "")
+
+        buffer = bytearray()
+        bounds = array('Q', [0])
+        for chunk, offsets in self.chunks:
+            base = len(buffer)
+            buffer += chunk
+            bounds.extend(base + offset for offset in offsets[1:])
+        return CompiledScenario(self.scenario.get("name", "scenario"), self.times,
+                                bytes(buffer), bounds, self.steps, self.step_names)
+
+    def _steps(self, steps, path):
+        for position, step in enumerate(steps):
+            step_path = f"{path}{position}"
+            if "steps" in step:
+                self.clock += step.get("delay", 0.0)
+                for _ in range(step.get("repeat", 1)):
+                    self._steps(step["steps"], step_path + ".")
+            else:
+                self._packet(step, step_path)
+
+    def _packet(self, step, path):
+        name = step["packet"]
+        if name not in self.crafter.codec:
+            raise ValueError(f"Step {path}: packet {name} not found in definitions")
+        repeat = step.get("repeat", 1)
+        interval = step.get("interval", 0.0)
+        start = self.clock + step.get("delay", 0.0)
+        times = [start + index * interval for index in range(repeat)]
+        self.clock = times[-1] if times else start
+        if not repeat:
+            return
+
+        generators = self.generators.get(path)
+        if generators is None:
+            generators = self.generators[path] = {
+                field: FieldGenerator(spec, self.rng)
+                for field, spec in step.get("fields", {}).items()}
+            self.step_index[path] = len(self.step_names)
+            self.step_names.append(name)
+        columns = {field: generator.take(times) for field, generator in generators.items()}
+        self.chunks.append(self.crafter.codec[name].pack_batch(columns, repeat))
+        self.times.extend(times)
+        self.steps.extend([self.step_index[path]] * repeat)
+
+
+def definitions_path(scenario, directory):
+    """Packet definitions of a scenario, relative to the scenario file's directory"""
+    return os.path.join(directory, scenario.get("definitions", "client2gs.json"))
+
+
+def compile_scenario(path, cache=True):
+    """Compiled schedule for a scenario file, reusing path + ".d2sched" while
+    neither the scenario nor its packet definitions have changed"""
+    with open(path, 'rb') as f:
+        source = f.read()
+    scenario = json.loads(source)
+    directory = os.path.dirname(os.path.abspath(path))
+    definitions = definitions_path(scenario, directory)
+    digest = hashlib.sha256(SCHEDULE_MAGIC + source)
+    with open(definitions, 'rb') as f:
+        digest.update(f.read())
+    key = digest.digest()
+
+    cache_path = path + ".d2sched"
+    name = scenario.get("name", os.path.basename(path))
+    if cache:
+        compiled = CompiledScenario.load(cache_path, key, name)
+        if compiled is not None:
+            return compiled
+    compiled = ScenarioCompiler(scenario, directory).compile()
+    if cache:
+        compiled.save(cache_path, key)
+    return compiled
+
+
+def play(compiled, send, speed=1.0, on_sent=None):
+    """Call send(payload) for every entry on schedule (speed 0 = no waiting)
+
+    Sleeps until shortly before each send and spins for the rest, yielding
+    like the pcap replayer. on_sent(index, scheduled) is called after each send with
+    the perf_counter time it was due. Returns a summary of the send lag.
+    """
+    times = compiled.times
+    bounds = compiled.bounds
+    view = memoryview(compiled.buffer)
+    started = time.perf_counter()
+    worst = 0.0
+    total = 0.0
+    for index in range(len(times)):
+        due = started + times[index] / speed if speed else time.perf_counter()
+        remaining = due - time.perf_counter()
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002)
+        # Yield while spinning instead of holding a core at 100%
+        while time.perf_counter() < due:
+            time.sleep(0)
+        send(view[bounds[index]:bounds[index + 1]])
+        lag = time.perf_counter() - due
+        total += lag
+        if lag > worst:
+            worst = lag
+        if on_sent is not None:
+            on_sent(index, due)
+    count = len(times)
+    return {
+        'sent': count,
+        'elapsed': round(time.perf_counter() - started, 4),
+        'mean_lag_ms': round(total / count * 1000, 3) if count else 0.0,
+        'max_lag_ms': round(worst * 1000, 3),
+    }
+
+
+def tcp_sender(host, port):
+    """(send, close) for a TCP connection with Nagle disabled"""
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock.sendall, sock.close
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and play D2 injection scenarios")
+    parser.add_argument("scenario", help="scenario JSON file")
+    parser.add_argument("--target", metavar="HOST:PORT", help="stream the schedule over TCP")
+    parser.add_argument("--speed", type=float, default=1.0, help="schedule speed factor (0 = max)")
+    parser.add_argument("--show", action="store_true", help="print the compiled schedule")
+    parser.add_argument("--no-cache", action="store_true", help="recompile and do not write the cache")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    compiled = compile_scenario(args.scenario, cache=not args.no_cache)
+    print(f"Scenario {compiled.name}: {len(compiled)} sends over {compiled.duration:.3f}s, "
+          f"{len(compiled.buffer)} bytes (ready in {(time.perf_counter() - started) * 1000:.1f}ms)")
+    if args.show:
+        for at, name, payload in compiled.entries():
+            print(f"  {at:>9.3f}s  {name:<28} {bytes(payload).hex()}")
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        send, close = tcp_sender(host or "127.0.0.1", int(port))
+        try:
+            print(play(compiled, send, args.speed))
+        finally:
+            close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+class MonitorSnapshot:
+    """Immutable, versioned copy of the monitor state for reader threads
+
+    The capture thread builds a new snapshot once per batch of packets and
+    publishes it with a single reference assignment. Readers take the
+    reference once and read every field from that object, so they never
+    lock against packet_handler and never mix values from two updates.
+    """
+    __slots__ = ('version', 'published', 'packets',
+                 'client_x', 'client_y', 'client_stamina_running', 'client_last_update',
+                 'client_packet_count', 'client_recent',
+                 'server_x', 'server_y', 'server_hp', 'server_mp', 'server_stamina',
+                 'server_hp_percent', 'server_last_update', 'server_packet_count',
+                 'server_recent', 'position_error', 'reconciliation', 'latency', 'flows',
+                 'alerts_fired', 'recent_alerts')
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def as_dict(self):
+        """Plain dict of the snapshot for exporters"""
+        return {name: getattr(self, name) for name in self.__slots__}
@@ -0,0 +1,384 @@
+import argparse
+import heapq
+import math
+import random
+import socket
+import struct
+import time
+from d2_packet_codec import HPMPUPDATE_BITS, HPMPUPDATE2_BITS, pack_bits
+from d2_packet_crafter import D2PacketCrafter
+from d2_packet_template import (PacketTemplate, fold, ones_complement_sum,
+                                IP_HEADER_SIZE, TCP_HEADER_SIZE)
+from d2_recorder import DIRECTION_CLIENT, DIRECTION_SERVER
+
+# Movement speeds in tiles per second
+WALK_SPEED = 4.0
+RUN_SPEED = 6.0
+
+# Relative weights of the actions a simulated player picks from
+ACTION_WEIGHTS = (("move", 6), ("skill_burst", 3), ("chat", 1))
+
+CHAT_LINES = ("hi", "tp up", "need help?", "lol", "go", "brb", "nice drop", "gg")
+
+PCAP_GLOBAL_HEADER = struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+ETHER_HEADER = bytes.fromhex("0200000000010200000000020800")
+
+
+class GameSession:
+    """One simulated player producing time-ordered (time, direction, payload) events"""
+
+    def __init__(self, generator, index, start_time, end_time, rng):
+        self.generator = generator
+        self.index = index
+        self.rng = rng
+        self.time = start_time + rng.uniform(0, 1.0)
+        self.end_time = end_time
+        self.guid = 0x10000 + index
+        self.x = rng.randint(4000, 6000)
+        self.y = rng.randint(4000, 6000)
+        self.max_hp = rng.randint(300, 1500)
+        self.max_mp = rng.randint(100, 800)
+        self.hp = self.max_hp
+        self.mp = self.max_mp
+        self.stamina = 4000
+        self.latency = rng.uniform(0.02, 0.15)
+        self.first_ping = self.time + rng.uniform(0, generator.ping_interval)
+
+    def events(self):
+        """Yield this session's events in time order until end_time"""
+        return heapq.merge(self.actions(), self.pings(), key=lambda event: event[0])
+
+    def actions(self):
+        generator = self.generator
+        actions = [name for name, _ in ACTION_WEIGHTS]
+        weights = [weight for _, weight in ACTION_WEIGHTS]
+        # Server replies can land after the next action starts, so events are
+        # held here until no later action can produce anything earlier
+        pending = []
+        while self.time < self.end_time:
+            action = self.rng.choices(actions, weights)[0]
+            for event in getattr(self, action)():
+                heapq.heappush(pending, event)
+            # Idle time between actions, scaled by the requested action rate
+            self.time += self.rng.expovariate(generator.rate)
+            while pending and pending[0][0] <= self.time:
+                event = heapq.heappop(pending)
+                if event[0] < self.end_time:
+                    yield event
+        while pending:
+            event = heapq.heappop(pending)
+            if event[0] < self.end_time:
+                yield event
+
+    def client(self, at, payload):
+        return (at, self.index, DIRECTION_CLIENT, payload)
+
+    def server(self, at, payload):
+        return (at + self.latency, self.index, DIRECTION_SERVER, payload)
+
+    def status(self, at, dx=0, dy=0):
+        """Server HP/MP/stamina bitstream update"""
+        values = {'hp': self.hp, 'mp': self.mp, 'stamina': self.stamina,
+                  'x': self.x, 'y': self.y, 'dx': dx & 0xFF, 'dy': dy & 0xFF,
+                  'hp_regen': 5, 'mp_regen': 3}
+        if self.rng.random() < 0.2:
+            return self.server(at, self.generator.hpmp_update2(values))
+        return self.server(at, self.generator.hpmp_update(values))
+
+    def move(self):
+        generator = self.generator
+        running = self.rng.random() < 0.7 and self.stamina > 100
+        distance = self.rng.uniform(5, 40)
+        angle = self.rng.uniform(0, 2 * math.pi)
+        target_x = max(0, min(0xFFFF, int(self.x + distance * math.cos(angle))))
+        target_y = max(0, min(0xFFFF, int(self.y + distance * math.sin(angle))))
+        speed = RUN_SPEED if running else WALK_SPEED
+        duration = math.hypot(target_x - self.x, target_y - self.y) / speed
+
+        name = "D2GS_RUNTOLOCATION" if running else "D2GS_WALKTOLOCATION"
+        start = self.time
+        events = [self.client(start, generator.client_message(name, nTargetX=target_x,
+                                                               nTargetY=target_y))]
+        events.append(self.server(start, generator.server_message(
+            "D2GS_PLAYERMOVE", nUnitType=0, nUnitGUID=self.guid, nMoveType=0x17 if running else 0x01,
+            nTargetX=target_x, nTargetY=target_y, nUnitHitClass=0, nUnitX=self.x, nUnitY=self.y)))
+
+        # Position/stamina updates along the path
+        origin_x, origin_y = self.x, self.y
+        step = generator.status_interval
+        elapsed = step
+        while elapsed < duration:
+            fraction = elapsed / duration
+            new_x = int(origin_x + (target_x - origin_x) * fraction)
+            new_y = int(origin_y + (target_y - origin_y) * fraction)
+            dx, dy = new_x - self.x, new_y - self.y
+            self.x, self.y = new_x, new_y
+            if running:
+                self.stamina = max(0, self.stamina - 10)
+            events.append(self.status(start + elapsed, dx, dy))
+            elapsed += step
+
+        self.x, self.y = target_x, target_y
+        if not running:
+            self.stamina = min(4000, self.stamina + int(duration * 50))
+        events.append(self.server(start + duration, generator.server_message(
+            "D2GS_PLAYERSTOP", nUnitType=0, nUnitGUID=self.guid, bHitClass=0,
+            nUnitX=self.x, nUnitY=self.y, nUnitHitClass=0,
+            nUnitLife=self.hp * 0x80 // self.max_hp)))
+        self.time = start + duration
+        return events
+
+    def skill_burst(self):
+        generator = self.generator
+        events = []
+        at = self.time
+        skill = self.rng.choice((36, 47, 49, 53, 56, 64))
+        for _ in range(self.rng.randint(3, 12)):
+            target_x = self.x + self.rng.randint(-15, 15)
+            target_y = self.y + self.rng.randint(-15, 15)
+            events.append(self.client(at, generator.client_message(
+                "D2GS_RIGHTSKILLONLOCATION", nTargetX=target_x, nTargetY=target_y)))
+            events.append(self.server(at, generator.server_message(
+                "D2GS_UNITCASTSKILL_XY", nAttackerType=0, nAttackerGUID=self.guid,
+                nSkillID=skill, nSkillLevel=20, nTargetX=target_x, nTargetY=target_y)))
+            self.mp = max(0, self.mp - self.rng.randint(5, 25))
+            self.hp = max(1, self.hp - self.rng.randint(0, 40))
+            events.append(self.status(at))
+            at += self.rng.uniform(0.15, 0.4)
+        self.time = at
+        # Potion and regeneration before the next action
+        self.hp = min(self.max_hp, self.hp + self.max_hp // 4)
+        self.mp = min(self.max_mp, self.mp + self.max_mp // 4)
+        return events
+
+    def chat(self):
+        generator = self.generator
+        message = self.rng.choice(CHAT_LINES)
+        nick = f"player{self.index}"
+        return [self.client(self.time, generator.client_message(
+                    "D2GS_CHAT", nType=1, nLanguageCode=0, szMessage=message)),
+                self.server(self.time, generator.server_message(
+                    "D2GS_CHAT", nChatType=1, nLanguageCode=0, nUnitType=0, nUnitGUID=self.guid,
+                    nChatColor=0, nChatSubType=0, szNick=nick, szMessage=message))]
+
+    def pings(self):
+        """Keep-alive pings every ping_interval, independent of the actions"""
+        generator = self.generator
+        at = self.first_ping
+        while at < self.end_time:
+            tick = int(at * 1000) & 0xFFFFFFFF
+            yield self.client(at, generator.client_message(
+                "D2GS_PING", nTickCount=tick, nDelay=int(self.latency * 1000)))
+            pong = self.server(at, generator.server_message("D2GS_PONG", nTickCount=tick))
+            if pong[0] < self.end_time:
+                yield pong
+            at += generator.ping_interval
+
+
+class TrafficGenerator:
+    """Synthetic two-direction GS sessions built from the JSON definitions
+
+    Every session is a simulated player that walks/runs with matching
+    server PLAYERMOVE/PLAYERSTOP messages, receives HP/MP bitstream updates,
+    casts skill bursts, chats and pings. Sessions are merged into one
+    time-ordered stream that is written as a pcap or sent to a local socket.
+    """
+
+    def __init__(self, sessions=10, duration=60.0, rate=1.0, seed=0, start_time=None,
+                 client_json="client2gs.json", server_json="gs2client.json",
+                 server_ip="10.0.0.1", server_port=4000, status_interval=0.2,
+                 ping_interval=5.0):
+        self.sessions = sessions
+        self.duration = duration
+        self.rate = rate
+        self.seed = seed
+        self.start_time = time.time() if start_time is None else start_time
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.status_interval = status_interval
+        self.ping_interval = ping_interval
+
+        self.client_codec = D2PacketCrafter(client_json).codec
+        self.server_codec = D2PacketCrafter(server_json).codec
+        # Fixed-layout messages are patched into templates instead of re-encoded
+        self.templates = ({}, {})
+
+    def _message(self, direction, packet_name, fields):
+        codec = (self.client_codec, self.server_codec)[direction]
+        templates = self.templates[direction]
+        template = templates.get(packet_name)
+        if template is None and packet_name not in templates:
+            packet = codec[packet_name]
+            fixed = packet.fixed_size is not None and len(packet.segments) == 1
+            template = templates[packet_name] = PacketTemplate(packet) if fixed else None
+        if template is None:
+            return codec[packet_name].encode(fields)
+        return bytes(template.patch(**fields))
+
+    def client_message(self, packet_name, **fields):
+        return self._message(DIRECTION_CLIENT, packet_name, fields)
+
+    def server_message(self, packet_name, **fields):
+        return self._message(DIRECTION_SERVER, packet_name, fields)
+
+    def hpmp_update(self, values):
+        return self.server_message("D2GS_HPMPUPDATE",
+                                   aBitStream=pack_bits(HPMPUPDATE_BITS, values))
+
+    def hpmp_update2(self, values):
+        return self.server_message("D2GS_HPMPUPDATE2",
+                                   aBitStream=pack_bits(HPMPUPDATE2_BITS, values))
+
+    def client_address(self, index):
+        """(ip, port) of the client end of session index
+
+        Hosts count up from 10.1.0.1 across the last two octets, so every
+        session below 65535 has its own address.
+        """
+        host = index + 1
+        return f"10.1.{host >> 8 & 0xFF}.{host & 0xFF}", 50000 + index % 10000
+
+    def events(self):
+        """All sessions merged into one time-ordered stream of
+        (timestamp, session index, direction, payload)"""
+        end_time = self.start_time + self.duration
+        streams = []
+        for index in range(self.sessions):
+            rng = random.Random(self.seed * 1000003 + index)
+            session = GameSession(self, index, self.start_time, end_time, rng)
+            streams.append(session.events())
+        return heapq.merge(*streams, key=lambda event: event[0])
+
+    def frames(self):
+        """Events as (timestamp, Ethernet/IPv4/TCP frame) with per-flow sequence numbers"""
+        flows = {}
+        server = socket.inet_aton(self.server_ip)
+        for timestamp, index, direction, payload in self.events():
+            flow = flows.get(index)
+            if flow is None:
+                client_ip, client_port = self.client_address(index)
+                flow = flows[index] = [socket.inet_aton(client_ip), client_port, 1000, 5000, 0]
+            client, client_port, client_seq, server_seq, ip_id = flow
+            if direction == DIRECTION_CLIENT:
+                frame = tcp_frame(client, server, client_port, self.server_port,
+                                  client_seq, server_seq, ip_id, payload)
+                flow[2] = (client_seq + len(payload)) & 0xFFFFFFFF
+            else:
+                frame = tcp_frame(server, client, self.server_port, client_port,
+                                  server_seq, client_seq, ip_id, payload)
+                flow[3] = (server_seq + len(payload)) & 0xFFFFFFFF
+            flow[4] = (ip_id + 1) & 0xFFFF
+            yield timestamp, frame
+
+    def write_pcap(self, path):
+        """Write every session to a pcap file and return the packet count"""
+        count = 0
+        with open(path, 'wb', buffering=1024 * 1024) as f:
+            f.write(PCAP_GLOBAL_HEADER)
+            for timestamp, frame in self.frames():
+                seconds = int(timestamp)
+                f.write(PCAP_RECORD_HEADER.pack(seconds, int((timestamp - seconds) * 1e6),
+                                                len(frame), len(frame)))
+                f.write(frame)
+                count += 1
+        print(f"Wrote {count} packets from {self.sessions} sessions to {path}")
+        return count
+
+    def stream(self, host="127.0.0.1", port=4000, speed=1.0):
+        """Send payloads as UDP datagrams between local sockets on the event timeline
+
+        Client messages go from one socket per session to host:port and
+        server messages back from a socket bound to host:port, so a monitor
+        sniffing the loopback interface sees both directions. speed scales
+        the timeline; 0 sends as fast as possible.
+        """
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.bind((host, port))
+        clients = {}
+        sent = 0
+        first = None
+        started = time.perf_counter()
+        try:
+            for timestamp, index, direction, payload in self.events():
+                if first is None:
+                    first = timestamp
+                if speed:
+                    delay = started + (timestamp - first) / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                client_socket = clients.get(index)
+                if client_socket is None:
+                    client_socket = clients[index] = socket.socket(socket.AF_INET,
+                                                                   socket.SOCK_DGRAM)
+                    client_socket.bind((host, 0))
+                if direction == DIRECTION_CLIENT:
+                    client_socket.sendto(payload, (host, port))
+                else:
+                    server_socket.sendto(payload, client_socket.getsockname())
+                sent += 1
+        except KeyboardInterrupt:
+            print("\nStreaming stopped by user")
+        finally:
+            for client_socket in clients.values():
+                client_socket.close()
+            server_socket.close()
+        elapsed = time.perf_counter() - started
+        print(f"Sent {sent} packets in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.0f} pkt/s)")
+        return sent
+
+
+def tcp_frame(source, destination, source_port, destination_port, seq, ack, ip_id, payload):
+    """Ethernet + IPv4 + TCP (PSH/ACK) frame with valid checksums"""
+    frame = bytearray(len(ETHER_HEADER) + IP_HEADER_SIZE + TCP_HEADER_SIZE + len(payload))
+    frame[:len(ETHER_HEADER)] = ETHER_HEADER
+    ip_offset = len(ETHER_HEADER)
+    tcp_offset = ip_offset + IP_HEADER_SIZE
+    total_length = len(frame) - ip_offset
+    struct.pack_into('!BBHHHBBH4s4s', frame, ip_offset, 0x45, 0, total_length, ip_id, 0x4000,
+                     64, socket.IPPROTO_TCP, 0, source, destination)
+    struct.pack_into('!H', frame, ip_offset + 10,
+                     ~ones_complement_sum(frame, ip_offset, tcp_offset) & 0xFFFF)
+    struct.pack_into('!HHIIBBHHH', frame, tcp_offset, source_port, destination_port, seq, ack,
+                     TCP_HEADER_SIZE << 2, 0x18, 65535, 0, 0)
+    frame[tcp_offset + TCP_HEADER_SIZE:] = payload
+    pseudo_header = struct.pack('!4s4sBBH', source, destination, 0, socket.IPPROTO_TCP,
+                                total_length - IP_HEADER_SIZE)
+    tcp_sum = fold(ones_complement_sum(pseudo_header) + ones_complement_sum(frame, tcp_offset))
+    struct.pack_into('!H', frame, tcp_offset + 16, ~tcp_sum & 0xFFFF)
+    return frame
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Synthetic D2 game server traffic generator")
+    parser.add_argument("--sessions", type=int, default=10, help="simulated players")
+    parser.add_argument("--duration", type=float, default=60.0, help="session length in seconds")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="player actions per second per session")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (same seed, same traffic)")
+    parser.add_argument("--start", type=float, default=None,
+                        help="capture start as a Unix time (default: now)")
+    parser.add_argument("--pcap", metavar="FILE", help="write the traffic to a pcap file")
+    parser.add_argument("--stream", metavar="HOST:PORT",
+                        help="send the traffic as UDP datagrams on a local socket")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="timeline speed factor when streaming (0 = max)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if not args.pcap and not args.stream:
+        print("Nothing to do: give --pcap FILE and/or --stream HOST:PORT")
+        return
+    generator = TrafficGenerator(args.sessions, args.duration, args.rate, args.seed,
+                                 args.start)
+    if args.pcap:
+        generator.write_pcap(args.pcap)
+    if args.stream:
+        host, _, port = args.stream.rpartition(":")
+        generator.stream(host or "127.0.0.1", int(port), args.speed)
+
+
+if __name__ == "__main__":
+    main()
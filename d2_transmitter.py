@@ -0,0 +1,193 @@
+import argparse
+import ctypes
+import ctypes.util
+import socket
+import struct
+import time
+from d2_packet_crafter import D2PacketCrafter
+from d2_packet_template import open_raw_socket
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """libc sendmmsg(2), or None where it is not available (non-Linux)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+class BatchTransmitter:
+    """Raw-socket sender that flushes batches of IP/TCP frames with sendmmsg
+
+    Frames come from a RawTcpTemplate (incremental checksums, advancing IP id
+    and TCP sequence) and are copied into a preallocated pool of batch_size
+    slots. The mmsghdr/iovec array pointing at those slots is built once, so
+    a flush is a single sendmmsg call for the whole batch. Without sendmmsg
+    the batch falls back to one sendto per frame.
+    """
+
+    def __init__(self, template, sock=None, batch_size=64):
+        self.template = template
+        self.sock = sock if sock is not None else open_raw_socket()
+        self.owns_socket = sock is None
+        self.batch_size = batch_size
+        self.frame_size = len(template.frame)
+        self.pool = bytearray(self.frame_size * batch_size)
+        self.view = memoryview(self.pool)
+        self.pending = 0
+
+        self.packets = 0
+        self.bytes = 0
+        self.syscalls = 0
+        self.started = None
+        self.elapsed = 0.0
+
+        # Raw IPPROTO_RAW sockets only use the address to route the frame
+        self.address = struct.pack('<H', socket.AF_INET) + b'\x00\x00' + \
+            socket.inet_aton(template.target_ip) + bytes(8)
+        self.use_sendmmsg = _sendmmsg is not None
+        if self.use_sendmmsg:
+            self._build_headers()
+
+    def _build_headers(self):
+        self._pool_c = (ctypes.c_char * len(self.pool)).from_buffer(self.pool)
+        self._address_c = ctypes.create_string_buffer(self.address, len(self.address))
+        base = ctypes.addressof(self._pool_c)
+        self._iovecs = (_IoVec * self.batch_size)()
+        self._messages = (_MMsgHdr * self.batch_size)()
+        self._messages_address = ctypes.addressof(self._messages)
+        for index in range(self.batch_size):
+            iovec = self._iovecs[index]
+            iovec.iov_base = base + index * self.frame_size
+            iovec.iov_len = self.frame_size
+            header = self._messages[index].msg_hdr
+            header.msg_name = ctypes.addressof(self._address_c)
+            header.msg_namelen = len(self.address)
+            header.msg_iov = ctypes.pointer(iovec)
+            header.msg_iovlen = 1
+
+    def queue(self, **fields):
+        """Patch the template, copy the frame into the pool and flush when full"""
+        if self.started is None:
+            self.started = time.perf_counter()
+        template = self.template
+        if fields:
+            template.patch(**fields)
+        start = self.pending * self.frame_size
+        self.view[start:start + self.frame_size] = template.frame
+        template.advance()
+        self.pending += 1
+        if self.pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send every queued frame"""
+        count = self.pending
+        if not count:
+            return 0
+        sent = 0
+        try:
+            if self.use_sendmmsg:
+                fd = self.sock.fileno()
+                while sent < count:
+                    result = _sendmmsg(fd, self._messages_address + sent * ctypes.sizeof(_MMsgHdr),
+                                       count - sent, 0)
+                    self.syscalls += 1
+                    if result < 0:
+                        errno = ctypes.get_errno()
+                        raise OSError(errno, f"sendmmsg failed after {sent} of {count} frames")
+                    sent += result
+            else:
+                target = (self.template.target_ip, 0)
+                while sent < count:
+                    start = sent * self.frame_size
+                    self.sock.sendto(self.view[start:start + self.frame_size], target)
+                    self.syscalls += 1
+                    sent += 1
+        finally:
+            # Frames the kernel took before a failure are on the wire, count them
+            self.pending = 0
+            self.packets += sent
+            self.bytes += sent * self.frame_size
+            self.elapsed = time.perf_counter() - self.started
+        return sent
+
+    def send_columns(self, columns):
+        """Queue one frame per row of {field: [values...]} and flush"""
+        names = list(columns)
+        for row in zip(*(columns[name] for name in names)):
+            self.queue(**dict(zip(names, row)))
+        self.flush()
+
+    def stats(self):
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'syscalls': self.syscalls,
+            'seconds': round(self.elapsed, 4),
+            'packets_per_second': round(self.packets / self.elapsed) if self.elapsed else 0,
+            'syscalls_per_packet': round(self.syscalls / self.packets, 4) if self.packets else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        method = "sendmmsg" if self.use_sendmmsg else "sendto"
+        print(f"Sent {stats['packets']} frames ({stats['bytes']} bytes) in {stats['seconds']}s "
+              f"via {method}: {stats['packets_per_second']} packets/s, "
+              f"{stats['syscalls_per_packet']} syscalls/packet")
+
+    def close(self):
+        self.flush()
+        if self.owns_socket:
+            self.sock.close()
+
+
+def main():
+    """Load test: send count movement frames as fast as possible"""
+    parser = argparse.ArgumentParser(description="Batched raw-socket D2 packet transmitter (Linux, root)")
+    parser.add_argument("--target", default="127.0.0.1", help="target IP")
+    parser.add_argument("--port", type=int, default=4000, help="target port")
+    parser.add_argument("--packet", default="D2GS_WALKTOLOCATION", help="packet to send")
+    parser.add_argument("--count", type=int, default=100000, help="frames to send")
+    parser.add_argument("--batch", type=int, default=64, help="frames per sendmmsg call")
+    args = parser.parse_args()
+
+    crafter = D2PacketCrafter()
+    template = crafter.raw_template(args.packet, args.target, args.port)
+    transmitter = BatchTransmitter(template, batch_size=args.batch)
+    try:
+        if args.packet in ("D2GS_WALKTOLOCATION", "D2GS_RUNTOLOCATION"):
+            for index in range(args.count):
+                transmitter.queue(nTargetX=5000 + index % 200, nTargetY=5000 + index // 200 % 200)
+        else:
+            for _ in range(args.count):
+                transmitter.queue()
+    finally:
+        transmitter.close()
+    transmitter.report()
+
+
+if __name__ == "__main__":
+    main()
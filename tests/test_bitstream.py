@@ -0,0 +1,32 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_location_monitor import D2DualLocationMonitor
+from d2_packet_codec import HPMPUPDATE_BITS, HPMPUPDATE2_BITS, WALKVERIFY_BITS, pack_bits
+from d2_traffic_generator import TrafficGenerator
+
+VALUES = {'hp': 1234, 'mp': 567, 'stamina': 4000, 'hp_regen': 5, 'mp_regen': 3,
+          'x': 5123, 'y': 4890, 'dx': 0xFE, 'dy': 2}
+
+
+def test_layouts_fit_the_definitions():
+    # aBitStream[12], aBitStream[14] and aBitStream[8] in gs2client.json
+    assert len(pack_bits(HPMPUPDATE_BITS, VALUES)) == 12
+    assert len(pack_bits(HPMPUPDATE2_BITS, VALUES)) == 14
+    assert len(pack_bits(WALKVERIFY_BITS, VALUES)) == 8
+
+
+def test_monitor_decodes_generated_updates(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    generator = TrafficGenerator(sessions=1, duration=1.0)
+    monitor = D2DualLocationMonitor()
+    expected = (VALUES['hp'], VALUES['mp'], VALUES['stamina'], VALUES['x'], VALUES['y'])
+    for name, payload in (("D2GS_HPMPUPDATE", generator.hpmp_update(VALUES)),
+                          ("D2GS_HPMPUPDATE2", generator.hpmp_update2(VALUES))):
+        assert monitor.parse_server_status_packet(payload, name) == expected
+    walk = b"\x96" + pack_bits(WALKVERIFY_BITS, VALUES)
+    assert monitor.parse_server_status_packet(walk, "D2GS_WALKVERIFY") == \
+        (None, None, VALUES['stamina'], VALUES['x'], VALUES['y'])
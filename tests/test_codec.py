@@ -0,0 +1,59 @@
+import os
+import struct
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_packet_codec import D2PacketCodec
+
+
+@pytest.fixture(scope="module")
+def server_codec():
+    return D2PacketCodec.from_file(os.path.join(ROOT, "gs2client.json"))
+
+
+def test_byte_arrays_follow_their_count(server_codec):
+    # StatBitStream[nFullPacketSize - 2] then Padding[34 - nFullPacketSize]
+    codec = server_codec['D2GS_UPDATEITEMSTATS']
+    stats = bytes(range(1, 9))
+    encoded = codec.encode({'nFullPacketSize': 10, 'StatBitStream': stats})
+    assert len(encoded) == 34
+    decoded = codec.decode(encoded)
+    assert decoded['StatBitStream'] == stats
+    assert decoded['Padding'] == bytes(24)
+
+    # Too long is cut to the count, too short is padded with zeros
+    assert codec.decode(codec.encode({'nFullPacketSize': 4, 'StatBitStream': stats}))['StatBitStream'] == stats[:2]
+    assert codec.decode(codec.encode({'nFullPacketSize': 12, 'StatBitStream': stats}))['StatBitStream'] == \
+        stats + bytes(2)
+
+
+def test_short_byte_array_raises(server_codec):
+    codec = server_codec['D2GS_UPDATEITEMSTATS']
+    encoded = codec.encode({'nFullPacketSize': 10, 'StatBitStream': bytes(8)})
+    with pytest.raises(struct.error):
+        codec.decode(encoded[:20])
+
+
+def test_missing_count_fields_decode(server_codec):
+    # nFullPacketSize defaults to 0, so the arrays are sized as the decoder will read them
+    codec = server_codec['D2GS_UPDATEITEMSTATS']
+    decoded = codec.decode(codec.encode({}))
+    assert decoded['nFullPacketSize'] == 0
+    assert decoded['StatBitStream'] == b''
+    assert decoded['Padding'] == bytes(34)
+
+
+def test_item_arrays_follow_their_count(server_codec):
+    codec = server_codec['D2GS_SKILLSLIST']
+    skills = [{'nSkillId': 54, 'nLevel': 20}]
+    assert codec.decode(codec.encode({'sSkills': skills}))['sSkills'] == skills
+
+    # Short arrays are padded with default records, long ones are refused
+    padded = codec.decode(codec.encode({'nSkillsCount': 2, 'sSkills': skills}))
+    assert padded['sSkills'] == skills + [{'nSkillId': 0, 'nLevel': 0}]
+    with pytest.raises(ValueError, match="sSkills: 2 items given"):
+        codec.encode({'nSkillsCount': 1, 'sSkills': skills * 2})
@@ -0,0 +1,60 @@
+import os
+import struct
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_packet_codec import split_batch
+from d2_packet_crafter import D2PacketCrafter
+
+
+@pytest.fixture
+def crafters(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return {name: D2PacketCrafter(f"{name}.json") for name in ("client2gs", "client2sid", "client2mcps")}
+
+
+def test_sid_size_is_back_patched(crafters):
+    crafter = crafters["client2sid"]
+    payload = crafter.craft_packet("SID_ENTERCHAT", Username="player", Statstring="")
+    # AlwaysFF, PacketId, nSize
+    assert payload[:2] == b'\xff\x0a'
+    assert struct.unpack_from('<H', payload, 2)[0] == len(payload) == 4 + 7 + 1
+    assert crafter.decode_packet(payload) == ("SID_ENTERCHAT", {
+        'AlwaysFF': 0xFF, 'PacketId': 0x0A, 'nSize': 12, 'Username': "player", 'Statstring': ""})
+
+
+def test_mcp_size_is_back_patched(crafters):
+    crafter = crafters["client2mcps"]
+    payload = crafter.craft_packet("MCP_CHARCREATE", Class=1, Flags=0, CharName="abc")
+    # nSize, PacketId
+    assert struct.unpack_from('<H', payload)[0] == len(payload) == 3 + 4 + 2 + 4
+    assert payload[2] == 0x02
+
+    # A given nSize is overwritten with the real length
+    longer = crafter.craft_packet("MCP_CHARCREATE", nSize=1, Class=1, Flags=0, CharName="abcdef")
+    assert struct.unpack_from('<H', longer)[0] == len(longer) == len(payload) + 3
+
+
+def test_batch_matches_single_encodes(crafters):
+    crafter = crafters["client2gs"]
+    xs, ys = [100, 200, 300], [10, 20, 30]
+    buffer, offsets = crafter.craft_batch("D2GS_WALKTOLOCATION", {'nTargetX': xs, 'nTargetY': ys})
+    assert list(offsets) == [0, 5, 10, 15]
+    assert [bytes(view) for view in split_batch(buffer, offsets)] == [
+        crafter.codec.encode("D2GS_WALKTOLOCATION", nTargetX=x, nTargetY=y) for x, y in zip(xs, ys)]
+
+
+def test_variable_batch_matches_single_encodes(crafters):
+    crafter = crafters["client2sid"]
+    names = ["a", "player", "somebody"]
+    buffer, offsets = crafter.craft_batch("SID_ENTERCHAT", {'Username': names, 'Statstring': ""})
+    messages = [bytes(view) for view in split_batch(buffer, offsets)]
+    assert messages == [crafter.codec.encode("SID_ENTERCHAT", Username=name, Statstring="")
+                        for name in names]
+    # Every message carries its own nSize
+    assert [struct.unpack_from('<H', message, 2)[0] for message in messages] == \
+        [len(message) for message in messages]
@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_collector import D2Collector
+from d2_export import StreamExporter
+from d2_query import RecordingSet
+from d2_recorder import DIRECTION_CLIENT, DIRECTION_SERVER
+
+MONITORS = 3
+SESSIONS = 50
+SPEED = 5.0
+
+
+@pytest.fixture(autouse=True)
+def definitions_directory(monkeypatch):
+    # The monitor and collector load the JSON definitions from the working directory
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def collector(tmp_path):
+    """D2Collector serving on a Unix socket from a background event loop"""
+    socket_path = str(tmp_path / "collector.sock")
+    collector = D2Collector(f"unix://{socket_path}", store=str(tmp_path / "store"), view_interval=0.5)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(collector.serve())
+
+    def serve():
+        with contextlib.suppress(asyncio.CancelledError):
+            loop.run_until_complete(task)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        yield collector
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join(5)
+        loop.close()
+
+
+def wait_for_events(collector, count, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while collector.events < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return collector.events
+
+
+def run_monitor(pcap, target, node, results):
+    """Replay pcap through a monitor exporting to target (one process per node)"""
+    from d2_location_monitor import D2DualLocationMonitor
+    from d2_replay import PcapReplayer
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Intervals scaled by SPEED, so batches cover as much capture time as live
+        exporter = StreamExporter(target, node=node, batch_interval=1.0 / SPEED,
+                                  aggregate_interval=10.0 / SPEED)
+        monitor = D2DualLocationMonitor(exporter=exporter)
+        PcapReplayer(monitor, pcap).run(SPEED)
+        monitor.export_state()
+        exporter.close()
+    results.put((node, exporter.stats()))
+
+
+def test_monitors_export_to_one_collector(tmp_path, collector):
+    from d2_traffic_generator import TrafficGenerator
+    pcap = str(tmp_path / "sessions.pcap")
+    with contextlib.redirect_stdout(io.StringIO()):
+        TrafficGenerator(sessions=SESSIONS, duration=30.0, seed=3).write_pcap(pcap)
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=run_monitor,
+                                 args=(pcap, collector.listen, f"node-{index}", results))
+                 for index in range(MONITORS)]
+    for process in processes:
+        process.start()
+    stats = dict(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join(10)
+        assert process.exitcode == 0
+
+    exported = sum(node['events'] for node in stats.values())
+    assert exported > 0
+    assert wait_for_events(collector, exported) == exported
+    for name, node in stats.items():
+        assert node['dropped'] == node['frames_lost'] == node['errors'] == 0
+        assert collector.nodes[name].events == node['events']
+        assert node['bandwidth_ratio'] < 0.05, node
+
+    view = collector.view()
+    assert set(view['nodes']) == set(stats)
+    assert len(view['sessions']) == SESSIONS * MONITORS
+
+    # Every node has its own store, even though all saw the same client addresses
+    for name, node in stats.items():
+        recorder = collector.recorders[name]
+        recorder.flush()
+        recorder.file.flush()
+        with RecordingSet(collector.node_store(name)) as recordings:
+            assert sum(recordings.packet_counts().values()) == node['events']
+            flows = {flow for chunk in recordings.chunks for flow in chunk.flows().tolist()}
+            assert len(flows) == SESSIONS
+
+
+def test_long_payloads_and_time_spans(collector):
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter = StreamExporter(collector.listen, node="edge", batch_interval=0.05)
+    exporter.select(DIRECTION_CLIENT, [0x01])
+    exporter.select(DIRECTION_SERVER, [0x0F])
+    base_ns = 1_700_000_000 * 10**9
+    hour_ns = 3600 * 10**9
+    events = [
+        (base_ns, 1, DIRECTION_CLIENT, b"\x01" + bytes(1400)),       # coalesced segment
+        (base_ns + 2 * hour_ns, 2, DIRECTION_SERVER, b"\x0f" + bytes(15)),
+        (base_ns + 200 * hour_ns, 1, DIRECTION_CLIENT, b"\x01" + bytes(4)),
+    ]
+    for event in events:
+        exporter.event(*event)
+    received = []
+    original = collector.store_events
+
+    def capture(node, body):
+        from d2_export import decode_events
+        received.extend(decode_events(body))
+        original(node, body)
+
+    collector.store_events = capture
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.close()
+    assert wait_for_events(collector, len(events)) == len(events)
+    assert exporter.stats()['errors'] == 0
+    assert [(ts, flow, direction, bytes(payload)) for ts, flow, direction, payload in received] == events
+
+
+def test_malformed_events_frame_drops_the_connection(tmp_path):
+    from d2_export import EVENTS_HEADER, FRAME_EVENTS, FRAME_HELLO, encode_frame
+
+    class Writer:
+        def close(self):
+            self.closed = True
+
+    collector = D2Collector("unix:///unused", store=str(tmp_path / "store"))
+    writer = Writer()
+
+    async def feed():
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_frame(FRAME_HELLO, b'{"node": "bad", "started": 0}'))
+        # Five flows announced, none sent
+        reader.feed_data(encode_frame(FRAME_EVENTS, EVENTS_HEADER.pack(0, 5)))
+        reader.feed_eof()
+        await collector.handle(reader, writer)
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        asyncio.run(feed())
+    assert "Bad frame from bad" in output.getvalue()
+    assert writer.closed
+    assert not collector.nodes["bad"].connected
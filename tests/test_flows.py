@@ -0,0 +1,69 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_flows import FlowTable, pack_flow, unpack_flow
+
+
+def track(table, client, now):
+    return table.track(f"10.0.0.{client}", 50000, "10.0.1.1", 4000, 6, now)
+
+
+def test_pack_flow_round_trip():
+    flow = ("10.1.2.3", 50001, "192.168.0.1", 4000, 6)
+    assert unpack_flow(pack_flow(*flow)) == flow
+
+
+def test_least_recently_seen_flow_is_evicted():
+    evicted = []
+    table = FlowTable(max_flows=3, on_evict=lambda entry, reason: evicted.append((entry.session, reason)))
+    for client in (1, 2, 3):
+        track(table, client, 0.0)
+    # Seeing flow 1 again makes flow 2 the least recently seen one
+    assert track(table, 1, 0.1).packets == 2
+    track(table, 4, 0.2)
+    assert evicted == [("10.0.0.2:50000", "lru")]
+    assert len(table) == 3
+    assert [entry.session for entry in table.flows.values()] == \
+        ["10.0.0.3:50000", "10.0.0.1:50000", "10.0.0.4:50000"]
+    assert table.stats()['evicted_lru'] == 1
+
+    # A returning flow starts over as a new entry
+    assert track(table, 2, 0.3).packets == 1
+    assert table.created == 5
+
+
+def test_idle_flows_are_swept():
+    evicted = []
+    table = FlowTable(idle_timeout=10.0, sweep_interval=1.0,
+                      on_evict=lambda entry, reason: evicted.append((entry.session, reason)))
+    track(table, 1, 0.0)
+    track(table, 2, 5.0)
+    track(table, 3, 9.0)
+    # Swept every second, but nothing has been idle for 10 seconds yet
+    assert len(table) == 3
+
+    track(table, 3, 12.0)
+    assert evicted == [("10.0.0.1:50000", "idle")]
+    track(table, 3, 16.0)
+    assert evicted == [("10.0.0.1:50000", "idle"), ("10.0.0.2:50000", "idle")]
+    assert list(table.flows) == [pack_flow("10.0.0.3", 50000, "10.0.1.1", 4000, 6)]
+    assert table.stats()['evicted_idle'] == 2
+
+
+def test_fin_from_both_sides_and_rst_remove_the_flow():
+    table = FlowTable()
+    entry = track(table, 1, 0.0)
+    table.tcp_flags(entry, 0x01, 0)
+    table.tcp_flags(entry, 0x01, 0)
+    assert entry.key in table
+    table.tcp_flags(entry, 0x11, 1)
+    assert entry.key not in table
+
+    entry = track(table, 2, 0.0)
+    table.tcp_flags(entry, 0x04, 1)
+    assert entry.key not in table
+    stats = table.stats()
+    assert (stats['evicted_fin'], stats['evicted_rst'], stats['flows']) == (1, 1, 0)
@@ -0,0 +1,44 @@
+import os
+import sys
+
+from scapy.layers.inet import IP, TCP
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_packet_codec import D2PacketCodec
+from d2_packet_template import RawTcpTemplate
+
+
+def recomputed(frame):
+    """(IP checksum, TCP checksum) of frame computed from scratch by scapy"""
+    packet = IP(bytes(frame))
+    del packet.chksum
+    del packet[TCP].chksum
+    packet = IP(bytes(packet))
+    return packet.chksum, packet[TCP].chksum
+
+
+def checksums(frame):
+    packet = IP(bytes(frame))
+    return packet.chksum, packet[TCP].chksum
+
+
+def test_incremental_checksums_match_full_recompute():
+    codec = D2PacketCodec.from_file(os.path.join(ROOT, "client2gs.json"))['D2GS_WALKTOLOCATION']
+    template = RawTcpTemplate(codec, "10.0.0.2", 4000, {'nTargetX': 100, 'nTargetY': 200},
+                              source_ip="10.0.0.1", seq=0xFFFFFFF0)
+    assert checksums(template.frame) == recomputed(template.frame)
+
+    # nTargetX and nTargetY start at odd offsets into the TCP segment
+    for x, y in [(101, 200), (0xFFFF, 0), (0, 0xFFFF), (12345, 54321)]:
+        template.patch(nTargetX=x, nTargetY=y)
+        assert checksums(template.frame) == recomputed(template.frame)
+        template.advance()
+        assert checksums(template.frame) == recomputed(template.frame)
+
+    packet = IP(bytes(template.frame))
+    assert packet.id == 4
+    # The sequence number wrapped around
+    assert packet[TCP].seq == (0xFFFFFFF0 + 4 * 5) & 0xFFFFFFFF
+    assert bytes(packet[TCP].payload) == codec.encode({'nTargetX': 12345, 'nTargetY': 54321})
@@ -0,0 +1,63 @@
+import os
+import sys
+
+from scapy.all import RawPcapReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_alerts import Alert, EveryEvent
+from d2_pcap_writer import RotatingPcapWriter
+
+FRAME_SIZE = 100
+# pcap global header + 3 records of FRAME_SIZE bytes
+THREE_FRAMES = 24 + 3 * (16 + FRAME_SIZE)
+
+
+def frame(index):
+    return bytes([index]) * FRAME_SIZE
+
+
+def contents(path):
+    """(timestamp, first byte) of every record in a pcap file"""
+    with RawPcapReader(path) as reader:
+        return [(meta.sec + meta.usec / 1000000, data[0]) for data, meta in reader]
+
+
+def test_rotation_by_size_keeps_the_newest_files(tmp_path):
+    writer = RotatingPcapWriter(str(tmp_path), max_bytes=THREE_FRAMES, max_files=2, flush_interval=0)
+    for index in range(10):
+        assert writer.write(1000.0 + index, frame(index))
+    writer.close()
+
+    assert writer.stats()['written'] == 10
+    assert writer.file_index == 4
+    assert len(writer.files) == 2
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in writer.files)
+    assert [contents(path) for path in writer.files] == [
+        [(1006.0, 6), (1007.0, 7), (1008.0, 8)], [(1009.0, 9)]]
+
+
+def test_rotation_by_capture_time(tmp_path):
+    writer = RotatingPcapWriter(str(tmp_path), max_seconds=2.0, flush_interval=0)
+    for index in range(5):
+        writer.write(1000.0 + index, frame(index))
+    writer.close()
+
+    assert [[index for _, index in contents(path)] for path in writer.files] == [[0, 1], [2, 3], [4]]
+
+
+def test_alert_writes_the_pre_alert_window(tmp_path):
+    writer = RotatingPcapWriter(str(tmp_path), pre_alert=2.0, post_alert=1.0, flush_interval=0)
+    for index in range(6):
+        writer.write(1000.0 + index, frame(index))
+    writer.trigger(Alert(EveryEvent("desync", "desync"), "10.0.0.1:50000", 1005.0, 1.0, "desync"))
+    for index in range(6, 10):
+        writer.write(1000.0 + index, frame(index))
+    writer.close()
+
+    # Frames older than pre_alert are never written; recording stops after post_alert
+    assert writer.stats()['alerts'] == 1
+    assert len(writer.files) == 1
+    assert "_alert_desync_" in os.path.basename(writer.files[0])
+    assert [index for _, index in contents(writer.files[0])] == [3, 4, 5, 6]
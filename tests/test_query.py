@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_packet_codec import D2PacketCodec
+from d2_query import RecordingSet
+from d2_recorder import SessionRecorder, DIRECTION_CLIENT, DIRECTION_SERVER, flow_key
+
+SECOND = 1000000000
+
+
+@pytest.fixture(scope="module")
+def codecs():
+    return (D2PacketCodec.from_file(os.path.join(ROOT, "client2gs.json")),
+            D2PacketCodec.from_file(os.path.join(ROOT, "gs2client.json")))
+
+
+def record_walk(directory, codecs, stop_x):
+    """Walk from (100, 100) to (110, 100) at the default 4 tiles/s, stopping at stop_x"""
+    client, server = codecs
+    flow = flow_key("10.0.0.1", 50000)
+    recorder = SessionRecorder(str(directory), client_codec=client, server_codec=server)
+    recorder.record(0, flow, DIRECTION_CLIENT,
+                    client['D2GS_WALKTOLOCATION'].encode({'nTargetX': 110, 'nTargetY': 100}))
+    recorder.record(SECOND // 20, flow, DIRECTION_SERVER, server['D2GS_PLAYERMOVE'].encode(
+        {'nUnitGUID': 7, 'nUnitX': 100, 'nUnitY': 100, 'nTargetX': 110, 'nTargetY': 100}))
+    recorder.record(SECOND // 20 + SECOND, flow, DIRECTION_SERVER, server['D2GS_PLAYERMOVE'].encode(
+        {'nUnitGUID': 7, 'nUnitX': 104, 'nUnitY': 100, 'nTargetX': 110, 'nTargetY': 100}))
+    recorder.record(SECOND // 20 + 3 * SECOND, flow, DIRECTION_SERVER, server['D2GS_PLAYERSTOP'].encode(
+        {'nUnitGUID': 7, 'nUnitX': stop_x, 'nUnitY': 100}))
+    recorder.close()
+
+
+def test_plain_move_has_no_desync(tmp_path, codecs):
+    record_walk(tmp_path, codecs, stop_x=110)
+    with RecordingSet(str(tmp_path), os.path.join(ROOT, "client2gs.json"),
+                      os.path.join(ROOT, "gs2client.json")) as recordings:
+        timestamps, flows, x, y, distance = recordings.desync()
+        # The first PLAYERMOVE starts the path; both later fixes lie on it
+        assert len(distance) == 2
+        assert distance.max() == pytest.approx(0.0)
+        assert list(x) == [104, 110]
+        assert max(recordings.desync_percentiles(99).values()) == pytest.approx(0.0)
+
+
+def test_stop_off_the_path_is_desync(tmp_path, codecs):
+    record_walk(tmp_path, codecs, stop_x=125)
+    with RecordingSet(str(tmp_path), os.path.join(ROOT, "client2gs.json"),
+                      os.path.join(ROOT, "gs2client.json")) as recordings:
+        _, _, _, _, distance = recordings.desync()
+        assert distance[-1] == pytest.approx(15.0)
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+from scapy.layers.inet import IP, TCP
+from scapy.layers.l2 import Ether
+from scapy.packet import Packet, Raw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_packet_codec import D2PacketCodec
+from d2_recorder import DIRECTION_CLIENT, DIRECTION_SERVER
+from d2_scapy import LINKTYPE_ETHERNET, BulkDissector, D2Message, generate_layers
+
+
+@pytest.fixture(scope="module")
+def layers():
+    # Not bound to the game ports, so other tests keep seeing Raw payloads
+    return generate_layers(ROOT, bind=False)
+
+
+def codec(name):
+    return D2PacketCodec.from_file(os.path.join(ROOT, name))
+
+
+def plain(value):
+    """Scapy field values and LazyMessage dicts in one comparable form"""
+    if isinstance(value, Packet):
+        return {name: plain(field) for name, field in value.fields.items()}
+    if isinstance(value, dict):
+        return {name: plain(field) for name, field in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def scapy_messages(stream, payload):
+    """Message layers scapy stacks on a game payload"""
+    layer = stream(payload)
+    messages = []
+    while isinstance(layer, D2Message):
+        messages.append(layer)
+        layer = layer.payload
+    assert isinstance(layer, Raw) or not layer
+    return messages
+
+
+def compare(layers, stream, sport, dport, payload):
+    frame = Ether() / IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=sport, dport=dport) / Raw(payload)
+    dissector = BulkDissector(layers)
+    packet = dissector.dissect(bytes(frame), LINKTYPE_ETHERNET, 1000.0)
+    messages = scapy_messages(stream, payload)
+
+    assert [type(message) for message in messages] == packet.classes
+    for index, message in enumerate(messages):
+        assert plain(message) == plain(packet.messages[index].to_dict())
+        assert plain(packet.layer(index)) == plain(message)
+        # Rebuilt by scapy, each message gives back its bytes
+        start, end = packet.bounds[index], packet.bounds[index + 1]
+        assert bytes(packet.layer(index)) == payload[start:end]
+    assert packet.bounds[-1] == len(payload)
+    assert dissector.stats()['unframed'] == 0
+    return packet
+
+
+def test_game_messages_match_bulk_dissector(layers):
+    client, server = codec("client2gs.json"), codec("gs2client.json")
+    payload = (client.encode("D2GS_WALKTOLOCATION", nTargetX=100, nTargetY=200) +
+               client.encode("D2GS_RUNTOLOCATION", nTargetX=5, nTargetY=6))
+    packet = compare(layers, layers.streams[("D2GS", DIRECTION_CLIENT)], 50000, 4000, payload)
+    assert packet.direction == DIRECTION_CLIENT
+    assert packet[layers.D2GS_RUNTOLOCATION].nTargetX == 5
+
+    payload = (server.encode("D2GS_PLAYERMOVE", nUnitGUID=7, nUnitX=1, nUnitY=2, nTargetX=3, nTargetY=4) +
+               server.encode("D2GS_SKILLSLIST", nPlayerGUID=9,
+                             sSkills=[{'nSkillId': 1, 'nLevel': 2}, {'nSkillId': 300, 'nLevel': 20}]) +
+               server.encode("D2GS_UPDATEITEMSTATS", nFullPacketSize=6, StatBitStream=b"abcd"))
+    packet = compare(layers, layers.streams[("D2GS", DIRECTION_SERVER)], 4000, 50000, payload)
+    assert [cls.__name__ for cls in packet.classes] == \
+        ["D2GS_PLAYERMOVE", "D2GS_SKILLSLIST", "D2GS_UPDATEITEMSTATS"]
+
+
+def test_realm_messages_match_bulk_dissector(layers):
+    sid, mcp = codec("sid2client.json"), codec("client2mcps.json")
+    payload = (sid.encode("SID_GETCHANNELLIST", Channels=["Diablo II", "Op x"]) +
+               sid.encode("SID_QUERYREALMS2", Unknown=0,
+                          Realms=[{'Unknown': 1, 'Title': "USEast", 'Description': "east"}]))
+    packet = compare(layers, layers.realm[DIRECTION_SERVER], 6112, 50000, payload)
+    assert [cls.__name__ for cls in packet.classes] == ["SID_GETCHANNELLIST_SERVER", "SID_QUERYREALMS2_SERVER"]
+
+    payload = mcp.encode("MCP_CHARCREATE", Class=1, Flags=0, CharName="abc") * 2
+    packet = compare(layers, layers.realm[DIRECTION_CLIENT], 50000, 6112, payload)
+    assert packet[layers.MCP_CHARCREATE].CharName == "abc"
+
+
+def test_scapy_built_message_sets_size(layers):
+    message = layers.SID_ENTERCHAT(Username=b"bob", Statstring=b"x")
+    assert bytes(message) == codec("client2sid.json").encode("SID_ENTERCHAT", Username="bob", Statstring="x")
@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import d2_scenario
+from d2_packet_codec import D2PacketCodec
+from d2_scenario import CompiledScenario, compile_scenario
+
+
+@pytest.fixture
+def scenario(tmp_path):
+    for name in ("bot_sequence.scenario.json", "client2gs.json"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    return str(tmp_path / "bot_sequence.scenario.json")
+
+
+def same(left, right):
+    return (list(left.times) == list(right.times) and bytes(left.buffer) == bytes(right.buffer) and
+            list(left.bounds) == list(right.bounds) and list(left.steps) == list(right.steps) and
+            left.step_names == right.step_names)
+
+
+def test_compiled_schedule(scenario):
+    compiled = compile_scenario(scenario, cache=False)
+    codec = D2PacketCodec.from_file(os.path.join(ROOT, "client2gs.json"))
+    entries = [(at, name, codec.decode(bytes(payload))) for at, name, payload in compiled.entries()]
+    # 1 ping, 4 walks, 1 belt item, then 3 x (1 run, 2 skills)
+    assert len(compiled) == len(entries) == 15
+    assert [name for _, name, _ in entries[:6]] == ["D2GS_PING"] + ["D2GS_WALKTOLOCATION"] * 4 + \
+        ["D2GS_USEBELTITEM"]
+    assert [decoded[1]['nTargetX'] for _, name, decoded in entries if name == "D2GS_WALKTOLOCATION"] == \
+        [100, 200, 300, 400]
+    assert [decoded[1]['nTargetX'] for _, name, decoded in entries if name == "D2GS_RUNTOLOCATION"] == \
+        [400, 450, 500]
+    assert entries[1][0] == pytest.approx(1.0)
+    assert compiled.duration == pytest.approx(entries[-1][0])
+    assert not os.path.exists(scenario + ".d2sched")
+
+
+def test_cache_round_trip(scenario, monkeypatch):
+    compiled = compile_scenario(scenario)
+    assert os.path.exists(scenario + ".d2sched")
+
+    calls = []
+    compile = d2_scenario.ScenarioCompiler.compile
+    monkeypatch.setattr(d2_scenario.ScenarioCompiler, "compile",
+                        lambda self: calls.append(self) or compile(self))
+
+    # Unchanged scenario and definitions: loaded without compiling
+    cached = compile_scenario(scenario)
+    assert calls == []
+    assert same(cached, compiled)
+    assert cached.name == compiled.name == "bot_sequence"
+
+    # Changed definitions invalidate the cache
+    definitions = os.path.join(os.path.dirname(scenario), "client2gs.json")
+    with open(definitions, 'a') as f:
+        f.write("\n")
+    assert same(compile_scenario(scenario), compiled)
+    assert len(calls) == 1
+    assert same(compile_scenario(scenario), compiled)
+    assert len(calls) == 1
+
+
+def test_stale_or_broken_cache_is_ignored(tmp_path):
+    path = str(tmp_path / "schedule.d2sched")
+    assert CompiledScenario.load(path, bytes(32), "missing") is None
+    with open(path, 'wb') as f:
+        f.write(b"D2SCHED1")
+    assert CompiledScenario.load(path, bytes(32), "short") is None
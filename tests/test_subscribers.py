@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+from scapy.layers.inet import IP, TCP
+from scapy.layers.inet6 import IPv6
+from scapy.packet import Raw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_location_monitor import D2DualLocationMonitor
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monitor = D2DualLocationMonitor()
+    errors = []
+    monkeypatch.setattr(monitor, "count_decode_error", errors.append)
+    monitor.decode_errors = errors
+    return monitor
+
+
+def client_packet(payload):
+    packet = IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=50000, dport=4000, flags="PA") / Raw(payload)
+    packet.time = 1000.0
+    return packet
+
+
+def walk(monitor, x, y):
+    return monitor.client_codec.encode("D2GS_WALKTOLOCATION", nTargetX=x, nTargetY=y)
+
+
+def test_builtins_are_subscriptions(monitor):
+    monitor.packet_handler(client_packet(walk(monitor, 120, 130)))
+    assert (monitor.client_x, monitor.client_y) == (120, 130)
+
+    # Unsubscribed, the packet id is not decoded at all
+    monitor.off("D2GS_WALKTOLOCATION", monitor.on_client_movement)
+    packet_id = monitor.client_codec['D2GS_WALKTOLOCATION'].packet_id
+    assert monitor.subscribers[0][packet_id] is None
+    monitor.packet_handler(client_packet(walk(monitor, 1, 2)))
+    assert (monitor.client_x, monitor.client_y) == (120, 130)
+
+
+def test_callback_errors_are_not_decode_errors(monitor):
+    def broken(message, timestamp):
+        return {}["missing"]
+
+    seen = []
+    monitor.on("D2GS_WALKTOLOCATION", broken)
+    monitor.on("D2GS_WALKTOLOCATION", lambda fields, t: seen.append(fields), fields=["nTargetX"])
+    monitor.packet_handler(client_packet(walk(monitor, 7, 8)))
+    assert monitor.subscriber_errors == 1
+    assert monitor.decode_errors == []
+    assert seen == [{'nTargetX': 7}]
+    assert monitor.client_x == 7
+
+
+def test_short_message_is_a_decode_error(monitor):
+    monitor.packet_handler(client_packet(walk(monitor, 7, 8)[:3]))
+    assert len(monitor.decode_errors) == 1
+    assert monitor.subscriber_errors == 0
+    assert (monitor.client_x, monitor.client_y) == (0, 0)
+
+
+def test_non_ipv4_packet_has_no_session(monitor):
+    monitor.packet_handler(client_packet(walk(monitor, 10, 20)))
+    assert list(monitor.reconciler.sessions) == ["10.0.0.1:50000"]
+
+    packet = IPv6(src="fe80::1", dst="fe80::2") / TCP(sport=50001, dport=4000, flags="PA") / Raw(walk(monitor, 30, 40))
+    packet.time = 1001.0
+    monitor.packet_handler(packet)
+    assert monitor.session is None
+    assert monitor.client_x == 30
+    # Not reconciled under the previous packet's session
+    assert monitor.reconciler.sessions["10.0.0.1:50000"].pending[-1][1:3] == (10, 20)
+    assert list(monitor.reconciler.sessions) == ["10.0.0.1:50000"]
@@ -0,0 +1,15 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from d2_traffic_generator import TrafficGenerator
+
+
+def test_sessions_have_their_own_client_address(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    generator = TrafficGenerator(sessions=1)
+    addresses = [generator.client_address(index)[0] for index in range(600)]
+    assert addresses[:2] == ["10.1.0.1", "10.1.0.2"]
+    assert len(set(addresses)) == len(addresses)